@@ -0,0 +1,224 @@
+"""
+Module for storing the results of a run as columnar NumPy arrays with a small
+JSON manifest, instead of pickling pandas objects. A run directory holds
+either one .npy file per array, which is memory-mapped when it is loaded, or
+a single compressed .npz file, which takes far less space when the results
+of many runs are kept.
+"""
+
+import datetime
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from backtesting.data import BarPanel
+from backtesting.event import Direction
+
+MANIFEST = 'manifest.json'
+ARCHIVE = 'arrays.npz'
+VERSION = 1
+DIRECTIONS = [Direction.BUY, Direction.SELL]  # the orders store the index of their direction
+SIMULATION = ['simulation_weights', 'simulation_returns', 'simulation_volatilities', 'simulation_sharpe']
+
+
+def bar_arrays(bars):
+    """
+    Returns the dates and the (fields x dates x symbols) values of the released bars.
+    """
+    panel = getattr(bars, 'panel', None)
+
+    if panel is None:
+        panel = BarPanel.from_frames(bars.latest_symbol_data, bars.symbol_list)
+        panel.cursor = len(panel)
+
+    return panel.fields, {'bar_dates': panel.index.values[:panel.cursor].astype('datetime64[ns]'),
+                          'bar_values': panel.values[:, :panel.cursor]}
+
+
+def order_arrays(history, symbol_list):
+    """
+    Returns the orders of the broker history as columns, sorted by date.
+    """
+    orders = [(order['date'], i, order['qty'], DIRECTIONS.index(order['direction']))
+              for i, symbol in enumerate(symbol_list) for order in history.get(symbol, [])]
+    orders.sort(key=lambda order: (order[0], order[1]))
+
+    return {
+        'order_dates': np.array([pd.Timestamp(order[0]).to_datetime64() for order in orders], dtype='datetime64[ns]'),
+        'order_symbols': np.array([order[1] for order in orders], dtype=np.int32),
+        'order_quantities': np.array([order[2] for order in orders], dtype=np.float64),
+        'order_directions': np.array([order[3] for order in orders], dtype=np.int8),
+    }
+
+
+def write_run(directory, bars, portfolio, broker, simulation=None, compress=False, include_bars=True, metadata=None):
+    """
+    Writes the ledger, the orders and optionally the bars and the Monte
+    Carlo simulation of a finished run, followed by the manifest. If the
+    ledger was opened in the same directory its files are only flushed.
+
+    Parameters:
+    directory - The directory of the run.
+    bars - The DataHandler object of the run.
+    portfolio - The Portfolio object, with its ledger.
+    broker - The ExecutionHandler object, with its order history.
+    simulation - The (weights, returns, volatilities, sharpe ratios) of the simulated portfolios, if any.
+    compress - Whether to write a single compressed .npz file instead of .npy files.
+    include_bars - Whether to store the market data, which is often already on disk.
+    metadata - A JSON serializable dictionary describing the run.
+    """
+    os.makedirs(directory, exist_ok=True)
+    ledger = portfolio.ledger
+    symbol_list = list(bars.symbol_list)
+    arrays = {}
+
+    for name in ledger.array_names:
+        arrays['ledger_' + name] = getattr(ledger, name)[:ledger.size]
+
+    # Already written as the run went, the files only have spare rows at the end
+    on_disk = (not compress and ledger.directory is not None
+               and os.path.abspath(ledger.directory) == os.path.abspath(directory))
+    if on_disk:
+        ledger.flush()
+
+    arrays.update(order_arrays(broker.history, symbol_list))
+
+    fields = None
+    if include_bars:
+        fields, bar_data = bar_arrays(bars)
+        arrays.update(bar_data)
+
+    if simulation is not None:
+        arrays.update(zip(SIMULATION, (np.asarray(values) for values in simulation)))
+
+    if compress:
+        np.savez_compressed(os.path.join(directory, ARCHIVE), **arrays)
+    else:
+        for name, array in arrays.items():
+            if not (on_disk and name.startswith('ledger_')):
+                np.save(os.path.join(directory, name + '.npy'), array)
+
+    manifest = {
+        'version': VERSION,
+        'format': 'npz' if compress else 'npy',
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'symbols': symbol_list,
+        'ledger_columns': ledger.account_columns,
+        'fields': fields,
+        'directions': [str(direction) for direction in DIRECTIONS],
+        'arrays': {name: {'shape': list(array.shape), 'dtype': str(array.dtype)} for name, array in arrays.items()},
+        'metadata': metadata or {},
+    }
+
+    # The manifest is written last, so a directory with a manifest is complete
+    path = os.path.join(directory, MANIFEST)
+    with open(path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+class RunArtifacts(object):
+    """
+    The results of a run written by write_run(). The arrays are only read
+    when they are asked for, and .npy files are memory-mapped, so the
+    DataFrames of a large run do not have to fit in memory.
+    """
+
+    def __init__(self, directory, mmap=True):
+        """
+        Parameters:
+        directory - The directory of the run.
+        mmap - Whether to memory-map the .npy files instead of reading them.
+        """
+        self.directory = directory
+        self.mmap = mmap
+
+        with open(os.path.join(directory, MANIFEST), 'r') as manifest_file:
+            self.manifest = json.load(manifest_file)
+
+        if self.manifest['version'] > VERSION:
+            raise ValueError("The run was written by a newer version: {}".format(self.manifest['version']))
+
+        self.archive = np.load(os.path.join(directory, ARCHIVE)) if self.manifest['format'] == 'npz' else None
+        self.symbols = self.manifest['symbols']
+        self.metadata = self.manifest['metadata']
+
+    def __contains__(self, name):
+        return name in self.manifest['arrays']
+
+    def array(self, name):
+        """
+        Returns an array of the run, read-only when it is memory-mapped.
+        """
+        if self.archive is not None:
+            array = self.archive[name]
+        else:
+            array = np.load(os.path.join(self.directory, name + '.npy'), mmap_mode='r' if self.mmap else None)
+
+        return array[:self.manifest['arrays'][name]['shape'][0]]
+
+    def _ledger_frame(self, name, columns):
+        index = pd.DatetimeIndex(self.array('ledger_datetimes'), name='datetime')
+        return pd.DataFrame(self.array(name), index=index, columns=columns, copy=False)
+
+    def holdings(self):
+        """
+        The market value of every symbol and the account columns at every bar.
+        """
+        return self._ledger_frame('ledger_holdings', self.symbols + self.manifest['ledger_columns'])
+
+    def positions(self):
+        return self._ledger_frame('ledger_positions', self.symbols)
+
+    def cash(self):
+        """
+        The cash of every symbol at every bar, or None if the portfolio does not split its cash.
+        """
+        if 'ledger_cash' not in self:
+            return None
+
+        return self._ledger_frame('ledger_cash', self.symbols)
+
+    def orders(self):
+        """
+        The orders of the run, one row per order.
+        """
+        symbols = np.array(self.symbols, dtype=object)
+        directions = np.array(self.manifest['directions'], dtype=object)
+
+        return pd.DataFrame({
+            'date': self.array('order_dates'),
+            'symbol': symbols[self.array('order_symbols')],
+            'qty': self.array('order_quantities'),
+            'direction': directions[self.array('order_directions')],
+        })
+
+    def bars(self):
+        """
+        The market data of the run as a BarPanel with every bar released, or None if it was not stored.
+        """
+        if 'bar_values' not in self:
+            return None
+
+        panel = BarPanel(pd.DatetimeIndex(self.array('bar_dates'), name='TRADE DATE'), self.array('bar_values'),
+                         self.manifest['fields'], self.symbols)
+        panel.cursor = len(panel)
+        return panel
+
+    def simulation(self):
+        """
+        The (weights, returns, volatilities, sharpe ratios) of the simulated portfolios, if any.
+        """
+        if SIMULATION[0] not in self:
+            return None
+
+        return tuple(self.array(name) for name in SIMULATION)
+
+
+def load_run(directory, mmap=True):
+    """
+    Opens the results of a run written by write_run().
+    """
+    return RunArtifacts(directory, mmap)
@@ -0,0 +1,152 @@
+"""
+Module for caching the parsed symbol CSVs on disk. Each symbol is stored as
+a datetime64 index and a 2-D float array of its numeric columns in NumPy's
+binary format, which can be memory-mapped instead of parsed on later runs.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 1
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    Calculates the SHA-1 digest of a file.
+    """
+    digest = hashlib.sha1()
+
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def get_cache_dir(csv_path):
+    """
+    Returns the cache directory of a symbol CSV, which lives in
+    a hidden folder next to the CSV files.
+    """
+    directory, filename = os.path.split(csv_path)
+    return os.path.join(directory, '.cache', os.path.splitext(filename)[0])
+
+
+def read_meta(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, 'meta.json'), 'r') as meta:
+            return json.load(meta)
+    except (IOError, ValueError):
+        return None
+
+
+def write_meta(cache_dir, meta):
+    """
+    Replaces the metadata file atomically.
+    """
+    temporary = os.path.join(cache_dir, 'meta.json.tmp')
+    with open(temporary, 'w') as output:
+        json.dump(meta, output)
+    os.replace(temporary, os.path.join(cache_dir, 'meta.json'))
+
+
+def is_valid(meta, csv_path, cache_dir):
+    """
+    Checks whether the cached arrays still belong to the CSV. The modification
+    time and size are compared first, and the digest is only calculated when
+    they differ, so touching a file without changing it keeps the cache.
+    """
+    if meta is None or meta.get('version') != CACHE_VERSION:
+        return False
+
+    stat = os.stat(csv_path)
+    if meta['mtime_ns'] == stat.st_mtime_ns and meta['size'] == stat.st_size:
+        return True
+
+    if meta['size'] != stat.st_size or meta['sha1'] != file_digest(csv_path):
+        return False
+
+    meta['mtime_ns'] = stat.st_mtime_ns
+    write_meta(cache_dir, meta)
+    return True
+
+
+def parse_csv(csv_path):
+    """
+    Parses a symbol CSV the way the data handlers expect it.
+    """
+    frame = pd.read_csv(csv_path, header=0, index_col=0)
+    frame.index = pd.to_datetime(frame.index)
+    return frame
+
+
+def write_cache(frame, csv_path, cache_dir):
+    """
+    Writes the numeric columns of the frame to the cache. The metadata is
+    written last, so an interrupted write never looks like a valid cache.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+
+    numeric = frame.select_dtypes(include=[np.number])
+    index = np.asarray(numeric.index.values, dtype='datetime64[ns]')
+    values = np.asfortranarray(numeric.values, dtype=np.float64)
+
+    np.save(os.path.join(cache_dir, 'index.npy'), index)
+    np.save(os.path.join(cache_dir, 'values.npy'), values)
+
+    stat = os.stat(csv_path)
+    meta = {
+        'version': CACHE_VERSION,
+        'columns': [str(column) for column in numeric.columns],
+        'index_name': numeric.index.name,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'sha1': file_digest(csv_path),
+    }
+
+    write_meta(cache_dir, meta)
+    return meta
+
+
+def load_cache(cache_dir, meta):
+    """
+    Memory-maps the cached arrays and wraps them in a DataFrame.
+    """
+    index = np.load(os.path.join(cache_dir, 'index.npy'), mmap_mode='r')
+    values = np.load(os.path.join(cache_dir, 'values.npy'), mmap_mode='r')
+    index = pd.DatetimeIndex(index, name=meta['index_name'])
+    return pd.DataFrame(values, index=index, columns=meta['columns'], copy=False)
+
+
+def symbol_digest(csv_path):
+    """
+    Returns the SHA-1 digest of a symbol CSV, taken from the cache
+    metadata when the file has not changed since it was cached.
+    """
+    cache_dir = get_cache_dir(csv_path)
+    meta = read_meta(cache_dir)
+
+    if is_valid(meta, csv_path, cache_dir):
+        return meta['sha1']
+
+    return file_digest(csv_path)
+
+
+def read_symbol_csv(csv_path):
+    """
+    Reads a symbol CSV through the cache. The CSV is only parsed when the
+    cache is missing or stale. Only the numeric columns are returned.
+    """
+    cache_dir = get_cache_dir(csv_path)
+    meta = read_meta(cache_dir)
+
+    if is_valid(meta, csv_path, cache_dir):
+        return load_cache(cache_dir, meta)
+
+    frame = parse_csv(csv_path)
+    meta = write_cache(frame, csv_path, cache_dir)
+    return load_cache(cache_dir, meta)
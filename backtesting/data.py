@@ -3,13 +3,53 @@ Module for obtaining the market data for the backtesting. Customized for the
 project after learning about event-driven backtesting from QuantStart. See:
 https://www.quantstart.com/articles/Event-Driven-Backtesting-with-Python-Part-III
 """
+import collections
 import datetime
 import os, os.path
+import re
+import sqlite3
+import numpy as np
 import pandas as pd
 
 from abc import ABCMeta, abstractmethod
 
+from backtesting.cache import parse_csv, read_symbol_csv
 from backtesting.event import MarketEvent
+from backtesting.indicators import IndicatorRegistry
+from backtesting.storage import read_symbol_parquet
+
+
+def load_symbol_frames(csv_dir, symbol_list, use_cache=True, storage='csv', columns=None, end_date=None):
+    """
+    Reads the data of every symbol into a DataFrame indexed by date.
+
+    Parameters:
+    csv_dir - The directory of the symbol files.
+    symbol_list - The list of symbols.
+    use_cache - Whether to read the CSVs through the binary cache.
+    storage - The format of the files, 'csv' or 'parquet'.
+    columns - The columns to read, all of them by default.
+    end_date - The last date to read, if any.
+    """
+    if storage == 'parquet':
+        return {symbol: read_symbol_parquet(os.path.join(csv_dir, '%s.parquet' % symbol), columns,
+                                            end_date=end_date)
+                for symbol in symbol_list}
+    if storage != 'csv':
+        raise ValueError("Unknown storage: {}".format(storage))
+
+    read = read_symbol_csv if use_cache else parse_csv
+    frames = {}
+
+    for symbol in symbol_list:
+        frame = read(os.path.join(csv_dir, '%s.csv' % symbol))
+        if columns is not None:
+            frame = frame[list(columns)]
+        if end_date is not None:
+            frame = frame[:pd.to_datetime(end_date)]
+        frames[symbol] = frame
+
+    return frames
 
 
 class DataHandler(object):
@@ -28,6 +68,49 @@ class DataHandler(object):
         """
         raise NotImplementedError("Should implement get_latest_bars()")
 
+    @abstractmethod
+    def get_latest_bar_datetime(self, symbol):
+        """
+        Returns the datetime of the last bar of the symbol.
+        """
+        raise NotImplementedError("Should implement get_latest_bar_datetime()")
+
+    @abstractmethod
+    def get_latest_bar_value(self, symbol, column):
+        """
+        Returns a single column value of the last bar of the symbol.
+        """
+        raise NotImplementedError("Should implement get_latest_bar_value()")
+
+    @abstractmethod
+    def get_bar_column(self, symbol, column):
+        """
+        Returns a column of all the bars released so far as an array.
+        """
+        raise NotImplementedError("Should implement get_bar_column()")
+
+    @abstractmethod
+    def get_latest_closes(self):
+        """
+        Returns the last closing price of every symbol as
+        an array in the order of the symbol list.
+        """
+        raise NotImplementedError("Should implement get_latest_closes()")
+
+    def get_expected_bar_count(self):
+        """
+        Returns the number of bars the backtest will push,
+        or None if it is not known in advance.
+        """
+        return None
+
+    @abstractmethod
+    def get_bar_count(self, symbol):
+        """
+        Returns the number of bars released so far for the symbol.
+        """
+        raise NotImplementedError("Should implement get_bar_count()")
+
     @abstractmethod
     def update_bars(self):
         """
@@ -36,55 +119,525 @@ class DataHandler(object):
         raise NotImplementedError("Should implement update_bars()")
 
 
+class BarStore(object):
+    """
+    Preallocated storage for the bars of a single symbol. All of the bars
+    are kept in one contiguous NumPy array and a cursor marks how many of
+    them have been released to the backtest, so pushing a new bar is a
+    single increment and reading the latest bars never copies any data.
+
+    Only the numeric columns of the source data are kept.
+    """
+
+    def __init__(self, index, values, columns):
+        """
+        Parameters:
+        index - The DatetimeIndex of the bars.
+        values - A 2-D float array with one row per bar.
+        columns - The column names of the values.
+        """
+        self.index = index
+        self.values = values
+        self.columns = list(columns)
+        self.column_index = {column: i for i, column in enumerate(self.columns)}
+        self.cursor = 0
+
+    @classmethod
+    def from_frame(cls, frame):
+        """
+        Creates the store from a DataFrame indexed by datetime.
+        """
+        frame = frame.select_dtypes(include=[np.number])
+        values = np.ascontiguousarray(frame.values, dtype=np.float64)
+        return cls(frame.index, values, frame.columns)
+
+    def __len__(self):
+        return len(self.index)
+
+    def advance(self):
+        """
+        Releases the next bar. Returns False if there are no bars left.
+        """
+        if self.cursor >= len(self):
+            return False
+
+        self.cursor += 1
+        return True
+
+    def latest_values(self, n=1):
+        """
+        Returns a view of the last N released bars as a 2-D array.
+        """
+        start = max(self.cursor - n, 0)
+        return self.values[start:self.cursor]
+
+    def latest_frame(self, n=1):
+        """
+        Wraps the last N released bars in a DataFrame
+        without copying the underlying array.
+        """
+        start = max(self.cursor - n, 0)
+        return pd.DataFrame(self.values[start:self.cursor], index=self.index[start:self.cursor],
+                            columns=self.columns, copy=False)
+
+    def frame(self):
+        """
+        Wraps all of the released bars in a DataFrame.
+        """
+        return self.latest_frame(self.cursor)
+
+    def column(self, name):
+        """
+        Returns a view of a column of the released bars.
+        """
+        return self.values[:self.cursor, self.column_index[name]]
+
+    def latest_value(self, name):
+        return self.values[self.cursor - 1, self.column_index[name]]
+
+    def latest_datetime(self):
+        return self.index[self.cursor - 1]
+
+
+class BarPanel(object):
+    """
+    The bars of a whole universe of symbols aligned on one trading calendar,
+    stored as a (fields x dates x symbols) array. Each field is a contiguous
+    dates x symbols matrix, so a cross-section of every symbol on a date is a
+    contiguous row, and a single cursor releases the bars of all symbols.
+
+    Only the numeric columns of the source data are kept.
+    """
+
+    def __init__(self, index, values, fields, symbols):
+        """
+        Parameters:
+        index - The DatetimeIndex of the calendar.
+        values - A 3-D float array of fields x dates x symbols.
+        fields - The names of the fields.
+        symbols - The list of symbols.
+        """
+        self.index = index
+        self.values = values
+        self.fields = list(fields)
+        self.field_index = {field: i for i, field in enumerate(self.fields)}
+        self.symbols = list(symbols)
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.cursor = 0
+
+    @classmethod
+    def from_frames(cls, frames, symbols):
+        """
+        Aligns the DataFrames of the symbols on the union of their dates.
+        On a date without a bar a symbol repeats its previous bar, and
+        before its first bar all of its fields are NaN.
+        """
+        frames = [frames[symbol].select_dtypes(include=[np.number]) for symbol in symbols]
+        index = frames[0].index
+
+        for frame in frames[1:]:
+            index = index.union(frame.index)
+
+        fields = []
+        for frame in frames:
+            fields.extend(column for column in frame.columns if column not in fields)
+
+        values = np.full((len(fields), len(index), len(symbols)), np.nan)
+
+        for i, frame in enumerate(frames):
+            # The last bar of the symbol on or before every date of the calendar
+            rows = frame.index.searchsorted(index, side='right') - 1
+            valid = rows >= 0
+            data = np.asarray(frame.values, dtype=np.float64)[rows[valid]]
+
+            for column, field in zip(frame.columns, data.T):
+                values[fields.index(column), valid, i] = field
+
+        return cls(index, values, fields, symbols)
+
+    def __len__(self):
+        return len(self.index)
+
+    def slice(self, start, stop):
+        """
+        Returns a panel over a range of the dates, sharing the array.
+        """
+        return BarPanel(self.index[start:stop], self.values[:, start:stop], self.fields, self.symbols)
+
+    def advance(self):
+        """
+        Releases the next bar of every symbol. Returns False if there are no bars left.
+        """
+        if self.cursor >= len(self.index):
+            return False
+
+        self.cursor += 1
+        return True
+
+    def field(self, name):
+        """
+        Returns a view of a field of every bar as a dates x symbols matrix.
+        """
+        return self.values[self.field_index[name]]
+
+    def latest(self, name):
+        """
+        Returns a view of a field of the last released bar of every symbol.
+        """
+        return self.values[self.field_index[name], self.cursor - 1]
+
+    def latest_values(self, symbol, n=1):
+        """
+        Returns a view of the last N released bars of a symbol as a 2-D array.
+        """
+        start = max(self.cursor - n, 0)
+        return self.values[:, start:self.cursor, self.symbol_index[symbol]].T
+
+    def latest_frame(self, symbol, n=1):
+        """
+        Wraps the last N released bars of a symbol in a DataFrame
+        without copying the underlying array.
+        """
+        start = max(self.cursor - n, 0)
+        return pd.DataFrame(self.latest_values(symbol, n), index=self.index[start:self.cursor],
+                            columns=self.fields, copy=False)
+
+    def frame(self, symbol):
+        """
+        Wraps all of the released bars of a symbol in a DataFrame.
+        """
+        return self.latest_frame(symbol, self.cursor)
+
+    def column(self, symbol, name):
+        """
+        Returns a view of a field of the released bars of a symbol.
+        """
+        return self.values[self.field_index[name], :self.cursor, self.symbol_index[symbol]]
+
+    def latest_value(self, symbol, name):
+        return self.values[self.field_index[name], self.cursor - 1, self.symbol_index[symbol]]
+
+    def latest_datetime(self):
+        return self.index[self.cursor - 1]
+
+
+class GrowingBarStore(BarStore):
+    """
+    A BarStore whose bars are appended as they arrive instead of being
+    known in advance. The arrays double in size when they are full, and
+    every appended bar is released at once.
+    """
+
+    index_name = 'TRADE DATE'
+
+    def __init__(self, columns, capacity=256):
+        super(GrowingBarStore, self).__init__(np.empty(capacity, dtype='datetime64[ns]'),
+                                              np.empty((capacity, len(columns))), columns)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, datetime, values):
+        """
+        Appends and releases a bar.
+        """
+        if self.size == len(self.index):
+            self.index = np.resize(self.index, 2 * self.size)
+            self.values = np.resize(self.values, (2 * self.size, self.values.shape[1]))
+
+        self.index[self.size] = datetime
+        self.values[self.size] = values
+        self.size += 1
+        self.cursor = self.size
+
+    def latest_frame(self, n=1):
+        start = max(self.cursor - n, 0)
+        return pd.DataFrame(self.values[start:self.cursor], columns=self.columns, copy=False,
+                            index=pd.DatetimeIndex(self.index[start:self.cursor], name=self.index_name))
+
+    def latest_datetime(self):
+        return pd.Timestamp(self.index[self.cursor - 1])
+
+
 class BistDataHandler(DataHandler):
-    def __init__(self, events, csv_dir, symbol_list, start_date=datetime.date(2015, 12, 1)):
+    def __init__(self, events, csv_dir, symbol_list, start_date=datetime.date(2015, 12, 1), use_cache=True,
+                 frames=None, storage='csv', columns=None, end_date=None, features=None):
+        """
+        Parameters:
+        events - The Event Queue object.
+        csv_dir - The directory of the symbol CSVs, or Parquet files.
+        symbol_list - The list of symbols.
+        start_date - The date of the first bar pushed to the backtest.
+        use_cache - Whether to read the CSVs through the binary cache.
+        frames - Already loaded DataFrames per symbol, to skip reading the files.
+        storage - The format of the symbol files, 'csv' or 'parquet'.
+        columns - The columns to load, all of them by default. The closing price is always loaded.
+        end_date - The date of the last bar pushed to the backtest, if any.
+        features - The FeatureStore to read precomputed indicators from, if any.
+        """
         self.events = events
         self.csv_dir = csv_dir
         self.symbol_list = symbol_list
         self.start_date = start_date
+        self.end_date = end_date
+        self.use_cache = use_cache
+        self.storage = storage
+        self.columns = columns
+
+        if columns is not None and 'CLOSING PRICE' not in columns:
+            self.columns = list(columns) + ['CLOSING PRICE']
 
-        self.symbol_data = {}
-        self.latest_symbol_data = {}
+        self.panel = None
         self.historical_symbol_data = {}
         self.continue_backtest = True
+        self.indicators = IndicatorRegistry(self, features)
+        self.market_event = MarketEvent()  # reused for every bar
 
-        self._read_data()
+        self._read_data(frames)
 
-    def _read_data(self):
-        index = None
+    def _read_data(self, frames=None):
+        if frames is None:
+            frames = load_symbol_frames(self.csv_dir, self.symbol_list, self.use_cache, self.storage, self.columns,
+                                        self.end_date)
 
-        for symbol in self.symbol_list:
-            self.symbol_data[symbol] = pd.read_csv(os.path.join(self.csv_dir, '%s.csv' % symbol), header=0, index_col=0)
-            self.symbol_data[symbol].index = pd.to_datetime(self.symbol_data[symbol].index)
+        panel = BarPanel.from_frames(frames, self.symbol_list)
+        start_date = pd.to_datetime(self.start_date)
+        start = panel.index.searchsorted(start_date, side='left')
+        stop = len(panel)
 
-            if index is None:
-                index = self.symbol_data[symbol].index
-            else:
-                index.union(self.symbol_data[symbol].index)
+        if self.end_date is not None:
+            stop = panel.index.searchsorted(pd.to_datetime(self.end_date), side='right')
 
-            self.latest_symbol_data[symbol] = pd.DataFrame(columns=self.symbol_data[symbol].columns)
+        # The history includes the start date, as slicing the frames by date did
+        history = panel.slice(0, panel.index.searchsorted(start_date, side='right'))
+        history.cursor = len(history)
 
         for symbol in self.symbol_list:
-            data = self.symbol_data[symbol].reindex(index=index, method='pad')
-            self.historical_symbol_data[symbol] = data[:pd.to_datetime(self.start_date)]
-            data = data[pd.to_datetime(self.start_date):]
-            self.symbol_data[symbol] = data.iterrows()
+            self.historical_symbol_data[symbol] = history.frame(symbol)
+
+        self.panel = panel.slice(start, stop)
 
-    def _get_new_bar(self, symbol):
-        for index, bar in self.symbol_data[symbol]:
-            yield bar
+    @property
+    def latest_symbol_data(self):
+        """
+        The bars pushed so far, as a DataFrame per symbol.
+        """
+        return {symbol: self.panel.frame(symbol) for symbol in self.symbol_list}
 
     def get_latest_bars(self, symbol, n=1):
-        return self.latest_symbol_data[symbol].tail(n)
+        return self.panel.latest_frame(symbol, n)
+
+    def get_latest_bar_datetime(self, symbol):
+        return self.panel.latest_datetime()
+
+    def get_latest_bar_value(self, symbol, column):
+        return self.panel.latest_value(symbol, column)
+
+    def get_bar_column(self, symbol, column):
+        return self.panel.column(symbol, column)
+
+    def get_bar_count(self, symbol):
+        return self.panel.cursor
+
+    def get_latest_closes(self):
+        return self.panel.latest('CLOSING PRICE')
+
+    def get_expected_bar_count(self):
+        # Every bar plus the final MarketEvent after the last one
+        return len(self.panel) + 1
 
     def update_bars(self):
+        if not self.panel.advance():
+            self.continue_backtest = False
+
+        self.indicators.update()
+        self.events.put(self.market_event)
+
+
+class SqliteDataHandler(DataHandler):
+    """
+    Streams the bars of a symbol set from the SQLite database written by
+    bist.py. The bars are read through a single cursor ordered by date, in
+    chunks, so only the bars released so far are held in memory. A symbol
+    without a bar on a date repeats its previous bar, as the CSV handler does.
+    """
+
+    def __init__(self, events, db_path, symbol_list, start_date=datetime.date(2015, 12, 1), end_date=None,
+                 columns=('CLOSING PRICE',), table='bist', chunk_size=1024):
+        """
+        Parameters:
+        events - The Event Queue object.
+        db_path - The path of the SQLite database.
+        symbol_list - The list of symbols.
+        start_date - The date of the first bar pushed to the backtest.
+        end_date - The date of the last bar pushed to the backtest, if any.
+        columns - The columns to load. The closing price is always loaded.
+        table - The table of the bars.
+        chunk_size - The number of rows fetched from the cursor at once.
+        """
+        self.events = events
+        self.db_path = db_path
+        self.symbol_list = symbol_list
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbol_list)}
+        self.start_date = start_date
+        self.end_date = end_date
+        self.columns = list(columns) + ([] if 'CLOSING PRICE' in columns else ['CLOSING PRICE'])
+        self.close_index = self.columns.index('CLOSING PRICE')
+        self.table = table
+        self.chunk_size = chunk_size
+
+        self.symbol_data = {symbol: GrowingBarStore(self.columns) for symbol in self.symbol_list}
+        self.historical_symbol_data = {}
+        self.continue_backtest = True
+        self.indicators = IndicatorRegistry(self)
+        self.market_event = MarketEvent()  # reused for every bar
+        self.latest_closes = np.full(len(self.symbol_list), np.nan)
+
+        self.connection = sqlite3.connect(db_path)
+        self.cursor = None
+        self.pending = collections.deque()
+        self.bar_count = None
+        self.latest_rows = np.full((len(self.symbol_list), len(self.columns)), np.nan)
+
+        self._read_history()
+        self._open_cursor()
+
+    @staticmethod
+    def _db_column(column):
+        # Same renaming as bist.alter_column_names()
+        return re.sub('[^a-zA-Z0-9 ]', '', column).replace(' ', '_')
+
+    def _query(self, date_filter):
+        columns = ', '.join('"{}"'.format(self._db_column(column)) for column in self.columns)
+        symbols = ', '.join('?' * len(self.symbol_list))
+        return ("select TRADE_DATE, INSTRUMENT_SERIES_CODE, {} from '{}' where INSTRUMENT_SERIES_CODE in ({}) "
+                "and {} order by TRADE_DATE".format(columns, self.table, symbols, date_filter))
+
+    def _read_history(self):
+        """
+        Reads the bars up to and including the start date at once, for
+        the portfolios that optimize on the historical data. The history
+        includes the start date and is aligned on the union of the dates
+        of the symbols, as in BistDataHandler. The last bar of every symbol
+        is also repeated until its first bar after the start date.
+        """
+        query = self._query('TRADE_DATE <= ?')
+        rows = pd.read_sql_query(query, self.connection, params=list(self.symbol_list) + [str(self.start_date)],
+                                 parse_dates=['TRADE_DATE'])
+        rows.columns = ['TRADE DATE', 'INSTRUMENT SERIES CODE'] + self.columns
+        rows[self.columns] = rows[self.columns].astype(np.float64)
+
+        frames = {symbol: data.set_index('TRADE DATE')[self.columns]
+                  for symbol, data in rows.groupby('INSTRUMENT SERIES CODE')}
+        frames = {symbol: frames.get(symbol, rows.iloc[:0].set_index('TRADE DATE')[self.columns])
+                  for symbol in self.symbol_list}
+
+        history = BarPanel.from_frames(frames, self.symbol_list)
+        history.cursor = len(history)
+
         for symbol in self.symbol_list:
-            try:
-                bar = self._get_new_bar(symbol).__next__()
-            except StopIteration:
-                self.continue_backtest = False
-            else:
-                if bar is not None:
-                    self.latest_symbol_data[symbol] = self.latest_symbol_data[symbol].append(bar)
-
-        self.events.put(MarketEvent())
+            self.historical_symbol_data[symbol] = history.frame(symbol)
+
+        if len(history):
+            self.latest_rows[:] = np.column_stack([history.latest(column) for column in self.columns])
+
+    def _date_filter(self):
+        if self.end_date is None:
+            return 'TRADE_DATE >= ?', [str(self.start_date)]
+        return 'TRADE_DATE >= ? and TRADE_DATE <= ?', [str(self.start_date), str(self.end_date)]
+
+    def _open_cursor(self):
+        date_filter, params = self._date_filter()
+        self.cursor = self.connection.execute(self._query(date_filter), list(self.symbol_list) + params)
+
+    def _fetch(self):
+        """
+        Refills the pending rows from the cursor. Returns False
+        once the cursor is exhausted.
+        """
+        if self.cursor is None:
+            return False
+
+        rows = self.cursor.fetchmany(self.chunk_size)
+        if not rows:
+            self.cursor.close()
+            self.cursor = None
+            return False
+
+        self.pending.extend(rows)
+        return True
+
+    def _next_date(self):
+        """
+        Pops the rows of the next date, or returns None if there are none.
+        """
+        if not self.pending and not self._fetch():
+            return None
+
+        date = self.pending[0][0]
+        rows = []
+
+        while True:
+            while self.pending and self.pending[0][0] == date:
+                rows.append(self.pending.popleft())
+
+            if self.pending or not self._fetch():
+                return date, rows
+
+    @property
+    def latest_symbol_data(self):
+        """
+        The bars pushed so far, as a DataFrame per symbol.
+        """
+        return {symbol: self.symbol_data[symbol].frame() for symbol in self.symbol_list}
+
+    def get_latest_bars(self, symbol, n=1):
+        return self.symbol_data[symbol].latest_frame(n)
+
+    def get_latest_bar_datetime(self, symbol):
+        return self.symbol_data[symbol].latest_datetime()
+
+    def get_latest_bar_value(self, symbol, column):
+        return self.symbol_data[symbol].latest_value(column)
+
+    def get_bar_column(self, symbol, column):
+        return self.symbol_data[symbol].column(column)
+
+    def get_bar_count(self, symbol):
+        return self.symbol_data[symbol].cursor
+
+    def get_latest_closes(self):
+        return self.latest_closes
+
+    def get_expected_bar_count(self):
+        if self.bar_count is None:
+            date_filter, params = self._date_filter()
+            symbols = ', '.join('?' * len(self.symbol_list))
+            query = "select count(distinct TRADE_DATE) from '{}' where INSTRUMENT_SERIES_CODE in ({}) and {}".format(
+                self.table, symbols, date_filter)
+            self.bar_count = self.connection.execute(query, list(self.symbol_list) + params).fetchone()[0]
+
+        # Every bar plus the final MarketEvent after the last one
+        return self.bar_count + 1
+
+    def update_bars(self):
+        bars = self._next_date()
+
+        if bars is None:
+            self.continue_backtest = False
+        else:
+            date, rows = bars
+
+            for row in rows:
+                self.latest_rows[self.symbol_index[row[1]]] = row[2:]
+
+            timestamp = np.datetime64(date, 'ns')
+
+            for i, symbol in enumerate(self.symbol_list):
+                self.symbol_data[symbol].append(timestamp, self.latest_rows[i])
+
+            self.latest_closes[:] = self.latest_rows[:, self.close_index]
+
+        self.indicators.update()
+        self.events.put(self.market_event)
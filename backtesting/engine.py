@@ -0,0 +1,106 @@
+"""
+Module for running the event loop of a backtest. Replaces the loop that was
+copied between scripts, which polled a thread-safe queue.Queue and branched
+on the type string of every event, with a single-threaded deque and a
+registry of handlers per event class.
+"""
+
+from collections import deque
+
+from backtesting.event import MarketEvent, SignalEvent, OrderEvent, FillEvent
+
+
+class EventQueue(deque):
+    """
+    Queue of the events of a single backtest. Components keep adding events
+    with put(), but without the locking of queue.Queue, and the engine
+    drains it without relying on queue.Empty exceptions.
+    """
+
+    def put(self, event):
+        self.append(event)
+
+
+class Backtest(object):
+    """
+    Drives a backtest bar by bar. For every bar the data handler pushes the
+    new market data, and then all of the events it causes are dispatched to
+    the handlers registered for their class until the queue is empty.
+    """
+
+    def __init__(self, bars, events, strategy=None, portfolio=None, broker=None, instrumentation=None):
+        """
+        Registers the usual handlers of the given components, in the
+        order the event loop has always called them.
+
+        Parameters:
+        bars - The DataHandler object with the market data.
+        events - The EventQueue shared by the components.
+        strategy - The Strategy object generating signals.
+        portfolio - The Portfolio object generating orders.
+        broker - The ExecutionHandler object filling orders.
+        instrumentation - An optional Instrumentation object that runs
+                          the loop and measures where the time goes.
+        """
+        self.bars = bars
+        self.events = events
+        self.strategy = strategy
+        self.portfolio = portfolio
+        self.broker = broker
+        self.instrumentation = instrumentation
+
+        self.handlers = {}
+        self.before_bar = []  # hooks called with the engine before each bar
+        self.after_bar = []  # hooks called with the engine after each bar's events
+        self.bar_count = 0
+
+        if strategy is not None:
+            self.register(MarketEvent, strategy.calculate_signals)
+        if portfolio is not None:
+            self.register(MarketEvent, portfolio.update_time_index)
+            self.register(SignalEvent, portfolio.update_signal)
+            self.register(FillEvent, portfolio.update_fill)
+        if broker is not None:
+            self.register(OrderEvent, broker.execute_order)
+
+    def register(self, event_class, handler):
+        """
+        Calls the handler with every event of the class, after
+        the handlers that have been registered before it.
+        """
+        self.handlers.setdefault(event_class, []).append(handler)
+
+    def dispatch(self):
+        """
+        Dispatches the queued events, including the ones
+        added by the handlers, until the queue is empty.
+        """
+        events = self.events
+        handlers = self.handlers
+
+        while events:
+            event = events.popleft()
+
+            if event is not None:
+                for handler in handlers.get(event.__class__, ()):
+                    handler(event)
+
+    def run(self):
+        """
+        Runs the backtest until the data handler runs out of bars.
+        """
+        if self.instrumentation is not None:
+            return self.instrumentation.run(self)
+
+        while self.bars.continue_backtest:
+            for hook in self.before_bar:
+                hook(self)
+
+            self.bars.update_bars()
+            self.dispatch()
+            self.bar_count += 1
+
+            for hook in self.after_bar:
+                hook(self)
+
+        return self.portfolio
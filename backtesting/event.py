@@ -2,23 +2,63 @@
 Module for trading events which drive the backtesting. Customized for the
 project after learning about event-driven backtesting from QuantStart. See:
 https://www.quantstart.com/articles/Event-Driven-Backtesting-with-Python-Part-II
+
+The events are allocated for every bar and trade, so they use __slots__
+instead of a per-instance __dict__, and their types are enums. The enums
+are also strings, so comparing them with the old string values still works.
 """
 
+from enum import Enum
+
+
+class StringEnum(str, Enum):
+    """
+    Enum whose members are strings and print as their values.
+    """
+
+    def __str__(self):
+        return self.value
+
+    def __format__(self, format_spec):
+        return format(self.value, format_spec)
+
+
+class EventType(StringEnum):
+    MARKET = 'MARKET'
+    SIGNAL = 'SIGNAL'
+    ORDER = 'ORDER'
+    FILL = 'FILL'
+
+
+class SignalType(StringEnum):
+    LONG = 'LONG'
+    SHORT = 'SHORT'
+    EXIT = 'EXIT'
+
+
+class Direction(StringEnum):
+    BUY = 'BUY'
+    SELL = 'SELL'
+
 
 class Event(object):
     """
     Base class for all of the events.
     """
-    pass
+    __slots__ = ()
 
 
 class MarketEvent(Event):
     """
     Triggered by DataHandler when there
     is an update in the market data.
+
+    It carries no data, so a data handler
+    can reuse a single instance for every bar.
     """
-    def __init__(self):
-        self.type = 'MARKET'
+    __slots__ = ()
+
+    type = EventType.MARKET
 
 
 class SignalEvent(Event):
@@ -26,11 +66,14 @@ class SignalEvent(Event):
     Triggered when a new signal has been generated
     by Strategy after it evaluates the market data.
     """
+    __slots__ = ('symbol', 'datetime', 'signal_type')
+
+    type = EventType.SIGNAL
+
     def __init__(self, symbol, datetime, signal_type):
-        self.type = 'SIGNAL'
         self.symbol = symbol
         self.datetime = datetime
-        self.signal_type = signal_type
+        self.signal_type = SignalType(signal_type)
 
     def __str__(self):
         template = "Signal: Symbol={}, Type={}, Date={}"
@@ -42,12 +85,15 @@ class OrderEvent(Event):
     Triggered by Portfolio after it assesses signals,
     for sending the order to an execution system.
     """
+    __slots__ = ('symbol', 'order_type', 'quantity', 'direction', 'datetime')
+
+    type = EventType.ORDER
+
     def __init__(self, symbol, order_type, quantity, direction, datetime):
-        self.type = 'ORDER'
         self.symbol = symbol
         self.order_type = order_type
         self.quantity = quantity
-        self.direction = direction
+        self.direction = Direction(direction)
         self.datetime = datetime
 
     def __str__(self):
@@ -60,13 +106,16 @@ class FillEvent(Event):
     Represents a filled order which has been returned from a brokerage
     and contains information about the actual cost of the order.
     """
+    __slots__ = ('time_index', 'symbol', 'exchange', 'quantity', 'direction', 'fill_cost', 'commission')
+
+    type = EventType.FILL
+
     def __init__(self, time_index, symbol, exchange, quantity, direction, fill_cost, commission=None):
-        self.type = 'FILL'
         self.time_index = time_index
         self.symbol = symbol
         self.exchange = exchange
         self.quantity = quantity
-        self.direction = direction
+        self.direction = Direction(direction)
         self.fill_cost = fill_cost
 
         if commission is None:
@@ -8,7 +8,7 @@ import datetime
 
 from abc import ABCMeta, abstractmethod
 
-from backtesting.event import FillEvent
+from backtesting.event import FillEvent, EventType
 
 
 class ExecutionHandler(object):
@@ -68,7 +68,7 @@ class SimulatedExecutionHandler(ExecutionHandler):
         Parameters:
         event - Contains an Event object with order information.
         """
-        if event.type == 'ORDER':
+        if event.type == EventType.ORDER:
             date = datetime.datetime.utcnow()
             self.history[event.symbol].append({'date': event.datetime, 'qty': event.quantity,
                                                'direction': event.direction})
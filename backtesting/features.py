@@ -0,0 +1,242 @@
+"""
+Module for precomputing indicators of every symbol once and keeping them on
+disk, next to the symbol files, instead of recomputing them in every run.
+Each symbol is stored as its dates and a (bars x features) array in NumPy's
+binary format, which is memory-mapped when it is read. When new days are
+appended to a symbol file only the new bars are computed.
+
+The features are computed on the trading days of the symbol itself, over
+its whole history, with the same partial windows at its first bars as the
+indicators of the data handlers. The moving averages are computed over the
+whole history even when only new bars are stored, which costs little with
+NumPy and keeps them identical to a full rebuild.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from backtesting.cache import read_meta, write_meta
+from backtesting.data import load_symbol_frames
+from backtesting.indicators import rolling_mean
+
+FEATURE_VERSION = 2
+SMA_WINDOWS = (10, 20, 30, 40, 50, 60, 100, 150, 200)
+VOLATILITY_WINDOWS = (20, 60)
+
+
+def rolling_windows(values, window, start=0):
+    """
+    Returns a view of the last N values at every position from the start,
+    padded with NaNs before the first value.
+    """
+    padded = np.concatenate((np.full(window - 1, np.nan), values))
+    return sliding_window_view(padded, window)[start:]
+
+
+def window_std(values, window, start=0):
+    """
+    Calculates the sample standard deviation of the last N values at every
+    position from the start, skipping NaNs, once there are at least two.
+    Every window is summed on its own, so the result does not depend on
+    where the calculation starts.
+    """
+    windows = rolling_windows(values, window, start)
+    counts = (~np.isnan(windows)).sum(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.nansum(windows, axis=1) / counts
+        squares = np.nansum((windows - means[:, None]) ** 2, axis=1)
+        return np.where(counts > 1, np.sqrt(squares / (counts - 1)), np.nan)
+
+
+def exponential_mean(values, window, previous=None):
+    """
+    Calculates the exponential moving average with a span of N values,
+    skipping NaNs. Given the average before the first value, the result is
+    identical to continuing the calculation over the earlier values.
+    """
+    if previous is not None:
+        values = np.concatenate(([previous], values))
+
+    means = pd.Series(values).ewm(span=window, adjust=False, ignore_na=True).mean().values
+    return means[1:] if previous is not None else means
+
+
+class FeatureStore(object):
+    """
+    Keeps the close, the returns, simple and exponential moving averages
+    and the rolling volatility of the returns of every symbol in a hidden
+    .features folder of the data directory. The features of a symbol are
+    brought up to date whenever its file changed since they were computed.
+    """
+
+    def __init__(self, data_dir, windows=SMA_WINDOWS, volatility_windows=VOLATILITY_WINDOWS, storage='csv',
+                 column='CLOSING PRICE'):
+        """
+        Parameters:
+        data_dir - The directory of the symbol files.
+        windows - The windows of the simple and exponential moving averages.
+        volatility_windows - The windows of the volatility of the returns.
+        storage - The format of the symbol files, 'csv' or 'parquet'.
+        column - The price column the features are computed from.
+        """
+        self.data_dir = data_dir
+        self.windows = tuple(windows)
+        self.volatility_windows = tuple(volatility_windows)
+        self.storage = storage
+        self.column = column
+
+        self.features = (['close', 'returns'] + ['sma_%d' % window for window in self.windows] +
+                         ['ema_%d' % window for window in self.windows] +
+                         ['volatility_%d' % window for window in self.volatility_windows])
+        self.feature_index = {feature: i for i, feature in enumerate(self.features)}
+        self.loaded = {}
+
+    def path(self, symbol):
+        return os.path.join(self.data_dir, '.features', symbol)
+
+    def source_path(self, symbol):
+        return os.path.join(self.data_dir, '%s.%s' % (symbol, self.storage))
+
+    def symbols(self):
+        """
+        Returns the symbols that have a file in the data directory.
+        """
+        extension = '.' + self.storage
+        return sorted(name[:-len(extension)] for name in os.listdir(self.data_dir) if name.endswith(extension))
+
+    def has(self, feature):
+        return feature in self.feature_index
+
+    def compute(self, closes, start=0, previous=None):
+        """
+        Computes the features of the bars from the start.
+
+        Parameters:
+        closes - The closing prices of every bar of the symbol.
+        start - The first bar to compute.
+        previous - The stored features of the bar before the start, if any.
+        """
+        returns = np.full(len(closes), np.nan)
+        returns[1:] = closes[1:] / closes[:-1] - 1.0
+
+        columns = [closes[start:], returns[start:]]
+        columns.extend(rolling_mean(closes, window)[start:] for window in self.windows)
+        columns.extend(exponential_mean(closes[start:], window,
+                                        None if previous is None else previous[self.feature_index['ema_%d' % window]])
+                       for window in self.windows)
+        columns.extend(window_std(returns, window, start) for window in self.volatility_windows)
+
+        return np.column_stack(columns)
+
+    def _read_source(self, symbol):
+        frame = load_symbol_frames(self.data_dir, [symbol], storage=self.storage, columns=[self.column])[symbol]
+        return np.asarray(frame.index.values, dtype='datetime64[ns]'), np.asarray(frame[self.column], dtype=np.float64)
+
+    def _is_compatible(self, meta):
+        return (meta is not None and meta.get('version') == FEATURE_VERSION and meta.get('features') == self.features
+                and meta.get('column') == self.column)
+
+    def _is_current(self, meta, symbol):
+        if not self._is_compatible(meta):
+            return False
+
+        stat = os.stat(self.source_path(symbol))
+        return meta['mtime_ns'] == stat.st_mtime_ns and meta['size'] == stat.st_size
+
+    def update(self, symbol):
+        """
+        Brings the features of a symbol up to date with its file. If the
+        stored bars are still the first bars of the file, only the bars
+        after them are computed, otherwise everything is recomputed.
+        Returns the number of computed bars.
+        """
+        directory = self.path(symbol)
+        meta = read_meta(directory)
+
+        if self._is_current(meta, symbol):
+            return 0
+
+        index, closes = self._read_source(symbol)
+        start, stored = 0, None
+
+        if self._is_compatible(meta):
+            stored_index, stored = self._load_arrays(directory)
+            start = len(stored_index)
+
+            # Appended days keep the stored bars, anything else is a new history
+            if (start > len(index) or not np.array_equal(stored_index, index[:start])
+                    or not np.array_equal(stored[:, 0], closes[:start], equal_nan=True)):
+                start, stored = 0, None
+
+        if stored is None or start == 0:
+            values = self.compute(closes)
+        else:
+            values = np.concatenate((stored, self.compute(closes, start, stored[-1])))
+
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'index.npy'), index)
+        np.save(os.path.join(directory, 'values.npy'), values)
+
+        stat = os.stat(self.source_path(symbol))
+        write_meta(directory, {'version': FEATURE_VERSION, 'features': self.features, 'column': self.column,
+                               'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size})
+
+        self.loaded.pop(symbol, None)
+        return len(index) - start
+
+    def update_all(self, symbols):
+        """
+        Brings the features of the symbols up to date and returns the number of computed bars.
+        """
+        return sum(self.update(symbol) for symbol in symbols)
+
+    @staticmethod
+    def _load_arrays(directory):
+        return (np.load(os.path.join(directory, 'index.npy'), mmap_mode='r'),
+                np.load(os.path.join(directory, 'values.npy'), mmap_mode='r'))
+
+    def load(self, symbol):
+        """
+        Returns the memory-mapped dates and (bars x features) values of a symbol, updated first if needed.
+        """
+        if symbol not in self.loaded:
+            self.update(symbol)
+            self.loaded[symbol] = self._load_arrays(self.path(symbol))
+
+        return self.loaded[symbol]
+
+    def value(self, symbol, feature, bar):
+        """
+        Returns a feature of a symbol at a bar index of its file.
+        """
+        return self.load(symbol)[1][bar, self.feature_index[feature]]
+
+    def frame(self, symbol):
+        """
+        Wraps the features of a symbol in a DataFrame indexed by date, without copying.
+        """
+        index, values = self.load(symbol)
+        return pd.DataFrame(values, index=pd.DatetimeIndex(index, name='TRADE DATE'), columns=self.features,
+                            copy=False)
+
+    def panel_matrix(self, feature, panel):
+        """
+        Returns a feature of every symbol of a BarPanel on its calendar, as
+        a dates x symbols matrix. On a date without a bar a symbol has its
+        feature at its previous bar, as the panel repeats its previous bar.
+        """
+        matrix = np.full((len(panel), len(panel.symbols)), np.nan)
+        dates = panel.index.values.astype('datetime64[ns]')
+        column = self.feature_index[feature]
+
+        for i, symbol in enumerate(panel.symbols):
+            index, values = self.load(symbol)
+            rows = index.searchsorted(dates, side='right') - 1
+            valid = rows >= 0
+            matrix[valid, i] = values[rows[valid], column]
+
+        return matrix
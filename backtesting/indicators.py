@@ -0,0 +1,239 @@
+"""
+Module for indicators that are updated incrementally as the data handler
+pushes new bars, so that strategies do not have to recompute them from the
+latest bars on every MarketEvent.
+"""
+
+import numpy as np
+
+
+def rolling_mean(values, window):
+    """
+    Calculates the mean of the last N values at every bar, of a column or
+    of every column of a dates x symbols matrix at once. While fewer than N
+    values are available, the mean of all of them is used, just like taking
+    the mean of get_latest_bars(symbol, N). NaNs are skipped as pandas does.
+    The value of a bar only depends on the bars up to it, so the means of a
+    whole panel can be calculated before the bars are released.
+
+    Parameters:
+    values - A 1-D array of prices, or a 2-D array with one column per symbol.
+    window - The number of values in the window.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    padding = np.zeros((1,) + values.shape[1:])
+    sums = np.concatenate((padding, np.cumsum(np.where(valid, values, 0.0), axis=0)))
+    counts = np.concatenate((padding, np.cumsum(valid, axis=0)))
+    end = np.arange(1, len(values) + 1)
+    start = np.maximum(end - window, 0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (sums[end] - sums[start]) / (counts[end] - counts[start])
+
+
+class RollingMean(object):
+    """
+    Mean of the last N values of a column, updated in O(1) per bar by adding
+    the entering value and subtracting the leaving one. The running sum is
+    compensated (Kahan-Babuska) so that long backtests do not drift. While
+    fewer than N bars are available the mean of all of them is used, and
+    NaNs are skipped, the same as get_latest_bars(symbol, N).mean().
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.cursor = 0
+        self.count = 0
+        self.total = 0.0
+        self.compensation = 0.0
+
+    def _add(self, value):
+        total = self.total + value
+
+        if abs(self.total) >= abs(value):
+            self.compensation += (self.total - total) + value
+        else:
+            self.compensation += (value - total) + self.total
+
+        self.total = total
+
+    def update(self, values, cursor):
+        """
+        Catches up with the bars released so far.
+
+        Parameters:
+        values - The column of the released bars.
+        cursor - The number of released bars.
+        """
+        while self.cursor < cursor:
+            entering = values[self.cursor]
+            if entering == entering:
+                self._add(entering)
+                self.count += 1
+
+            leaving_index = self.cursor - self.window
+            if leaving_index >= 0:
+                leaving = values[leaving_index]
+                if leaving == leaving:
+                    self._add(-leaving)
+                    self.count -= 1
+
+            if self.count == 0:
+                self.total = 0.0
+                self.compensation = 0.0
+
+            self.cursor += 1
+
+    @property
+    def value(self):
+        if self.count == 0:
+            return float('nan')
+
+        return (self.total + self.compensation) / self.count
+
+
+class StoredIndicator(object):
+    """
+    An indicator of every symbol of a BarPanel read from values calculated
+    for the whole panel at once, so an update only moves the cursor.
+    """
+
+    def __init__(self, matrix):
+        """
+        Parameters:
+        matrix - The dates x symbols matrix of the indicator on the calendar of the panel.
+        """
+        self.matrix = matrix
+        self.cursor = 0
+
+    def update(self, values, cursor):
+        self.cursor = cursor
+
+    @property
+    def values(self):
+        """
+        The current value of every symbol.
+        """
+        if self.cursor == 0:
+            return np.full(self.matrix.shape[1], np.nan)
+
+        return self.matrix[self.cursor - 1]
+
+    def symbol_value(self, i):
+        if self.cursor == 0:
+            return float('nan')
+
+        return self.matrix[self.cursor - 1, i]
+
+    def symbol(self, index):
+        return SymbolIndicator(self, index)
+
+
+class SymbolIndicator(object):
+    """
+    The indicator of a single symbol within a cross-sectional indicator,
+    with the same value property as the per-symbol indicators.
+    """
+
+    def __init__(self, indicator, index):
+        self.indicator = indicator
+        self.index = index
+
+    @property
+    def value(self):
+        return self.indicator.symbol_value(self.index)
+
+
+class IndicatorRegistry(object):
+    """
+    Keeps the indicators requested for the symbols of a data handler. Every
+    indicator is created once per (symbol, column, kind, window), so several
+    strategies asking for the same moving average share a single instance,
+    and each one is updated once per update_bars() call.
+
+    When the data handler keeps an aligned BarPanel, an indicator covers every
+    symbol of the panel and is keyed without a symbol. Its values are
+    calculated for all of the bars of the panel at once with the same
+    functions as the vectorized backtests, so both give the same signals,
+    and an update only moves its cursor.
+
+    With a FeatureStore, the moving averages it keeps are read from it
+    instead of being calculated. Those are computed over the whole history
+    of each symbol on its own trading days, so in the first bars after the
+    start date, and after days a symbol did not trade, they can differ from
+    the calculated ones, which only see the bars of the backtest.
+    """
+
+    def __init__(self, bars, features=None):
+        """
+        Parameters:
+        bars - The DataHandler object whose bars feed the indicators.
+        features - The FeatureStore to read precomputed indicators from, if any.
+        """
+        self.bars = bars
+        self.features = features
+        self.indicators = {}
+
+    def _sync(self, key, indicator):
+        symbol, column = key[0], key[1]
+
+        if symbol is None:
+            panel = self.bars.panel
+            indicator.update(panel.field(column), panel.cursor)
+        else:
+            indicator.update(self.bars.get_bar_column(symbol, column), self.bars.get_bar_count(symbol))
+
+    def sma(self, symbol, window, column='CLOSING PRICE'):
+        """
+        Returns the simple moving average of a column of the symbol.
+        """
+        panel = getattr(self.bars, 'panel', None)
+        features = self.features
+
+        if (panel is not None and features is not None and column == features.column
+                and features.has('sma_%d' % window)):
+            return self.feature(symbol, 'sma_%d' % window)
+
+        if panel is not None:
+            key = (None, column, 'sma', window)
+
+            if key not in self.indicators:
+                self.indicators[key] = StoredIndicator(rolling_mean(panel.field(column), window))
+                self._sync(key, self.indicators[key])
+
+            return self.indicators[key].symbol(panel.symbol_index[symbol])
+
+        key = (symbol, column, 'sma', window)
+
+        if key not in self.indicators:
+            self.indicators[key] = RollingMean(window)
+            self._sync(key, self.indicators[key])
+
+        return self.indicators[key]
+
+    def feature(self, symbol, name):
+        """
+        Returns a precomputed feature of the symbol, such as 'ema_20' or 'volatility_60'.
+        """
+        panel = getattr(self.bars, 'panel', None)
+
+        if self.features is None or panel is None:
+            raise ValueError("Precomputed features need a feature store and a data handler with a panel")
+        if not self.features.has(name):
+            raise ValueError("Unknown feature: {}".format(name))
+
+        key = (None, self.features.column, 'feature', name)
+
+        if key not in self.indicators:
+            self.indicators[key] = StoredIndicator(self.features.panel_matrix(name, panel))
+            self._sync(key, self.indicators[key])
+
+        return self.indicators[key].symbol(panel.symbol_index[symbol])
+
+    def update(self):
+        """
+        Updates all of the indicators with the newly released bars.
+        """
+        for key, indicator in self.indicators.items():
+            self._sync(key, indicator)
@@ -0,0 +1,175 @@
+"""
+Module for measuring where the time of a backtest goes. An Instrumentation
+object runs the event loop of a Backtest in place of Backtest.run(), timing
+the data handler and every registered handler per event type, counting the
+events and optionally tracing the peak memory and profiling the whole loop.
+Without it the engine runs exactly as before, with no overhead.
+"""
+
+import cProfile
+import inspect
+import json
+import logging
+import time
+import tracemalloc
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+def component_name(handler):
+    """
+    Returns the class and method name of a bound method, or the name of a function.
+    """
+    owner = getattr(handler, '__self__', None)
+    name = getattr(handler, '__name__', repr(handler))
+
+    if owner is not None and not inspect.ismodule(owner):
+        return '{}.{}'.format(owner.__class__.__name__, name)
+
+    return getattr(handler, '__qualname__', name)
+
+
+class Instrumentation(object):
+    """
+    Collects the wall time, call counts and event counts of a backtest,
+    per event type and per component, and reports them as a dictionary
+    or a JSON file at the end of the run.
+    """
+
+    def __init__(self, trace_memory=False, profile=False):
+        """
+        Parameters:
+        trace_memory - Whether to trace the peak memory with tracemalloc,
+                       which slows down every allocation of the run.
+        profile - Whether to capture a cProfile profile of the bar loop.
+        """
+        self.trace_memory = trace_memory
+        self.profiler = cProfile.Profile() if profile else None
+
+        self.bars = 0
+        self.seconds = 0.0
+        self.peak_memory = None
+        self.event_counts = defaultdict(int)
+        self.handler_calls = defaultdict(int)
+        self.handler_seconds = defaultdict(float)
+        self.names = {}  # component names of the handlers, computed once
+
+    def _record(self, key, seconds):
+        self.handler_calls[key] += 1
+        self.handler_seconds[key] += seconds
+
+    def dispatch(self, backtest):
+        """
+        Dispatches the queued events like Backtest.dispatch(), timing every handler.
+        """
+        events = backtest.events
+        handlers = backtest.handlers
+        names = self.names
+        clock = time.perf_counter
+
+        while events:
+            event = events.popleft()
+
+            if event is None:
+                continue
+
+            event_name = event.__class__.__name__
+            self.event_counts[event_name] += 1
+
+            for handler in handlers.get(event.__class__, ()):
+                start = clock()
+                handler(event)
+                elapsed = clock() - start
+
+                if handler not in names:
+                    names[handler] = component_name(handler)
+                self._record((event_name, names[handler]), elapsed)
+
+    def run(self, backtest):
+        """
+        Runs the backtest until the data handler runs out of bars.
+        """
+        bars = backtest.bars
+        update_name = component_name(bars.update_bars)
+        clock = time.perf_counter
+
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.profiler is not None:
+            self.profiler.enable()
+
+        run_start = clock()
+
+        try:
+            while bars.continue_backtest:
+                for hook in backtest.before_bar:
+                    hook(backtest)
+
+                start = clock()
+                bars.update_bars()
+                self._record(('update_bars', update_name), clock() - start)
+
+                self.dispatch(backtest)
+                backtest.bar_count += 1
+                self.bars += 1
+
+                for hook in backtest.after_bar:
+                    hook(backtest)
+        finally:
+            self.seconds += clock() - run_start
+
+            if self.profiler is not None:
+                self.profiler.disable()
+            if self.trace_memory:
+                self.peak_memory = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+
+        logger.info("Ran %d bars in %.3f seconds", self.bars, self.seconds)
+        return backtest.portfolio
+
+    def report(self):
+        """
+        Returns the measurements as a dictionary of plain types.
+        """
+        events = defaultdict(float)
+        components = defaultdict(float)
+        handlers = []
+
+        for key in sorted(self.handler_seconds, key=self.handler_seconds.get, reverse=True):
+            event_name, handler = key
+            seconds = self.handler_seconds[key]
+            events[event_name] += seconds
+            components[handler.split('.')[0]] += seconds
+            handlers.append({'event': event_name, 'handler': handler,
+                             'calls': self.handler_calls[key], 'seconds': seconds})
+
+        return {
+            'bars': self.bars,
+            'seconds': self.seconds,
+            'bars_per_second': self.bars / self.seconds if self.seconds > 0 else None,
+            'peak_memory_bytes': self.peak_memory,
+            'event_counts': dict(self.event_counts),
+            'event_seconds': dict(events),
+            'component_seconds': dict(components),
+            'handlers': handlers,
+        }
+
+    def write_report(self, path):
+        """
+        Writes the report to a JSON file.
+        """
+        with open(path, 'w') as report_file:
+            json.dump(self.report(), report_file, indent=2)
+
+        logger.info("Wrote the instrumentation report to: %s", path)
+
+    def write_profile(self, path):
+        """
+        Writes the captured profile to a file that pstats can read.
+        """
+        if self.profiler is None:
+            raise ValueError("The profile was not captured, create the Instrumentation with profile=True")
+
+        self.profiler.dump_stats(path)
+        logger.info("Wrote the profile to: %s", path)
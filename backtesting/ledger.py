@@ -0,0 +1,194 @@
+"""
+Module for recording the positions and holdings of a portfolio at every bar
+in preallocated NumPy arrays, instead of appending a new dictionary for every
+bar and converting the list into a DataFrame at the end. The arrays can be
+memory-mapped .npy files, so that long runs are written to disk as they go.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class Ledger(object):
+    """
+    The Ledger keeps one row per bar of the quantities held of every symbol,
+    their market values followed by the account columns (e.g. cash,
+    commission and total) and, optionally, the cash assigned to every symbol.
+    Rows are written in place, and the arrays only grow (doubling) when the
+    number of bars was not known in advance.
+    """
+
+    def __init__(self, symbol_list, account_columns, capacity=256, symbol_cash=False):
+        """
+        Parameters:
+        symbol_list - The list of symbols.
+        account_columns - The names of the columns after the symbols.
+        capacity - The number of rows to preallocate.
+        symbol_cash - Whether to record the cash of every symbol.
+        """
+        self.symbol_list = list(symbol_list)
+        self.account_columns = list(account_columns)
+        self.columns = self.symbol_list + self.account_columns
+        self.column_index = {column: i for i, column in enumerate(self.columns)}
+        self.size = 0
+        self.directory = None
+
+        capacity = max(capacity, 1)
+        width = len(self.symbol_list)
+        self.datetimes = np.empty(capacity, dtype='datetime64[ns]')
+        self.positions = np.zeros((capacity, width))
+        self.holdings = np.zeros((capacity, len(self.columns)))
+        self.cash = np.zeros((capacity, width)) if symbol_cash else None
+
+    @property
+    def array_names(self):
+        return ['datetimes', 'positions', 'holdings'] + (['cash'] if self.cash is not None else [])
+
+    def path(self, name):
+        """
+        Returns the path of the .npy file of an array when the ledger is memory-mapped.
+        """
+        return os.path.join(self.directory, 'ledger_{}.npy'.format(name))
+
+    def _resize(self, name, capacity):
+        array = getattr(self, name)
+        shape = (capacity,) + array.shape[1:]
+
+        if self.directory is None:
+            return np.resize(array, shape)
+
+        # Copied to a new file, so that the records are never only in memory
+        path = self.path(name)
+        grown = np.lib.format.open_memmap(path + '.tmp', mode='w+', dtype=array.dtype, shape=shape)
+        grown[:self.size] = array[:self.size]
+        os.replace(path + '.tmp', path)
+        return grown
+
+    def _reserve(self, rows):
+        capacity = len(self.datetimes)
+
+        if self.size + rows <= capacity:
+            return
+
+        capacity = max(capacity * 2, self.size + rows)
+
+        for name in self.array_names:
+            setattr(self, name, self._resize(name, capacity))
+
+    def open_files(self, directory):
+        """
+        Moves the arrays to memory-mapped .npy files in the directory,
+        so the records appended from now on are written to disk as the
+        run goes. The files keep the preallocated rows, of which the
+        first size are records.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+        for name in self.array_names:
+            array = getattr(self, name)
+            mapped = np.lib.format.open_memmap(self.path(name), mode='w+', dtype=array.dtype, shape=array.shape)
+            mapped[:self.size] = array[:self.size]
+            setattr(self, name, mapped)
+
+    def flush(self):
+        """
+        Writes the memory-mapped records to disk.
+        """
+        if self.directory is not None:
+            for name in self.array_names:
+                getattr(self, name).flush()
+
+    def append(self, datetime, positions, market_values, account, cash=None):
+        """
+        Writes the record of a bar.
+
+        Parameters:
+        datetime - The datetime of the bar.
+        positions - The quantity of every symbol.
+        market_values - The market value of every symbol.
+        account - The values of the account columns.
+        cash - The cash of every symbol, if recorded.
+        """
+        self._reserve(1)
+        row = self.size
+        width = len(self.symbol_list)
+
+        self.datetimes[row] = np.datetime64(pd.Timestamp(datetime), 'ns')
+        self.positions[row] = positions
+        self.holdings[row, :width] = market_values
+        self.holdings[row, width:] = account
+
+        if self.cash is not None:
+            self.cash[row] = cash
+
+        self.size += 1
+
+    def extend(self, datetimes, positions, market_values, account, cash=None):
+        """
+        Writes the records of several bars at once, with one
+        row per bar in each of the arrays.
+        """
+        rows = len(datetimes)
+        self._reserve(rows)
+        start, stop = self.size, self.size + rows
+        width = len(self.symbol_list)
+
+        self.datetimes[start:stop] = np.asarray(datetimes, dtype='datetime64[ns]')
+        self.positions[start:stop] = positions
+        self.holdings[start:stop, :width] = market_values
+        self.holdings[start:stop, width:] = account
+
+        if self.cash is not None:
+            self.cash[start:stop] = cash
+
+        self.size = stop
+
+    def latest(self, column):
+        """
+        Returns a column of the last record.
+        """
+        return self.holdings[self.size - 1, self.column_index[column]]
+
+    def frame(self):
+        """
+        Wraps the recorded holdings in a DataFrame indexed
+        by datetime, without copying the array.
+        """
+        index = pd.DatetimeIndex(self.datetimes[:self.size], name='datetime')
+        return pd.DataFrame(self.holdings[:self.size], index=index, columns=self.columns, copy=False)
+
+    def position_records(self):
+        """
+        Converts the positions into the list of dictionaries
+        that portfolios used to keep in all_positions.
+        """
+        records = []
+
+        for row in range(self.size):
+            record = dict(zip(self.symbol_list, self.positions[row].tolist()))
+            record['datetime'] = pd.Timestamp(self.datetimes[row])
+            records.append(record)
+
+        return records
+
+    def holdings_records(self):
+        """
+        Converts the holdings into the list of dictionaries that portfolios
+        used to keep in all_holdings, with the cash of every symbol as a
+        dictionary under 'cash' when it is recorded.
+        """
+        records = []
+
+        for row in range(self.size):
+            record = dict(zip(self.columns, self.holdings[row].tolist()))
+            record['datetime'] = pd.Timestamp(self.datetimes[row])
+
+            if self.cash is not None:
+                record['cash'] = dict(zip(self.symbol_list, self.cash[row].tolist()))
+
+            records.append(record)
+
+        return records
@@ -0,0 +1,237 @@
+"""
+Module for calculating portfolio allocations analytically. Instead of sampling
+random portfolios, the long-only minimum variance and maximum Sharpe ratio
+(tangency) portfolios are found exactly by solving a small quadratic program
+with an active-set method, which only needs NumPy.
+"""
+
+import numpy as np
+
+
+def ledoit_wolf_covariance(returns):
+    """
+    Shrinks the sample covariance towards a scaled identity matrix with the
+    intensity of Ledoit & Wolf (2004), which keeps the estimate well
+    conditioned when there are many symbols and few observations.
+
+    Parameters:
+    returns - A 2-D array of period returns, one column per symbol.
+
+    Returns:
+    cov, shrinkage - The shrunk covariance and the shrinkage intensity.
+    """
+    n_samples, n_features = returns.shape
+    centered = returns - returns.mean(axis=0)
+    sample = centered.T.dot(centered) / n_samples
+    mu = np.trace(sample) / n_features
+
+    squared = centered ** 2
+    beta = (squared.T.dot(squared) / n_samples - sample ** 2).sum() / n_samples
+    delta = ((sample - mu * np.eye(n_features)) ** 2).sum()
+    beta = min(beta, delta)
+    shrinkage = 0.0 if delta == 0 else beta / delta
+
+    return shrinkage * mu * np.eye(n_features) + (1.0 - shrinkage) * sample, shrinkage
+
+
+def estimate_moments(stocks, shrinkage=None, periods=252):
+    """
+    Calculates the annualized mean and covariance of the log returns of the
+    closing prices.
+
+    Parameters:
+    stocks - A DataFrame of closing prices, one column per symbol.
+    shrinkage - None for the sample covariance, 'ledoit_wolf' for the
+                Ledoit-Wolf estimate or a float in [0, 1] for a fixed
+                shrinkage towards the scaled identity.
+    periods - The number of periods in a year.
+    """
+    returns = np.log(stocks / stocks.shift(1))
+    mean = returns.mean().values * periods
+
+    if shrinkage is None:
+        return mean, returns.cov().values * periods
+
+    observations = returns.dropna().values
+
+    if shrinkage == 'ledoit_wolf':
+        cov, _ = ledoit_wolf_covariance(observations)
+    else:
+        cov = shrink_covariance(np.cov(observations, rowvar=False, bias=True), shrinkage)
+
+    return mean, cov * periods
+
+
+def shrink_covariance(sample, shrinkage):
+    """
+    Shrinks a covariance matrix towards the scaled identity with a fixed intensity in [0, 1].
+    """
+    target = np.trace(sample) / len(sample) * np.eye(len(sample))
+    return float(shrinkage) * target + (1.0 - float(shrinkage)) * sample
+
+
+class OnlineMoments(object):
+    """
+    Keeps the mean and covariance of the log returns up to date as prices
+    arrive, in O(N^2) per bar instead of recomputing them from the whole
+    history. Without a half-life every return has the same weight (Welford's
+    algorithm), otherwise the weights decay exponentially with the age of the
+    return. Bars where any of the returns is missing are skipped.
+    """
+
+    def __init__(self, width, halflife=None):
+        """
+        Parameters:
+        width - The number of symbols.
+        halflife - The number of bars after which the weight of a
+                   return halves, or None for equal weights.
+        """
+        self.count = 0
+        self.mean = np.zeros(width)
+        self.scatter = np.zeros((width, width))
+        self.alpha = None if halflife is None else 1.0 - 0.5 ** (1.0 / halflife)
+        self.last_prices = None
+
+    def update(self, returns):
+        """
+        Adds the returns of a bar.
+        """
+        if not np.isfinite(returns).all():
+            return
+
+        self.count += 1
+        delta = returns - self.mean
+
+        if self.alpha is None:
+            self.mean += delta / self.count
+            self.scatter += np.outer(delta, returns - self.mean)
+        elif self.count == 1:
+            self.mean = returns.copy()
+        else:
+            self.mean += self.alpha * delta
+            self.scatter = (1.0 - self.alpha) * (self.scatter + self.alpha * np.outer(delta, delta))
+
+    def update_prices(self, prices):
+        """
+        Adds the log returns since the previous prices.
+        """
+        prices = np.array(prices, dtype=np.float64)
+
+        if self.last_prices is not None:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                self.update(np.log(prices / self.last_prices))
+
+        self.last_prices = prices
+
+    def covariance(self):
+        if self.alpha is None:
+            return self.scatter / max(self.count - 1, 1)
+        return self.scatter
+
+    def moments(self, shrinkage=None, periods=252):
+        """
+        Returns the annualized mean and covariance, optionally
+        shrunk towards the scaled identity with a fixed intensity.
+        """
+        cov = self.covariance()
+
+        if shrinkage is not None:
+            cov = shrink_covariance(cov, shrinkage)
+
+        return self.mean * periods, cov * periods
+
+
+def _solve_equality(cov, a):
+    """
+    Minimizes w'Σw subject to a'w = 1 without the sign constraints.
+    """
+    try:
+        direction = np.linalg.solve(cov, a)
+    except np.linalg.LinAlgError:
+        direction = np.linalg.lstsq(cov, a, rcond=None)[0]
+
+    return direction / a.dot(direction)
+
+
+def solve_long_only(cov, a, tolerance=1e-12):
+    """
+    Minimizes w'Σw subject to a'w = 1 and w >= 0 with a primal active-set
+    method. Every iteration solves the problem on the symbols with non-zero
+    weight and either steps to it, dropping the first weight that reaches
+    zero on the way, or adds the symbol whose Lagrange multiplier shows that
+    it would lower the variance.
+
+    Parameters:
+    cov - The covariance matrix.
+    a - The coefficients of the equality constraint, at least one positive.
+    tolerance - The tolerance of the optimality checks.
+    """
+    cov = np.asarray(cov, dtype=np.float64)
+    a = np.asarray(a, dtype=np.float64)
+    n = len(a)
+
+    if not (a > 0).any():
+        raise ValueError("At least one coefficient of the constraint must be positive")
+
+    # Start from the single symbol with the best ratio, which is feasible
+    ratios = np.where(a > 0, a / np.sqrt(np.maximum(np.diag(cov), tolerance)), -np.inf)
+    start = ratios.argmax()
+    weights = np.zeros(n)
+    weights[start] = 1.0 / a[start]
+    free = np.zeros(n, dtype=bool)
+    free[start] = True
+    scale = max(np.abs(cov).max(), tolerance)
+
+    for _ in range(10 * n + 10):
+        indices = np.flatnonzero(free)
+        target = _solve_equality(cov[np.ix_(indices, indices)], a[indices])
+
+        if (target >= -tolerance).all():
+            weights = np.zeros(n)
+            weights[indices] = np.maximum(target, 0.0)
+
+            gradient = cov.dot(weights)
+            multipliers = gradient - weights.dot(gradient) * a
+            multipliers[free] = np.inf
+            candidate = multipliers.argmin()
+
+            if multipliers[candidate] >= -tolerance * scale:
+                return weights
+
+            free[candidate] = True
+        else:
+            current = weights[indices]
+            negative = target < 0
+            steps = current[negative] / (current[negative] - target[negative])
+            step = steps.min()
+
+            weights[indices] = current + step * (target - current)
+            dropped = indices[negative][steps <= step + tolerance]
+            weights[dropped] = 0.0
+            free[dropped] = False
+
+    raise RuntimeError("The active-set method did not converge")
+
+
+def min_variance_weights(cov):
+    """
+    Returns the long-only weights with the lowest variance.
+    """
+    return solve_long_only(cov, np.ones(len(cov)))
+
+
+def max_sharpe_weights(mean, cov):
+    """
+    Returns the long-only weights with the highest Sharpe ratio, assuming a
+    risk-free rate of zero. Since the Sharpe ratio does not change when the
+    weights are scaled, this is the variance minimized for a unit expected
+    return, normalized to sum to one. If no symbol has a positive expected
+    return the minimum variance weights are returned instead.
+    """
+    mean = np.asarray(mean, dtype=np.float64)
+
+    if not (mean > 0).any():
+        return min_variance_weights(cov)
+
+    weights = solve_long_only(cov, mean)
+    return weights / weights.sum()
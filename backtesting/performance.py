@@ -1,12 +1,23 @@
 """
 Module for calculating portfolio performance. Included from:
 https://www.quantstart.com/articles/Event-Driven-Backtesting-with-Python-Part-VII
+
+The metrics are calculated with vectorized NumPy operations, so that they
+stay cheap on long curves and for the results of large parameter sweeps.
 """
 
 import numpy as np
 import pandas as pd
 
 
+def _nanmax(values):
+    """
+    Maximum ignoring NaNs, or NaN if there are no values.
+    """
+    values = values[~np.isnan(values)]
+    return values.max() if len(values) else np.nan
+
+
 def create_sharpe_ratio(returns, periods=252):
     """
     Create the Sharpe ratio for the strategy, based on a
@@ -16,9 +27,83 @@ def create_sharpe_ratio(returns, periods=252):
     returns - A pandas Series representing period percentage returns.
     periods - Daily (252), Hourly (252*6.5), Minutely(252*6.5*60) etc.
     """
+    returns = np.asarray(returns, dtype=np.float64)
+    returns = returns[~np.isnan(returns)]
     return np.sqrt(periods) * np.mean(returns) / np.std(returns)
 
 
+def create_sortino_ratio(returns, periods=252):
+    """
+    Create the Sortino ratio for the strategy, which is the Sharpe
+    ratio with only the downside deviation as the risk measure.
+
+    Parameters:
+    returns - A pandas Series representing period percentage returns.
+    periods - Daily (252), Hourly (252*6.5), Minutely(252*6.5*60) etc.
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    returns = returns[~np.isnan(returns)]
+    downside = np.sqrt(np.mean(np.minimum(returns, 0.0) ** 2))
+    return np.sqrt(periods) * np.mean(returns) / downside
+
+
+def create_calmar_ratio(returns, max_drawdown, periods=252):
+    """
+    Create the Calmar ratio for the strategy, the annualized
+    return divided by the maximum drawdown.
+
+    Parameters:
+    returns - A pandas Series representing period percentage returns.
+    max_drawdown - The maximum drawdown as a fraction of the peak.
+    periods - Daily (252), Hourly (252*6.5), Minutely(252*6.5*60) etc.
+    """
+    returns = np.asarray(returns, dtype=np.float64)
+    returns = returns[~np.isnan(returns)]
+
+    if len(returns) == 0 or not max_drawdown:
+        return np.nan
+
+    annual_return = np.prod(1.0 + returns) ** (periods / float(len(returns))) - 1.0
+    return annual_return / max_drawdown
+
+
+def create_rolling_sharpe(returns, window=126, periods=252):
+    """
+    Create the Sharpe ratio over a rolling window of the returns, with
+    the same population standard deviation as create_sharpe_ratio.
+
+    Parameters:
+    returns - A pandas Series representing period percentage returns.
+    window - The number of periods in each window.
+    periods - Daily (252), Hourly (252*6.5), Minutely(252*6.5*60) etc.
+    """
+    rolling = pd.Series(returns, dtype=np.float64).rolling(window)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.sqrt(periods) * rolling.mean() / rolling.std(ddof=0)
+
+
+def _drawdown_arrays(equity_curve):
+    """
+    Calculates the high water mark, drawdown and drawdown duration of every
+    bar. As in the original loop the first bar is skipped, the high water
+    mark starts at zero and NaNs leave it unchanged, and the duration
+    counts the bars since the curve was last at its high water mark.
+    """
+    values = np.asarray(equity_curve, dtype=np.float64)
+    index = np.arange(len(values))
+
+    hwm = np.fmax.accumulate(np.concatenate(([0.0], values[1:])))
+    drawdown = hwm - values
+    drawdown[:1] = np.nan
+
+    at_high = np.where(drawdown == 0, index, -1)
+    last_high = np.maximum.accumulate(at_high) if len(values) else at_high
+    duration = np.where(last_high >= 0, index - last_high, np.nan)
+
+    return hwm, drawdown, duration
+
+
 def create_drawdowns(equity_curve):
     """
     Calculate the largest peak-to-trough drawdown of the PnL curve
@@ -31,19 +116,122 @@ def create_drawdowns(equity_curve):
     Returns:
     drawdown, duration - Highest peak-to-trough drawdown and duration.
     """
+    hwm, drawdown, duration = _drawdown_arrays(equity_curve)
+    return _nanmax(drawdown), _nanmax(duration)
+
+
+def create_underwater_curve(equity_curve):
+    """
+    Create the underwater curve, i.e. how far below its running
+    maximum the equity curve is at every bar, as a fraction.
+
+    Parameters:
+    equity_curve - A pandas Series of the cumulative returns curve.
+    """
+    hwm, drawdown, duration = _drawdown_arrays(equity_curve)
+    return _underwater(equity_curve, hwm, drawdown)
+
+
+def _underwater(equity_curve, hwm, drawdown):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        underwater = -drawdown / hwm
+
+    if isinstance(equity_curve, pd.Series):
+        return pd.Series(underwater, index=equity_curve.index)
+    return underwater
+
+
+def create_performance_report(returns, equity_curve, periods=252, window=126, history=None, prices=None):
+    """
+    Calculates all of the metrics of a curve, sharing the cleaned returns
+    and the drawdown arrays between them.
+
+    Parameters:
+    returns - A pandas Series representing period percentage returns.
+    equity_curve - A pandas Series of the cumulative returns curve.
+    periods - Daily (252), Hourly (252*6.5), Minutely(252*6.5*60) etc.
+    window - The number of periods of the rolling Sharpe ratio.
+    history - The order history of the execution handler, for the trade statistics.
+    prices - The closing prices of the symbols, for the trade statistics.
+
+    Returns:
+    A dictionary of the summary metrics, the 'rolling_sharpe' and 'underwater'
+    curves and, given the order history, the 'trades' statistics.
+    """
+    values = np.asarray(returns, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    hwm, drawdown, duration = _drawdown_arrays(equity_curve)
+    underwater = _underwater(equity_curve, hwm, drawdown)
+    max_underwater = _nanmax(-np.asarray(underwater, dtype=np.float64))
+
+    report = {
+        'sharpe_ratio': create_sharpe_ratio(values, periods),
+        'sortino_ratio': create_sortino_ratio(values, periods),
+        'calmar_ratio': create_calmar_ratio(values, max_underwater, periods),
+        'max_drawdown': _nanmax(drawdown),
+        'max_underwater': max_underwater,
+        'drawdown_duration': _nanmax(duration),
+        'rolling_sharpe': create_rolling_sharpe(returns, window, periods),
+        'underwater': underwater,
+    }
+
+    if history is not None:
+        report['trades'] = create_trade_stats(history, prices)
+
+    return report
+
+
+def create_trade_stats(history, prices):
+    """
+    Pairs the orders of every symbol into round-trip trades and calculates
+    their statistics. A trade opens when the position is flat and closes
+    with the next order, which is how the portfolios trade.
+
+    Parameters:
+    history - The order history of the execution handler, mapping
+              symbols to lists of {'date', 'qty', 'direction'} dictionaries.
+    prices - A pandas Series of closing prices per symbol, indexed by date.
+
+    Returns:
+    A dictionary of the trade statistics.
+    """
+    trade_returns = []
+    trade_pnls = []
+    trade_bars = []
+
+    for symbol, orders in history.items():
+        if len(orders) < 2:
+            continue
+
+        dates = pd.to_datetime([order['date'] for order in orders])
+        positions = prices[symbol].index.get_indexer(dates)
+        fills = prices[symbol].values[positions]
+        quantities = np.array([order['qty'] for order in orders], dtype=np.float64)
+        signs = np.array([1.0 if order['direction'] == 'BUY' else -1.0 for order in orders])
+
+        closed = len(orders) // 2 * 2
+        entries, exits = fills[0:closed:2], fills[1:closed:2]
+        sign = signs[0:closed:2]
+
+        trade_returns.append(sign * (exits / entries - 1.0))
+        trade_pnls.append(sign * (exits - entries) * quantities[0:closed:2])
+        trade_bars.append(positions[1:closed:2] - positions[0:closed:2])
+
+    returns = np.concatenate(trade_returns) if trade_returns else np.empty(0)
+    pnls = np.concatenate(trade_pnls) if trade_pnls else np.empty(0)
+    bars = np.concatenate(trade_bars) if trade_bars else np.empty(0)
+
+    if len(returns) == 0:
+        return {'trades': 0}
+
+    wins, losses = pnls[pnls > 0], pnls[pnls < 0]
 
-    # Calculate the cumulative returns curve
-    # and set up the High Water Mark
-    # Then create the drawdown and duration series
-    hwm = [0]
-    eq_idx = equity_curve.index
-    drawdown = pd.Series(index=eq_idx)
-    duration = pd.Series(index=eq_idx)
-
-    # Loop over the index range
-    for t in range(1, len(eq_idx)):
-        cur_hwm = max(hwm[t - 1], equity_curve[t])
-        hwm.append(cur_hwm)
-        drawdown[t] = hwm[t] - equity_curve[t]
-        duration[t] = 0 if drawdown[t] == 0 else duration[t - 1] + 1
-    return drawdown.max(), duration.max()
+    return {
+        'trades': len(returns),
+        'win_rate': len(wins) / float(len(returns)),
+        'average_return': returns.mean(),
+        'best_return': returns.max(),
+        'worst_return': returns.min(),
+        'profit_factor': wins.sum() / -losses.sum() if len(losses) else np.inf,
+        'average_bars_held': bars.mean(),
+    }
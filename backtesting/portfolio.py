@@ -4,12 +4,14 @@ project after learning about event-driven backtesting from QuantStart. See:
 https://www.quantstart.com/articles/Event-Driven-Backtesting-with-Python-Part-V
 """
 
+import numpy as np
 import pandas as pd
 
 from abc import ABCMeta, abstractmethod
 
-from backtesting.event import OrderEvent
-from backtesting.performance import create_sharpe_ratio, create_drawdowns
+from backtesting.event import OrderEvent, EventType, SignalType, Direction
+from backtesting.ledger import Ledger
+from backtesting.performance import create_performance_report
 
 
 class Portfolio(object):
@@ -60,47 +62,50 @@ class NaivePortfolio(Portfolio):
         self.bars = bars
         self.events = events
         self.symbol_list = self.bars.symbol_list
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbol_list)}
         self.start_date = pd.to_datetime(start_date)
         self.initial_capital = initial_capital
         self.equity_curve = None
 
-        self.all_positions = self.construct_all_positions()
-        self.current_positions = {key: value for key, value in [(symbol, 0) for symbol in self.symbol_list]}
-
-        self.all_holdings = self.construct_all_holdings()
+        self.current_positions = np.zeros(len(self.symbol_list))
         self.current_holdings = self.construct_current_holdings()
+        self.ledger = self.construct_ledger()
 
-    def construct_all_positions(self):
+    def construct_ledger(self):
         """
-        Constructs the positions list using the start_date
-        to determine when the time index will begin.
+        Constructs the ledger of positions and holdings, sized for the
+        bars of the data handler, with the start_date as its first record.
         """
-        dictionary = {key: value for key, value in [(symbol, 0) for symbol in self.symbol_list]}
-        dictionary['datetime'] = self.start_date
-        return [dictionary]
+        expected = self.bars.get_expected_bar_count()
+        ledger = Ledger(self.symbol_list, ['cash', 'commission', 'total'], expected + 1 if expected else 256)
+        ledger.append(self.start_date, self.current_positions, np.zeros(len(self.symbol_list)),
+                      (self.initial_capital, 0.0, self.initial_capital))
+        return ledger
 
-    def construct_all_holdings(self):
+    def construct_current_holdings(self):
         """
-        Constructs the holdings list using the start_date
-        to determine when the time index will begin.
+        This constructs the dictionary which will hold the instantaneous
+        value of the portfolio across all symbols.
         """
-        dictionary = {key: value for key, value in [(symbol, 0.0) for symbol in self.symbol_list]}
-        dictionary['datetime'] = self.start_date
+        dictionary = dict()
         dictionary['cash'] = self.initial_capital  # spare cash in the account after any purchases
         dictionary['commission'] = 0.0  # the cumulative commission accrued
         dictionary['total'] = self.initial_capital  # the total account equity including cash and any open positions
-        return [dictionary]
+        return dictionary
 
-    def construct_current_holdings(self):
+    @property
+    def all_positions(self):
         """
-        This constructs the dictionary which will hold the instantaneous
-        value of the portfolio across all symbols.
+        The recorded positions as a list of dictionaries.
         """
-        dictionary = {key: value for key, value in [(symbol, 0.0) for symbol in self.symbol_list]}
-        dictionary['cash'] = self.initial_capital
-        dictionary['commission'] = 0.0
-        dictionary['total'] = self.initial_capital
-        return dictionary
+        return self.ledger.position_records()
+
+    @property
+    def all_holdings(self):
+        """
+        The recorded holdings as a list of dictionaries.
+        """
+        return self.ledger.holdings_records()
 
     def update_time_index(self, event):
         """
@@ -110,36 +115,14 @@ class NaivePortfolio(Portfolio):
 
         Makes use of a MarketEvent from the events queue.
         """
-        bars = {}
-        for symbol in self.symbol_list:
-            bars[symbol] = self.bars.get_latest_bars(symbol)
-
-        # Update positions
-        positions = {key: value for key, value in [(symbol, 0) for symbol in self.symbol_list]}
-        positions['datetime'] = pd.to_datetime(bars[self.symbol_list[0]].iloc[0].name)
-
-        for symbol in self.symbol_list:
-            positions[symbol] = self.current_positions[symbol]
-
-        # Append the current positions
-        self.all_positions.append(positions)
-
-        # Update holdings
-        holdings = {key: value for key, value in [(symbol, 0) for symbol in self.symbol_list]}
-        holdings['datetime'] = pd.to_datetime(bars[self.symbol_list[0]].iloc[0].name)
-        holdings['cash'] = self.current_holdings['cash']
-        holdings['commission'] = self.current_holdings['commission']
-        holdings['total'] = self.current_holdings['cash']
+        # Approximation to the real value, symbols that are not held do not count
+        market_values = np.where(self.current_positions != 0,
+                                 self.current_positions * self.bars.get_latest_closes(), 0.0)
+        cash = self.current_holdings['cash']
+        account = (cash, self.current_holdings['commission'], cash + market_values.sum())
 
-        print(len(self.symbol_list))
-        for symbol in self.symbol_list:
-            # Approximation to the real value
-            market_value = self.current_positions[symbol] * bars[symbol].iloc[0]['CLOSING PRICE']
-            holdings[symbol] = market_value
-            holdings['total'] += market_value
-
-        # Append the current holdings
-        self.all_holdings.append(holdings)
+        self.ledger.append(self.bars.get_latest_bar_datetime(self.symbol_list[0]), self.current_positions,
+                           market_values, account)
 
     def update_positions_from_fill(self, fill):
         """
@@ -152,13 +135,13 @@ class NaivePortfolio(Portfolio):
         # Check whether the fill is a buy or sell
         direction = 0
 
-        if fill.direction == 'BUY':
+        if fill.direction == Direction.BUY:
             direction = 1
-        if fill.direction == 'SELL':
+        if fill.direction == Direction.SELL:
             direction = -1
 
         # Update positions list with new quantities
-        self.current_positions[fill.symbol] += direction * fill.quantity
+        self.current_positions[self.symbol_index[fill.symbol]] += direction * fill.quantity
 
     def update_holdings_from_fill(self, fill):
         """
@@ -171,15 +154,14 @@ class NaivePortfolio(Portfolio):
         # Check whether the fill is a buy or sell
         direction = 0
 
-        if fill.direction == 'BUY':
+        if fill.direction == Direction.BUY:
             direction = 1
-        if fill.direction == 'SELL':
+        if fill.direction == Direction.SELL:
             direction = -1
 
         # Update holdings list with new quantities
-        cost = self.bars.get_latest_bars(fill.symbol).iloc[0]['CLOSING PRICE']  # Close price
+        cost = self.bars.get_latest_closes()[self.symbol_index[fill.symbol]]  # Close price
         cost = direction * cost * fill.quantity
-        self.current_holdings[fill.symbol] += cost
         self.current_holdings['commission'] += fill.commission
         self.current_holdings['cash'] -= (cost + fill.commission)
         self.current_holdings['total'] -= (cost + fill.commission)
@@ -189,7 +171,7 @@ class NaivePortfolio(Portfolio):
         Updates the portfolio current positions and holdings
         from a FillEvent.
         """
-        if event.type == 'FILL':
+        if event.type == EventType.FILL:
             self.update_positions_from_fill(event)
             self.update_holdings_from_fill(event)
 
@@ -206,17 +188,17 @@ class NaivePortfolio(Portfolio):
         direction = signal.signal_type
 
         market_quantity = 100
-        current_quantity = self.current_positions[symbol]
+        current_quantity = self.current_positions[self.symbol_index[symbol]]
         order_type = 'MARKET'
 
-        if direction == 'LONG' and current_quantity == 0:
-            return OrderEvent(symbol, order_type, market_quantity, 'BUY', signal.datetime)
-        if direction == 'SHORT' and current_quantity == 0:
-            return OrderEvent(symbol, order_type, market_quantity, 'SELL', signal.datetime)
-        if direction == 'EXIT' and current_quantity > 0:
-            return OrderEvent(symbol, order_type, abs(current_quantity), 'SELL', signal.datetime)
-        if direction == 'EXIT' and current_quantity < 0:
-            return OrderEvent(symbol, order_type, abs(current_quantity), 'BUY', signal.datetime)
+        if direction == SignalType.LONG and current_quantity == 0:
+            return OrderEvent(symbol, order_type, market_quantity, Direction.BUY, signal.datetime)
+        if direction == SignalType.SHORT and current_quantity == 0:
+            return OrderEvent(symbol, order_type, market_quantity, Direction.SELL, signal.datetime)
+        if direction == SignalType.EXIT and current_quantity > 0:
+            return OrderEvent(symbol, order_type, abs(current_quantity), Direction.SELL, signal.datetime)
+        if direction == SignalType.EXIT and current_quantity < 0:
+            return OrderEvent(symbol, order_type, abs(current_quantity), Direction.BUY, signal.datetime)
 
         return None
 
@@ -225,39 +207,51 @@ class NaivePortfolio(Portfolio):
         Acts on a SignalEvent to generate new
         orders based on the portfolio logic.
         """
-        if event.type == 'SIGNAL':
+        if event.type == EventType.SIGNAL:
             order_event = self.generate_naive_order(event)
             self.events.put(order_event)
 
     def create_equity_curve(self):
         """
-        Creates a pandas DataFrame from the all_holdings
-        list of dictionaries.
+        Creates a pandas DataFrame from the holdings
+        recorded in the ledger.
         """
-        curve = pd.DataFrame(self.all_holdings)
-        curve.set_index('datetime', inplace=True)
+        curve = self.ledger.frame()
         curve['returns'] = curve['total'].pct_change()
         curve['equity_curve'] = (1.0 + curve['returns']).cumprod()
         self.equity_curve = curve
 
-    def output_summary_stats(self):
+    def output_summary_stats(self, history=None):
         """
         Creates a list of summary statistics for the portfolio such
-        as Sharpe Ratio and drawdown information.
+        as Sharpe Ratio and drawdown information. The rolling Sharpe ratio
+        and the underwater curve are added to the equity curve.
+
+        Parameters:
+        history - The order history of the execution handler, to add the statistics of the trades.
         """
         self.create_equity_curve()
 
-        total_return = self.equity_curve['equity_curve'][-1]
+        total_return = self.equity_curve['equity_curve'].iloc[-1]
         returns = self.equity_curve['returns']
         pnl = self.equity_curve['equity_curve']
 
-        sharpe_ratio = create_sharpe_ratio(returns)
-        max_dd, dd_duration = create_drawdowns(pnl)
+        prices = None if history is None else {symbol: frame['CLOSING PRICE']
+                                               for symbol, frame in self.bars.latest_symbol_data.items()}
+        report = create_performance_report(returns, pnl, history=history, prices=prices)
+        self.equity_curve['rolling_sharpe'] = report['rolling_sharpe']
+        self.equity_curve['underwater'] = report['underwater']
 
         stats = [("Initial Capital", self.initial_capital),
-                 ("Total Holdings", self.all_holdings[-1]['total']),
+                 ("Total Holdings", self.ledger.latest('total')),
                  ("Total Return", "%0.2f%%" % ((total_return - 1.0) * 100.0)),
-                 ("Sharpe Ratio", "%0.2f" % sharpe_ratio),
-                 ("Max Drawdown", "%0.2f%%" % (max_dd * 100.0)),
-                 ("Drawdown Duration", "%d" % dd_duration)]
+                 ("Sharpe Ratio", "%0.2f" % report['sharpe_ratio']),
+                 ("Sortino Ratio", "%0.2f" % report['sortino_ratio']),
+                 ("Calmar Ratio", "%0.2f" % report['calmar_ratio']),
+                 ("Max Drawdown", "%0.2f%%" % (report['max_drawdown'] * 100.0)),
+                 ("Drawdown Duration", "%d" % report['drawdown_duration'])]
+
+        if history is not None:
+            stats.extend((name.replace('_', ' ').title(), value) for name, value in report['trades'].items())
+
         return stats
@@ -0,0 +1,186 @@
+"""
+Module for caching the results of backtests on disk. A result is addressed
+by a hash of the digests of the symbol files it read and of the strategy and
+portfolio configuration, so running the same backtest on the same data again
+returns the stored ledger, orders and statistics instead of recomputing them,
+and any change to the data or the configuration is a different entry.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import zipfile
+
+import numpy as np
+
+from backtesting.artifacts import MANIFEST, load_run, write_run
+from backtesting.cache import file_digest, symbol_digest
+
+# Bump when the engine, the strategies or the portfolios change their results
+RESULT_VERSION = 2
+
+
+def data_digests(data_dir, symbol_list, storage='csv'):
+    """
+    Returns the digest of the file of every symbol.
+    """
+    if storage == 'csv':
+        return {symbol: symbol_digest(os.path.join(data_dir, '%s.csv' % symbol)) for symbol in symbol_list}
+
+    return {symbol: file_digest(os.path.join(data_dir, '%s.%s' % (symbol, storage))) for symbol in symbol_list}
+
+
+def result_key(digests, config):
+    """
+    Hashes the data digests and a JSON serializable configuration of the
+    run, such as the dates, the strategy and the portfolio with their
+    parameters, into the key of the result.
+    """
+    payload = json.dumps({'version': RESULT_VERSION, 'data': digests, 'config': config},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def plain(value):
+    """
+    Converts NumPy scalars to Python ones, so the statistics can be stored as JSON.
+    """
+    return value.item() if isinstance(value, np.generic) else value
+
+
+class ResultCache(object):
+    """
+    Keeps one compressed run directory per key. Reading an entry marks it
+    as recently used, and when the cache grows past its size limit the
+    least recently used entries are removed until it is back under a low
+    mark. Entries are written under a temporary name and renamed, so
+    concurrent workers never see a partial entry.
+
+    The size of the cache is counted once and then kept up to date with the
+    entries written by this object, so a write does not list the whole
+    cache. Entries written by other processes are counted at the next
+    eviction, which lists the cache again.
+    """
+
+    def __init__(self, directory, max_bytes=1 << 30, low_mark=0.9):
+        """
+        Parameters:
+        directory - The directory of the cache.
+        max_bytes - The size the cache is kept under.
+        low_mark - The fraction of max_bytes an eviction shrinks the cache to.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.low_mark = low_mark
+        self.size = None  # counted on the first write
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key, stats=()):
+        """
+        Returns the RunArtifacts of the key, or None if it is not cached,
+        cannot be read or lacks any of the named statistics. The statistics
+        are in its metadata under 'stats'.
+        """
+        manifest = os.path.join(self.path(key), MANIFEST)
+
+        try:
+            os.utime(manifest)
+            artifacts = load_run(self.path(key))
+
+            if not all(name in artifacts.metadata['stats'] for name in stats):
+                return None
+        except (OSError, ValueError, KeyError, TypeError, zipfile.BadZipFile):
+            return None
+
+        return artifacts
+
+    def put(self, key, bars, portfolio, broker, stats, config=None):
+        """
+        Stores the ledger and the orders of a finished run with its statistics.
+
+        Parameters:
+        key - The key of the run.
+        bars, portfolio, broker - The components of the run.
+        stats - A dictionary of named lists of (name, value) statistics.
+        config - The configuration of the run, kept for reference.
+        """
+        stats = {name: [(label, plain(value)) for label, value in values] for name, values in stats.items()}
+        temporary = self.path('{}.tmp-{}'.format(key, os.getpid()))
+
+        write_run(temporary, bars, portfolio, broker, compress=True, include_bars=False,
+                  metadata={'stats': stats, 'config': config})
+        size = self.entry_size(temporary)
+
+        try:
+            replaced = self.entry_size(self.path(key))
+        except OSError:
+            replaced = 0
+
+        try:
+            os.rename(temporary, self.path(key))
+        except OSError:
+            # Replaces an entry with fewer statistics, or the same one stored by another process
+            shutil.rmtree(self.path(key), ignore_errors=True)
+
+            try:
+                os.rename(temporary, self.path(key))
+            except OSError:
+                shutil.rmtree(temporary, ignore_errors=True)
+
+        if self.size is None:
+            self.size = sum(entry_size for _, entry_size, _ in self.entries())
+        else:
+            self.size += size - replaced
+
+        if self.size > self.max_bytes:
+            self.evict()
+
+        return self.get(key)
+
+    @staticmethod
+    def entry_size(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+    def entries(self):
+        """
+        Returns the (last used, size, key) of every complete entry.
+        """
+        entries = []
+
+        for key in os.listdir(self.directory):
+            if '.tmp-' in key:
+                continue
+
+            path = self.path(key)
+
+            try:
+                used = os.stat(os.path.join(path, MANIFEST)).st_mtime
+                size = self.entry_size(path)
+            except OSError:
+                continue
+
+            entries.append((used, size, key))
+
+        return entries
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits under
+        the low mark of its size limit, so the next writes do not evict again.
+        """
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * self.low_mark
+
+        for _, size, key in entries:
+            if total <= target:
+                break
+
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            total -= size
+
+        self.size = total
@@ -0,0 +1,88 @@
+"""
+Module for storing the market data in Parquet files, as an alternative to
+the CSVs. Parquet keeps every column compressed and typed, so a reader can
+load only the columns and the date range it needs without parsing text.
+
+pyarrow is only imported when Parquet is used, so it stays optional.
+"""
+
+import os
+
+import pandas as pd
+
+
+def _import_parquet():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("The Parquet storage requires pyarrow, install it with: pip install pyarrow")
+
+    return pyarrow, pyarrow.parquet
+
+
+def _date_filters(column, start_date=None, end_date=None):
+    filters = []
+
+    if start_date is not None:
+        filters.append((column, '>=', pd.Timestamp(start_date)))
+    if end_date is not None:
+        filters.append((column, '<=', pd.Timestamp(end_date)))
+
+    return filters or None
+
+
+def write_symbol_parquet(df, path, compression='zstd'):
+    """
+    Writes the bars of a symbol, indexed by date, to a Parquet file.
+    """
+    pa, pq = _import_parquet()
+    pq.write_table(pa.Table.from_pandas(df), path, compression=compression)
+
+
+def read_symbol_parquet(path, columns=None, start_date=None, end_date=None):
+    """
+    Reads the bars of a symbol from a Parquet file. Only the given columns
+    are read, and the rows outside of the date range are skipped using the
+    statistics of the file.
+
+    Parameters:
+    path - The Parquet file of the symbol.
+    columns - The columns to read, all of them by default.
+    start_date - The first date to read, if any.
+    end_date - The last date to read, if any.
+    """
+    pa, pq = _import_parquet()
+    index_name = pq.read_schema(path).pandas_metadata['index_columns'][0]
+    table = pq.read_table(path, columns=None if columns is None else list(columns) + [index_name],
+                          filters=_date_filters(index_name, start_date, end_date))
+    return table.to_pandas()
+
+
+def append_symbol_parquet(df, path, compression='zstd'):
+    """
+    Appends new bars to the Parquet file of a symbol. Parquet files cannot be
+    extended in place, but a symbol is small enough to be rewritten.
+    """
+    if os.path.exists(path):
+        df = pd.concat([pd.read_parquet(path), df], sort=False)
+    write_symbol_parquet(df, path, compression)
+
+
+def write_dataset(df, root, basename='part', compression='zstd'):
+    """
+    Writes the bars of all symbols, indexed by date, to a dataset partitioned
+    by year. Each call adds new files to the partitions, so new days are
+    appended by writing them with a different basename.
+
+    Parameters:
+    df - The bars of all symbols.
+    root - The directory of the dataset.
+    basename - The prefix of the files written by this call.
+    compression - The compression codec of the files.
+    """
+    pa, pq = _import_parquet()
+    df = df.assign(YEAR=df.index.year)
+    pq.write_to_dataset(pa.Table.from_pandas(df), root, partition_cols=['YEAR'], compression=compression,
+                        basename_template=basename + '-{i}.parquet', existing_data_behavior='overwrite_or_ignore')
+
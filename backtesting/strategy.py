@@ -6,7 +6,7 @@ https://www.quantstart.com/articles/Event-Driven-Backtesting-with-Python-Part-IV
 
 from abc import ABCMeta, abstractmethod
 
-from backtesting.event import SignalEvent
+from backtesting.event import SignalEvent, EventType, SignalType
 
 
 class Strategy(object):
@@ -24,6 +24,14 @@ class Strategy(object):
         """
         raise NotImplementedError("Should implement calculate_signals()")
 
+    def calculate_positions(self, closes):
+        """
+        Calculates whether the strategy holds a symbol after every bar,
+        given its whole closing price history as a 1-D array. Strategies
+        implementing it can be run by backtesting.vectorized.
+        """
+        raise NotImplementedError("Should implement calculate_positions() for vectorized backtests")
+
 
 class BuyAndHoldStrategy(Strategy):
     def __init__(self, bars, events):
@@ -43,12 +51,12 @@ class BuyAndHoldStrategy(Strategy):
         return bought
 
     def calculate_signals(self, event):
-        if event.type == 'MARKET':
+        if event.type == EventType.MARKET:
             for symbol in self.symbol_list:
                 bars = self.bars.get_latest_bars(symbol)
 
                 if bars is not None and not bars.empty:
                     if not self.bought[symbol]:
-                        signal = SignalEvent(symbol, bars.iloc[0].name, 'LONG')
+                        signal = SignalEvent(symbol, bars.iloc[0].name, SignalType.LONG)
                         self.events.put(signal)
                         self.bought[symbol] = True
@@ -0,0 +1,186 @@
+"""
+Module for running strategies whose signals only depend on the closing price
+history in a single vectorized pass, instead of bar by bar through the event
+queue. The event-driven engine stays the reference for live-like behaviour;
+this module reproduces its holdings and order history for research runs.
+"""
+
+import numpy as np
+
+from backtesting.event import Direction
+from backtesting.indicators import rolling_mean  # the same means as the event-driven indicators
+
+
+def hold_states(enter, leave):
+    """
+    Converts entry and exit conditions into the "bought" state of a strategy
+    after every bar. The state is set by an entry, cleared by an exit and
+    carried over when neither condition holds.
+
+    Parameters:
+    enter - A boolean array, True where a LONG signal is given.
+    leave - A boolean array, True where an EXIT signal is given.
+    """
+    state = np.full(len(enter), np.nan)
+    state[leave] = 0.0
+    state[enter] = 1.0
+
+    last = np.where(np.isnan(state), 0, np.arange(len(state)))
+    np.maximum.accumulate(last, out=last)
+    state = state[last]
+    return np.nan_to_num(state) > 0
+
+
+class VectorizedBacktest(object):
+    """
+    Runs a strategy implementing calculate_positions() over the whole history
+    of a data handler at once. Supports the greedy portfolios, which split
+    their capital into per-symbol cash and buy as much as it allows on LONG
+    signals, filling orders at the closing price of the signal bar.
+    """
+
+    def __init__(self, bars, strategy, portfolio, broker=None, column='CLOSING PRICE'):
+        """
+        Parameters:
+        bars - The DataHandler object with the market data.
+        strategy - The Strategy object that calculates the positions.
+        portfolio - A freshly constructed greedy Portfolio object.
+        broker - The ExecutionHandler whose order history is filled, if any.
+        column - The price column the strategy and the fills use.
+        """
+        self.bars = bars
+        self.strategy = strategy
+        self.portfolio = portfolio
+        self.broker = broker
+        self.column = column
+        self.symbol_list = self.bars.symbol_list
+
+        if getattr(self.portfolio, 'current_cash', None) is None:
+            raise ValueError("Vectorized backtests need a portfolio with per-symbol cash")
+        if getattr(self.portfolio, 'rebalance', None) is not None:
+            raise ValueError("Vectorized backtests do not support rebalancing portfolios")
+
+    def _load_closes(self):
+        panel = self.bars.panel
+        closes = panel.field(self.column)[:, [panel.symbol_index[symbol] for symbol in self.symbol_list]]
+        return panel.index, closes
+
+    @staticmethod
+    def _commission(quantity):
+        # Same as FillEvent.calculate_commission()
+        return max(quantity * 0.05, 5.0)
+
+    def _simulate_symbol(self, closes, states, cash):
+        """
+        Walks through the bars where the state of the strategy changes, which
+        are usually few, and returns the quantity, cash and commission of the
+        symbol after every trade together with the orders.
+        """
+        changes = np.flatnonzero(np.diff(np.concatenate(([False], states)).astype(np.int8)))
+        quantity = 0.0
+        commission = 0.0
+        trades, quantities, cashes, commissions, orders = [], [], [], [], []
+
+        for index in changes:
+            price = closes[index]
+
+            if states[index]:
+                # Without cash, as for symbols the optimizer gave no weight, nothing is bought
+                if quantity != 0 or not cash / price > 0:
+                    continue
+                order_quantity, direction = cash / price, Direction.BUY
+            else:
+                if quantity == 0:
+                    continue
+                order_quantity, direction = abs(quantity), Direction.SELL if quantity > 0 else Direction.BUY
+
+            sign = 1 if direction == Direction.BUY else -1
+            fee = self._commission(order_quantity)
+            quantity += sign * order_quantity
+            cash -= sign * price * order_quantity + fee
+            commission += fee
+
+            trades.append(index)
+            quantities.append(quantity)
+            cashes.append(cash)
+            commissions.append(commission)
+            orders.append((index, order_quantity, direction))
+
+        return np.array(trades, dtype=np.int64), quantities, cashes, commissions, orders
+
+    @staticmethod
+    def _step(trades, values, initial, length):
+        """
+        Expands the values after each trade into one value per bar.
+        """
+        last = np.searchsorted(trades, np.arange(length), side='right') - 1
+        values = np.concatenate(([initial], values))
+        return values[last + 1]
+
+    def run(self):
+        """
+        Runs the backtest, filling the ledger of the portfolio and the order history of the broker as the event-driven
+        engine would, and returns the portfolio.
+        """
+        dates, closes = self._load_closes()
+        length, width = closes.shape
+        initial_cash = np.array(self.portfolio.current_cash, dtype=np.float64)
+
+        quantities = np.zeros((length, width))
+        cash = np.zeros((length, width))
+        commission = np.zeros((length, width))
+
+        for j, symbol in enumerate(self.symbol_list):
+            states = np.asarray(self.strategy.calculate_positions(closes[:, j]), dtype=bool)
+            trades, qty, symbol_cash, fees, orders = self._simulate_symbol(closes[:, j], states, initial_cash[j])
+
+            quantities[:, j] = self._step(trades, qty, 0.0, length)
+            cash[:, j] = self._step(trades, symbol_cash, initial_cash[j], length)
+            commission[:, j] = self._step(trades, fees, 0.0, length)
+
+            if self.broker is not None and orders:
+                # The dates of all of the orders are looked up at once, indexing them one by one is slow
+                order_dates = dates[trades].tolist()
+                self.broker.history[symbol].extend({'date': date, 'qty': order_quantity, 'direction': direction}
+                                                   for date, (_, order_quantity, direction) in zip(order_dates, orders))
+
+        self._record(dates, closes, quantities, cash, commission, initial_cash)
+
+        self.bars.panel.cursor = len(self.bars.panel)
+        self.bars.continue_backtest = False
+
+        return self.portfolio
+
+    def _record(self, dates, closes, quantities, cash, commission, initial_cash):
+        """
+        Writes the records of the portfolio. The record of every bar reflects
+        the trades of the previous bars valued at the current close, and the
+        final record repeats the last bar after its trades, as the last
+        MarketEvent of the data handler does in the event-driven engine.
+        """
+        portfolio = self.portfolio
+        length = len(dates)
+        capital = portfolio.initial_capital
+
+        # Holdings before the trades of each bar, plus the final bar after them
+        rows = np.concatenate((np.arange(-1, length - 1), [length - 1]))
+        prices = closes[np.concatenate((np.arange(length), [length - 1]))]
+        before = rows >= 0
+
+        qty = np.where(before[:, None], quantities[rows], 0.0)
+        symbol_cash = np.where(before[:, None], cash[rows], initial_cash)
+        fees = np.where(before, commission[rows].sum(axis=1), 0.0)
+
+        market_values = np.where(qty != 0, qty * prices, 0.0)
+        remaining_cash = capital + (symbol_cash - initial_cash).sum(axis=1)
+        totals = remaining_cash + market_values.sum(axis=1)
+        record_dates = np.concatenate((dates, dates[-1:]))
+
+        portfolio.ledger.extend(record_dates, qty, market_values,
+                                np.column_stack((remaining_cash, fees, totals)), symbol_cash)
+
+        portfolio.current_positions[:] = quantities[-1]
+        portfolio.current_cash[:] = cash[-1]
+        portfolio.current_holdings['remaining_cash'] = remaining_cash[-1]
+        portfolio.current_holdings['commission'] = fees[-1]
+        portfolio.current_holdings['total'] = remaining_cash[-1]
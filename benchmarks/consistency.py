@@ -0,0 +1,103 @@
+"""
+Checks that the vectorized backtests give the same orders, positions and
+holdings as the event-driven engine on synthetic data, for every strategy implementing
+calculate_positions() and every portfolio the vectorized mode supports.
+
+Usage:
+    python -m benchmarks.consistency --symbols 20 --years 4
+
+The run exits with an error when any pair of runs differs.
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+from backtesting.engine import Backtest
+from backtesting.execution import SimulatedExecutionHandler
+from backtesting.vectorized import VectorizedBacktest
+from benchmarks.run import STRATEGIES, Context
+from naive_greedy_portfolio import NaiveGreedyPortfolio
+from optimized_greedy_portfolio import OptimizedGreedyPortfolio
+
+PORTFOLIOS = [NaiveGreedyPortfolio, OptimizedGreedyPortfolio]
+
+
+def run_backtest(context, strategy_class, params, portfolio_class, vectorized):
+    """
+    Returns the order history and the ledger of a backtest.
+    """
+    bars = context.data_handler()
+    strategy = strategy_class(bars, bars.events, *params)
+    portfolio = portfolio_class(bars, bars.events, context.start_date)
+    broker = SimulatedExecutionHandler(bars.events, context.symbol_list)
+
+    if vectorized:
+        VectorizedBacktest(bars, strategy, portfolio, broker).run()
+    else:
+        Backtest(bars, bars.events, strategy, portfolio, broker).run()
+
+    return broker.history, portfolio.ledger
+
+
+def differences(event_driven, vectorized):
+    """
+    Returns a description of every difference between the results of the two runs.
+    """
+    (orders, ledger), (vectorized_orders, vectorized_ledger) = event_driven, vectorized
+    found = []
+
+    for symbol, history in orders.items():
+        if history != vectorized_orders[symbol]:
+            found.append('orders of {}'.format(symbol))
+
+    if ledger.size != vectorized_ledger.size:
+        return found + ['ledger size']
+
+    for name in ledger.array_names:
+        values, vectorized_values = getattr(ledger, name)[:ledger.size], getattr(vectorized_ledger, name)[:ledger.size]
+
+        if name == 'holdings':
+            # The account columns are sums over the symbols, added up in a different order
+            equal = (np.array_equal(values[:, :len(ledger.symbol_list)],
+                                    vectorized_values[:, :len(ledger.symbol_list)], equal_nan=True)
+                     and np.allclose(values, vectorized_values, rtol=1e-12, atol=0.0, equal_nan=True))
+        else:
+            equal = np.array_equal(values, vectorized_values, equal_nan=True)
+
+        if not equal:
+            found.append('ledger {}'.format(name))
+
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares vectorized and event-driven backtests on synthetic data.')
+    parser.add_argument('--symbols', type=int, default=20, help='the number of synthetic symbols')
+    parser.add_argument('--years', type=float, default=4, help='the number of years of synthetic bars')
+    args = parser.parse_args()
+
+    csv_dir = tempfile.mkdtemp(prefix='bist-consistency-')
+    failures = 0
+
+    try:
+        context = Context(args.symbols, args.years, csv_dir)
+
+        for strategy_class, params in STRATEGIES:
+            for portfolio_class in PORTFOLIOS:
+                name = '{}/{}'.format(strategy_class.__name__, portfolio_class.__name__)
+                found = differences(run_backtest(context, strategy_class, params, portfolio_class, False),
+                                    run_backtest(context, strategy_class, params, portfolio_class, True))
+                failures += bool(found)
+                print('{:<70} {}'.format(name, 'differs in ' + ', '.join(found) if found else 'identical'))
+    finally:
+        shutil.rmtree(csv_dir)
+
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
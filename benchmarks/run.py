@@ -0,0 +1,297 @@
+"""
+Times the hot paths of the backtester on synthetic data and compares them
+with a saved baseline. Every benchmark reports its best time over a number
+of repeats, its throughput in symbol-bars per second and the peak memory it
+allocates, measured in a separate run with tracemalloc.
+
+Usage:
+    python -m benchmarks.run --symbols 50 --years 5
+    python -m benchmarks.run --save-baseline
+
+The results are written to benchmarks/results/, and the run exits with an
+error when a benchmark is slower than the baseline by more than the tolerance.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from backtesting.data import BistDataHandler
+from backtesting.engine import Backtest, EventQueue
+from backtesting.execution import SimulatedExecutionHandler
+from backtesting.performance import create_drawdowns
+from benchmarks.synthetic import generate_frames, write_csvs
+from naive_greedy_portfolio import NaiveGreedyPortfolio
+from optimized_greedy_portfolio import OptimizedGreedyPortfolio
+from simple_moving_average import SimpleMovingAverageStrategy
+from simple_moving_average_ribbon import SimpleMovingAverageRibbonStrategy
+from simpler_simple_moving_average import SimplerSimpleMovingAverageStrategy
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STRATEGIES = [
+    (SimpleMovingAverageStrategy, (40, 100)),
+    (SimplerSimpleMovingAverageStrategy, (40,)),
+    (SimpleMovingAverageRibbonStrategy, ([10, 20, 30, 40, 50, 60],)),
+]
+
+
+class Context(object):
+    """
+    The synthetic data shared by the benchmarks.
+    """
+
+    def __init__(self, symbols, years, csv_dir):
+        self.frames = generate_frames(symbols, years)
+        self.symbol_list = sorted(self.frames)
+        self.csv_dir = csv_dir
+        first_date = min(frame.index[0] for frame in self.frames.values())
+        self.start_date = (first_date + pd.Timedelta(days=365)).date()  # a year of history for the optimizer
+
+        write_csvs(self.frames, csv_dir)
+
+    def data_handler(self, **kwargs):
+        kwargs.setdefault('frames', self.frames)
+        return BistDataHandler(EventQueue(), self.csv_dir, self.symbol_list, self.start_date, **kwargs)
+
+
+def symbol_bars(bars):
+    return len(bars.panel) * len(bars.symbol_list)
+
+
+def time_replay(bars, callback):
+    """
+    Releases every bar and times the whole step, update_bars() and the
+    callback that is called after it. The indicators the callback
+    registered are updated in update_bars(), so timing only the callback
+    would leave out most of their cost; compare with update_bars alone.
+    """
+    start = time.perf_counter()
+
+    while bars.continue_backtest:
+        bars.update_bars()
+        callback(bars.market_event)
+        bars.events.clear()
+
+    return time.perf_counter() - start
+
+
+def bench_read_csv(context):
+    start = time.perf_counter()
+    bars = context.data_handler(frames=None, use_cache=False)
+    return time.perf_counter() - start, symbol_bars(bars)
+
+
+def bench_read_cached(context):
+    context.data_handler(frames=None)  # makes sure the cache exists
+    start = time.perf_counter()
+    bars = context.data_handler(frames=None)
+    return time.perf_counter() - start, symbol_bars(bars)
+
+
+def bench_update_bars(context):
+    bars = context.data_handler()
+    start = time.perf_counter()
+
+    while bars.continue_backtest:
+        bars.update_bars()
+        bars.events.clear()
+
+    return time.perf_counter() - start, symbol_bars(bars)
+
+
+def bench_signals(strategy_class, params):
+    def bench(context):
+        bars = context.data_handler()
+        strategy = strategy_class(bars, bars.events, *params)
+        return time_replay(bars, strategy.calculate_signals), symbol_bars(bars)
+
+    return bench
+
+
+def bench_time_index(portfolio_class):
+    def bench(context):
+        bars = context.data_handler()
+        portfolio = portfolio_class(bars, bars.events, context.start_date)
+        return time_replay(bars, portfolio.update_time_index), symbol_bars(bars)
+
+    return bench
+
+
+def bench_simulate(context):
+    bars = context.data_handler()
+    stocks = pd.concat([bars.historical_symbol_data[symbol]['CLOSING PRICE'] for symbol in context.symbol_list],
+                       axis=1)
+    start = time.perf_counter()
+    OptimizedGreedyPortfolio.simulate(stocks, 5000)
+    return time.perf_counter() - start, len(stocks) * len(context.symbol_list)
+
+
+def bench_drawdowns(context):
+    random = np.random.RandomState(0)
+    pnl = pd.Series(np.exp(np.cumsum(random.normal(0.0, 0.01, 100000))))
+    start = time.perf_counter()
+    create_drawdowns(pnl)
+    return time.perf_counter() - start, len(pnl)
+
+
+def bench_backtest(context):
+    bars = context.data_handler()
+    strategy = SimpleMovingAverageStrategy(bars, bars.events, 40, 100)
+    portfolio = NaiveGreedyPortfolio(bars, bars.events, context.start_date)
+    broker = SimulatedExecutionHandler(bars.events, context.symbol_list)
+
+    start = time.perf_counter()
+    Backtest(bars, bars.events, strategy, portfolio, broker).run()
+    return time.perf_counter() - start, symbol_bars(bars)
+
+
+BENCHMARKS = [
+    ('read_data[csv]', bench_read_csv),
+    ('read_data[cache]', bench_read_cached),
+    ('update_bars', bench_update_bars),
+] + [
+    ('bar_step[calculate_signals, %s]' % strategy_class.__name__, bench_signals(strategy_class, params))
+    for strategy_class, params in STRATEGIES
+] + [
+    ('bar_step[update_time_index, %s]' % portfolio_class.__name__, bench_time_index(portfolio_class))
+    for portfolio_class in (NaiveGreedyPortfolio, OptimizedGreedyPortfolio)
+] + [
+    ('simulate', bench_simulate),
+    ('create_drawdowns', bench_drawdowns),
+    ('backtest[SMA, NaiveGreedy]', bench_backtest),
+]
+
+
+def run_benchmark(bench, context, repeat):
+    """
+    Returns the best time, the throughput and the peak memory of a benchmark.
+    """
+    timings = []
+
+    for _ in range(repeat):
+        seconds, bars = bench(context)
+        timings.append(seconds)
+
+    tracemalloc.start()
+    try:
+        bench(context)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    seconds = min(timings)
+    return {
+        'seconds': seconds,
+        'bars': bars,
+        'bars_per_second': bars / seconds if seconds > 0 else float('inf'),
+        'peak_memory_bytes': peak,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the benchmarks that are slower than the baseline by more than
+    the tolerance, with the ratio of their times.
+    """
+    regressions = {}
+
+    for name, result in results.items():
+        previous = baseline.get(name)
+
+        if previous is not None and result['seconds'] > previous['seconds'] * (1.0 + tolerance):
+            regressions[name] = result['seconds'] / previous['seconds']
+
+    return regressions
+
+
+def print_report(results, baseline, regressions):
+    print('{:<66} {:>10} {:>14} {:>10} {:>9}'.format('benchmark', 'seconds', 'bars/s', 'peak MiB', 'baseline'))
+
+    for name, result in results.items():
+        ratio = ''
+        if name in baseline:
+            ratio = '{:.2f}x'.format(result['seconds'] / baseline[name]['seconds'])
+
+        print('{:<66} {:>10.4f} {:>14,.0f} {:>10.1f} {:>9}{}'.format(
+            name, result['seconds'], result['bars_per_second'], result['peak_memory_bytes'] / 2.0 ** 20, ratio,
+            '  REGRESSION' if name in regressions else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Times the hot paths of the backtester on synthetic data.')
+    parser.add_argument('--symbols', type=int, default=20, help='the number of synthetic symbols')
+    parser.add_argument('--years', type=float, default=4, help='the number of years of synthetic bars')
+    parser.add_argument('--repeat', type=int, default=3, help='the number of timed runs of every benchmark')
+    parser.add_argument('--filter', default='', help='only run the benchmarks whose name contains this')
+    parser.add_argument('--baseline', default=os.path.join(BENCHMARK_DIR, 'baseline.json'),
+                        help='the results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='the slowdown flagged as a regression')
+    parser.add_argument('--save-baseline', action='store_true', help='save the results as the new baseline')
+    args = parser.parse_args()
+
+    csv_dir = tempfile.mkdtemp(prefix='bist-bench-')
+
+    try:
+        context = Context(args.symbols, args.years, csv_dir)
+        results = {}
+
+        for name, bench in BENCHMARKS:
+            if args.filter in name:
+                results[name] = run_benchmark(bench, context, args.repeat)
+    finally:
+        shutil.rmtree(csv_dir)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as baseline_file:
+            previous = json.load(baseline_file)
+
+        # Timings of a different data size are not comparable
+        if previous['meta']['symbols'] == args.symbols and previous['meta']['years'] == args.years:
+            baseline = previous['results']
+        else:
+            print("Ignoring the baseline, which was run on different data")
+
+    regressions = compare(results, baseline, args.tolerance)
+    print_report(results, baseline, regressions)
+
+    report = {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'symbols': args.symbols,
+            'years': args.years,
+            'repeat': args.repeat,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+        },
+        'results': results,
+        'regressions': regressions,
+    }
+
+    results_dir = os.path.join(BENCHMARK_DIR, 'results')
+    os.makedirs(results_dir, exist_ok=True)
+    output = os.path.join(results_dir, datetime.datetime.now().strftime('%Y%m%d-%H%M%S.json'))
+
+    for path in [output] + ([args.baseline] if args.save_baseline else []):
+        with open(path, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+        print("Wrote the results to: {}".format(path))
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Generates synthetic market data shaped like the symbol CSVs that bist_csv.py
+writes to data/bist/symbols: one file per symbol indexed by TRADE DATE, with
+the symbol code and the daily prices and volumes. Prices follow random walks,
+symbols are listed at different dates and a few days are missing, so that
+the data exercises the same alignment code as the real data.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ['INSTRUMENT SERIES CODE', 'OPENING PRICE', 'LOWEST PRICE', 'HIGHEST PRICE', 'CLOSING PRICE',
+           'TOTAL TRADED VALUE', 'TOTAL TRADED VOLUME', 'TOTAL NUMBER OF CONTRACTS']
+
+
+def generate_frames(symbols=10, years=3, start_date='2015-12-01', seed=0):
+    """
+    Returns a dictionary of DataFrames, one per symbol.
+
+    Parameters:
+    symbols - The number of symbols.
+    years - The number of years of trading days.
+    start_date - The first trading day.
+    seed - The seed of the random number generator.
+    """
+    random = np.random.RandomState(seed)
+    calendar = pd.bdate_range(start_date, periods=int(252 * years), name='TRADE DATE')
+    frames = {}
+
+    for i in range(symbols):
+        # Most symbols trade from the start, the others are listed later
+        listed = 0 if random.rand() < 0.8 else random.randint(0, len(calendar) // 2)
+        dates = calendar[listed:]
+        dates = dates[random.rand(len(dates)) > 0.01]
+
+        close = 10.0 * np.exp(np.cumsum(random.normal(0.0002, 0.02, len(dates))))
+        opening = close * np.exp(random.normal(0.0, 0.005, len(dates)))
+        spread = np.abs(random.normal(0.0, 0.01, len(dates)))
+        volume = random.lognormal(12.0, 1.0, len(dates)).round()
+
+        frames['SYM%03d.E' % i] = pd.DataFrame({
+            'INSTRUMENT SERIES CODE': 'SYM%03d.E' % i,
+            'OPENING PRICE': opening.round(2),
+            'LOWEST PRICE': (np.minimum(opening, close) * (1.0 - spread)).round(2),
+            'HIGHEST PRICE': (np.maximum(opening, close) * (1.0 + spread)).round(2),
+            'CLOSING PRICE': close.round(2),
+            'TOTAL TRADED VALUE': (volume * close).round(2),
+            'TOTAL TRADED VOLUME': volume,
+            'TOTAL NUMBER OF CONTRACTS': (volume / 100.0).round(),
+        }, index=dates, columns=COLUMNS)
+
+    return frames
+
+
+def write_csvs(frames, directory):
+    """
+    Writes the frames to one CSV per symbol, as bist_csv.write_symbols does.
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    for symbol, frame in frames.items():
+        frame.to_csv(os.path.join(directory, '%s.csv' % symbol))
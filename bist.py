@@ -1,4 +1,5 @@
 import datetime
+import io
 import requests
 import zipfile as zf
 import pandas as pd
@@ -40,69 +41,131 @@ def create_urls(date):
     print (url)
     return url, zip_file_path, csv_file_path
 
-def get_data(date):
+def read_zip_csv(source, **kwargs):
+    """
+    Parses the CSV inside a zip archive, streaming the member into
+    pd.read_csv without extracting it to disk.
+
+    Parameters:
+    source - The path of the archive, or its contents as bytes.
+    kwargs - The arguments of pd.read_csv.
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    with zf.ZipFile(source, 'r') as archive:
+        member = next(name for name in archive.namelist() if name.lower().endswith('.csv'))
+        with archive.open(member) as file:
+            return pd.read_csv(file, **kwargs)
+
+def get_data(date, keep_zip=False, extract=False):
     url, zip_file_path,csv_file_path = create_urls(date)
     zip_file = requests.get(url)
     status = zip_file.status_code
     if status == 200:
-        with open("./data/downloads/" + zip_file_path,'wb') as output:
-            output.write(zip_file.content)
-        with zf.ZipFile("./data/downloads/" + zip_file_path,'r') as zip_file:
-            zip_file.extractall("./data/downloads/")
-        with open ("./data/downloads/" + csv_file_path,'r') as file:
-            df = pd.read_csv(file, header = 0, delimiter= ";", 
-                                 skiprows= 1)
+        if keep_zip or extract:
+            with open("./data/downloads/" + zip_file_path,'wb') as output:
+                output.write(zip_file.content)
+        if extract:
+            with zf.ZipFile("./data/downloads/" + zip_file_path,'r') as archive:
+                archive.extractall("./data/downloads/")
+        df = read_zip_csv(zip_file.content, header = 0, delimiter= ";", skiprows= 1)
     else :
         df = None
     return df, status
 
-def check_db_exists():
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-    start_date = datetime.date(2017,10,19)
-    cur.execute("select name from sqlite_master where type = 'table'")
-    tables = cur.fetchall()
-    print (tables)
-    if len(tables)==0 or ("bist" not in tables[0]):
-        print (start_date)
-        df, status= get_data(start_date)
-        alter_column_names(df)
-        df.to_sql("bist", conn, if_exists = "append", index = False)
-        cur.execute("create table 'saved_values' (date date, status integer)")
-        date = (str(start_date), 1)
-        cur.execute("insert into 'saved_values'(date, status) values (?,?)",
-                    (date))
-        conn.commit()
-    cur.execute("select date from 'saved_values'")
-    saved_dates = cur.fetchall()
-    date = max(saved_dates)[0].split("-")
-    from_date = datetime.date(int(date[0]),int(date[1]),int(date[2]))
-    return conn, cur, saved_dates, from_date
-
-def main():
-    conn, cur, saved_dates, fromdate = check_db_exists()
+def connect(path=db_path):
+    """
+    Opens the database in WAL mode, so that backtests can read
+    it while new days are being written.
+    """
+    conn = sqlite3.connect(path)
+    conn.execute("pragma journal_mode = wal")
+    conn.execute("pragma synchronous = normal")
+    return conn
+
+def get_table_columns(conn, table):
+    return [row[1] for row in conn.execute("pragma table_info('{}')".format(table))]
+
+def get_sql_type(dtype):
+    if pd.api.types.is_integer_dtype(dtype):
+        return "integer"
+    if pd.api.types.is_float_dtype(dtype):
+        return "real"
+    return "text"
+
+def ensure_columns(conn, df, table="bist"):
+    """
+    Creates the table from the columns of the first day, and adds the
+    columns that later days introduce, along with the index on
+    (symbol, trade date) that the data handler queries by.
+    """
+    columns = get_table_columns(conn, table)
+    if not columns:
+        definitions = ", ".join('"{}" {}'.format(column, get_sql_type(dtype)) for column, dtype in df.dtypes.items())
+        conn.execute("create table '{}' ({})".format(table, definitions))
+    else:
+        for column, dtype in df.dtypes.items():
+            if column not in columns:
+                conn.execute("alter table '{}' add column \"{}\" {}".format(table, column, get_sql_type(dtype)))
+
+    conn.execute("create index if not exists '{0}_symbol_date' on '{0}' "
+                 "(INSTRUMENT_SERIES_CODE, TRADE_DATE)".format(table))
+
+def normalize_dates(df, column="TRADE_DATE"):
+    """
+    Stores the dates as ISO strings, which SQLite compares in date order.
+    """
+    df[column] = pd.to_datetime(df[column]).dt.strftime("%Y-%m-%d")
+
+def insert_rows(conn, df, table="bist"):
+    ensure_columns(conn, df, table)
+    columns = ", ".join('"{}"'.format(column) for column in df.columns)
+    placeholders = ", ".join("?" * len(df.columns))
+    values = df.astype(object).where(df.notna(), None)
+    conn.executemany("insert into '{}' ({}) values ({})".format(table, columns, placeholders),
+                     values.itertuples(index=False, name=None))
+
+def write_batch(conn, frames, statuses):
+    """
+    Writes the days of a batch and their statuses in one transaction.
+    """
+    with conn:
+        if frames:
+            insert_rows(conn, pd.concat(frames, sort=False, ignore_index=True))
+        conn.executemany("insert or replace into 'saved_values'(date, status) values (?, ?)", statuses)
+
+def check_db_exists(conn):
+    conn.execute("create table if not exists 'saved_values' (date date primary key, status integer)")
+    saved_dates = {row[0] for row in conn.execute("select date from 'saved_values'")}
+    return saved_dates
+
+def main(batch_size=100):
+    conn = connect()
+    saved_dates = check_db_exists(conn)
     fromdate = datetime.date(2015,12,1)
     today = datetime.date.today()
+    frames, statuses = [], []
+
     while fromdate != today:
-        date_to_save =(str(fromdate),)
+        date_to_save = str(fromdate)
         if (fromdate.weekday()) <5 and (date_to_save not in saved_dates):
             print (date_to_save)
             df, status = get_data(fromdate)
             if status == 200:
                 alter_column_names(df)
-                df.to_sql("bist", conn, if_exists = "append", index = False)
-                cur.execute("insert into 'saved_values'(date, status) values (?, ?)",
-                            ((date_to_save[0],1)))
-                conn.commit()
-                saved_dates.append(date_to_save)
+                normalize_dates(df)
+                frames.append(df)
+                statuses.append((date_to_save, 1))
             else:
-                cur.execute("insert into 'saved_values'(date, status) values (?, ?)",
-                            ((date_to_save[0],0)))
-                conn.commit()                
-        fromdate += datetime.timedelta(days=1)
-    cur.close()
+                statuses.append((date_to_save, 0))
+            saved_dates.add(date_to_save)
 
+            if len(statuses) >= batch_size:
+                write_batch(conn, frames, statuses)
+                frames, statuses = [], []
+        fromdate += datetime.timedelta(days=1)
 
+    write_batch(conn, frames, statuses)
     conn.close()
     return
 
@@ -1,11 +1,23 @@
-import os
+import argparse
 import datetime
+import json
+import os
 import requests
+import shutil
 import zipfile
 import pandas as pd
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+from backtesting.features import FeatureStore
+from backtesting.storage import append_symbol_parquet, write_dataset, write_symbol_parquet
+from bist import alter_column_names, read_zip_csv
+
 
-from bist import alter_column_names
+BASE_URL = 'https://www.borsaistanbul.com'
 
 
 def make_dirs(path):
@@ -23,72 +35,380 @@ def get_filename(date, extension='zip'):
     return date.strftime('thb%Y%m%d1.{}').format(extension)
 
 
-def get_url(date):
-    return 'https://www.borsaistanbul.com' + get_dirname(date) + get_filename(date)
+def get_url(date, base_url=BASE_URL):
+    return base_url + get_dirname(date) + get_filename(date)
 
 
-def get_data():
-    downloads_dir = os.getcwd() + '/data/bist/downloads/'
-    current_date = datetime.date(2015, 12, 1)
-    end_date = datetime.date.today()
-    bist = pd.DataFrame()
+def get_trading_days(start_date, end_date):
+    """
+    Returns the weekdays from start_date up to, but excluding, end_date.
+    Holidays are only known once their download is missing.
+    """
+    days = []
+    current_date = start_date
 
     while current_date < end_date:
-        if current_date.weekday() > 4:
-            current_date = current_date + datetime.timedelta(1)
-            continue
+        if current_date.weekday() <= 4:
+            days.append(current_date)
+        current_date = current_date + datetime.timedelta(1)
+
+    return days
+
+
+def create_session(pool_size=8, retries=3, backoff_factor=0.5):
+    """
+    Creates a session whose connections are kept alive and shared between
+    the download threads. Connection errors and server errors are retried
+    with an exponential backoff, while a 404 (a holiday) is not.
+
+    Parameters:
+    pool_size - The number of connections kept open, one per thread.
+    retries - The number of times a failed request is retried.
+    backoff_factor - The base of the delay between retries, in seconds.
+    """
+    retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def has_day(date, downloads_dir):
+    """
+    Checks whether a day is on disk, either as its zip or as an extracted CSV.
+    """
+    return (os.path.exists(downloads_dir + get_filename(date)) or
+            os.path.exists(downloads_dir + get_filename(date, 'csv')))
+
+
+def fetch_day(session, date, downloads_dir, base_url=BASE_URL, timeout=30, extract=False):
+    """
+    Downloads the zip of a day, and extracts it if asked to. Returns
+    the date and the HTTP status, which is 404 for holidays. The zip is
+    only moved into place once its whole body was read, so an interrupted
+    download does not leave a partial zip that later runs would skip.
+    """
+    response = session.get(get_url(date, base_url), timeout=timeout)
+
+    if response.status_code == 200:
+        zip_filename = downloads_dir + get_filename(date)
+        temporary = zip_filename + '.tmp'
+
+        try:
+            with open(temporary, 'wb') as output:
+                output.write(response.content)
+            os.replace(temporary, zip_filename)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+        if extract:
+            with zipfile.ZipFile(zip_filename, 'r') as archive:
+                archive.extractall(downloads_dir)
+
+    return date, response.status_code
 
-        print("Fetching: {}".format(current_date))
-        zip_filename = downloads_dir + get_filename(current_date)
-        csv_filename = downloads_dir + get_filename(current_date, 'csv')
 
-        url = get_url(current_date)
-        request = requests.get(url)
+def download_days(dates, downloads_dir, base_url=BASE_URL, workers=8, session=None, extract=False):
+    """
+    Downloads the days that are not in downloads_dir yet on a pool of
+    threads. Days already on disk are skipped before any request is made.
 
-        if not os.path.exists(csv_filename):
-            make_dirs(downloads_dir)
+    Parameters:
+    dates - The days to download.
+    downloads_dir - The directory the zips are downloaded to.
+    base_url - The server to download from.
+    workers - The number of concurrent downloads.
+    session - The requests.Session to use, created if not given.
+    extract - Whether to also extract the CSVs from the zips.
 
-            if request.status_code == 200:
-                with open(zip_filename, 'wb') as output:
-                    output.write(request.content)
-                with zipfile.ZipFile(zip_filename, 'r') as archive:
-                    archive.extractall(downloads_dir)
+    Returns:
+    A dictionary of the HTTP status of every downloaded day.
+    """
+    make_dirs(downloads_dir)
+    pending = [date for date in dates if not has_day(date, downloads_dir)]
+    statuses = {}
+
+    print("Fetching {} of {} days, {} already downloaded".format(len(pending), len(dates),
+                                                                 len(dates) - len(pending)))
+    if not pending:
+        return statuses
+
+    own_session = session is None
+    session = session or create_session(workers)
+
+    try:
+        with ThreadPoolExecutor(workers) as executor:
+            futures = [executor.submit(fetch_day, session, date, downloads_dir, base_url, extract=extract)
+                       for date in pending]
+
+            for count, future in enumerate(as_completed(futures), 1):
+                try:
+                    date, status = future.result()
+                except requests.RequestException as error:
+                    print("Failed ({}/{}): {}".format(count, len(pending), error))
+                    continue
+
+                statuses[date] = status
+                print("Fetched ({}/{}): {} [{}]".format(count, len(pending), date, status))
+    finally:
+        if own_session:
+            session.close()
+
+    return statuses
+
+
+def read_days(dates, downloads_dir):
+    """
+    Parses the CSVs of the given days and concatenates them once. The CSVs
+    are read straight from the zips, unless they were extracted. Days
+    without either (holidays) are skipped.
+    """
+    frames = []
+    for date in dates:
+        csv_filename = downloads_dir + get_filename(date, 'csv')
+        zip_filename = downloads_dir + get_filename(date)
 
         # It might be a holiday, so we must check again
         if os.path.exists(csv_filename):
             with open(csv_filename, 'r') as csv:
-                bist = pd.concat([bist, pd.read_csv(csv, delimiter=';', header=1)], sort=True)
+                frames.append(pd.read_csv(csv, delimiter=';', header=1))
+        elif os.path.exists(zip_filename):
+            frames.append(read_zip_csv(zip_filename, delimiter=';', header=1))
+
+    if not frames:
+        return pd.DataFrame()
+
+    return pd.concat(frames, sort=True)
+
+
+def get_data(start_date=datetime.date(2015, 12, 1), end_date=None, downloads_dir=None, base_url=BASE_URL,
+             workers=8, extract=False):
+    downloads_dir = downloads_dir or os.getcwd() + '/data/bist/downloads/'
+    end_date = end_date or datetime.date.today()
+    dates = get_trading_days(start_date, end_date)
+
+    download_days(dates, downloads_dir, base_url, workers, extract=extract)
+    return read_days(dates, downloads_dir)
+
+
+def read_manifest(path):
+    """
+    Reads the manifest of ingested days, which maps ISO dates to the HTTP
+    status of their download: 200 for trading days and 404 for holidays.
+    """
+    try:
+        with open(path, 'r') as manifest:
+            return json.load(manifest)
+    except (IOError, ValueError):
+        return {}
+
+
+def write_manifest(path, manifest):
+    """
+    Replaces the manifest atomically, so that an interrupted
+    run never leaves a partially written one behind.
+    """
+    make_dirs(os.path.dirname(path))
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as output:
+        json.dump(manifest, output, indent=0, sort_keys=True)
+    os.replace(temporary, path)
 
-        current_date = current_date + datetime.timedelta(1)
 
-    return bist
+def get_statuses(dates, downloads_dir, statuses, grace_days=7, today=None):
+    """
+    Returns the final statuses of the days, stopping at the first day whose
+    download failed, so that it is retried on the next run before any later
+    day is appended. Days already on disk count as downloaded.
 
+    A 404 only marks a holiday once a later day was published or the day is
+    older than the grace period. The 404s at the end of the last grace_days
+    days are left out, as they may be days the exchange has not uploaded
+    yet, and are fetched again on the next run.
+    """
+    final = {}
 
-def write_symbols(bist):
-    symbol_template = os.getcwd() + '/data/bist/symbols/{}.csv'
+    for date in dates:
+        if has_day(date, downloads_dir):
+            status = 200
+        else:
+            status = statuses.get(date)
+
+        if status not in (200, 404):
+            break
+
+        final[date.isoformat()] = status
+
+    cutoff = (today or datetime.date.today()) - datetime.timedelta(grace_days)
+
+    for date in reversed(dates[:len(final)]):
+        if final[date.isoformat()] != 404 or date < cutoff:
+            break
+
+        del final[date.isoformat()]
+
+    return final
+
+
+def index_by_date(df, column):
+    df = df.set_index(column)
+    df.index = pd.to_datetime(df.index)
+    return df
+
+
+def append_csv(df, target):
+    """
+    Appends the rows to a CSV, ordering the columns as in its header. Columns
+    that are not in the header are dropped, since appending them would
+    require rewriting the file. Creates the file if it does not exist.
+    """
+    if not os.path.exists(target):
+        df.to_csv(target)
+        return
+
+    header = pd.read_csv(target, nrows=0, index_col=0).columns
+    extra = df.columns.difference(header)
+    if len(extra):
+        print("Dropping columns missing from {}: {}".format(target, ', '.join(extra)))
+
+    df.reindex(columns=header).to_csv(target, mode='a', header=False)
+
+
+def get_data_dir(storage='csv'):
+    """
+    Returns the directory the symbol files, the combined data
+    and the manifest of a storage format are written to.
+    """
+    if storage == 'parquet':
+        return os.getcwd() + '/data/bist/parquet/'
+    return os.getcwd() + '/data/bist/'
+
+
+def write_symbols(bist, append=False, storage='csv'):
+    symbol_template = get_data_dir(storage) + 'symbols/{}.' + storage
     make_dirs(symbol_template.split('{}')[0])
+    names = []
 
     for name, df in bist.groupby('INSTRUMENT SERIES CODE'):
+        names.append(name)
         target = symbol_template.format(name)
-        print("Writing {} to: {}".format(name, target))
-        df.set_index('TRADE DATE', inplace=True)
-        df.index = pd.to_datetime(df.index, infer_datetime_format=True)
-        df.to_csv(target)
+        df = index_by_date(df, 'TRADE DATE')
+
+        if append:
+            print("Appending {} to: {}".format(name, target))
+            if storage == 'parquet':
+                append_symbol_parquet(df, target)
+            else:
+                append_csv(df, target)
+        else:
+            print("Writing {} to: {}".format(name, target))
+            if storage == 'parquet':
+                write_symbol_parquet(df, target)
+            else:
+                df.to_csv(target)
+
+    return names
 
 
-def write_all(bist):
-    make_dirs(os.getcwd() + '/data/bist/')
-    filename = os.getcwd() + '/data/bist/all.csv'
-    print("Writing all to: {}".format(filename))
-    
+def update_features(storage='csv'):
+    """
+    Brings the precomputed indicators of every symbol file up to date, so
+    that symbols whose features are missing or out of date are built even
+    when no new days were ingested. Up to date symbols are skipped.
+    """
+    store = FeatureStore(get_data_dir(storage) + 'symbols/', storage=storage)
+    print("Computed the features of {} new bars".format(store.update_all(store.symbols())))
+
+
+def write_all(bist, append=False, storage='csv'):
+    make_dirs(get_data_dir(storage))
+
     alter_column_names(bist)
+    bist = index_by_date(bist, 'TRADE_DATE')
+
+    if storage == 'parquet':
+        # A dataset partitioned by year, with new days added as new files
+        root = get_data_dir(storage) + 'all'
+        if not append and os.path.exists(root):
+            shutil.rmtree(root)
+
+        print("{} all to: {}".format('Appending' if append else 'Writing', root))
+        write_dataset(bist, root, bist.index.min().strftime('part-%Y%m%d'))
+        return
+
+    filename = get_data_dir(storage) + 'all.csv'
+
+    if append:
+        print("Appending all to: {}".format(filename))
+        append_csv(bist, filename)
+    else:
+        print("Writing all to: {}".format(filename))
+        bist.to_csv(filename)
+
+
+def update(full=False, start_date=datetime.date(2015, 12, 1), end_date=None, base_url=BASE_URL, workers=8,
+           storage='csv', extract=False, features=False):
+    """
+    Ingests the Borsa Istanbul data. Without a manifest, or with full=True,
+    every day since start_date is read and the symbol CSVs and all.csv are
+    rewritten. Otherwise only the days after the last ingested one are
+    fetched, parsed and appended to them, leaving the history untouched.
+
+    Parameters:
+    full - Whether to rebuild all of the files.
+    start_date - The first day of a full rebuild.
+    end_date - The day to stop before, today by default.
+    base_url - The server to download from.
+    workers - The number of concurrent downloads.
+    storage - The format of the files, 'csv' or 'parquet', each with its own manifest.
+    extract - Whether to also extract the CSVs from the downloaded zips.
+    features - Whether to precompute the indicators of the symbols, which is
+               also done when they were precomputed before.
+    """
+    downloads_dir = os.getcwd() + '/data/bist/downloads/'
+    manifest_path = get_data_dir(storage) + 'manifest.json'
+    end_date = end_date or datetime.date.today()
+
+    manifest = {} if full else read_manifest(manifest_path)
+    if manifest:
+        last_date = datetime.datetime.strptime(max(manifest), '%Y-%m-%d').date()
+        start_date = last_date + datetime.timedelta(1)
+
+    dates = get_trading_days(start_date, end_date)
+    downloaded = download_days(dates, downloads_dir, base_url, workers, extract=extract)
+    statuses = get_statuses(dates, downloads_dir, downloaded)
+    ingested = [date for date in dates if date.isoformat() in statuses]
+
+    if len(ingested) < len(dates):
+        print("Stopping before {}, which could not be downloaded or is not published yet".format(
+            dates[len(ingested)]))
+
+    data = read_days(ingested, downloads_dir)
+    append = bool(manifest)
+
+    if len(data):
+        write_symbols(data, append, storage)
+        write_all(data, append, storage)
+
+    symbols_dir = get_data_dir(storage) + 'symbols/'
+    if os.path.isdir(symbols_dir) and (features or os.path.isdir(symbols_dir + '.features')):
+        update_features(storage)
+
+    manifest.update(statuses)
+    write_manifest(manifest_path, manifest)
+    print("Ingested {} new days, {} in total".format(len(statuses), len(manifest)))
 
-    bist.set_index('TRADE_DATE', inplace=True)
-    bist.index = pd.to_datetime(bist.index, infer_datetime_format=True)
-    bist.to_csv(filename)
-    
 
 if __name__ == "__main__":
-    data = get_data()
-    write_symbols(data)
-    write_all(data)
+    parser = argparse.ArgumentParser(description='Downloads the Borsa Istanbul data and writes the symbol CSVs.')
+    parser.add_argument('--full', action='store_true', help='rebuild every file instead of appending new days')
+    parser.add_argument('--storage', choices=['csv', 'parquet'], default='csv', help='the format of the files')
+    parser.add_argument('--extract', action='store_true', help='also extract the CSVs from the downloaded zips')
+    parser.add_argument('--features', action='store_true',
+                        help='precompute the indicators of the symbols for FeatureStore')
+    args = parser.parse_args()
+
+    update(args.full, storage=args.storage, extract=args.extract, features=args.features)
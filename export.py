@@ -1,7 +1,8 @@
 import datetime
-import pickle
 import os
 
+from backtesting.artifacts import write_run
+
 folder_name = datetime.datetime.now().strftime('%Y-%m-%d-%H-%M-%S')
 
 
@@ -20,15 +21,18 @@ def get_dump_filename(name):
     return os.path.join(get_dumps_dir(), name)
 
 
-def export_all(data_handler, portfolio, exec_handler, simulation=None):
-    with open(get_dump_filename('data'), 'wb') as dump:
-        pickle.dump(data_handler.latest_symbol_data, dump)
-    with open(get_dump_filename('portfolio'), 'wb') as dump:
-        pickle.dump(portfolio.all_holdings, dump)
-    with open(get_dump_filename('order'), 'wb') as dump:
-        pickle.dump(exec_handler.history, dump)
+def open_ledger(portfolio):
+    """
+    Moves the ledger of the portfolio to the dumps folder before the run,
+    so its records are written to disk as they are appended.
+    """
+    portfolio.ledger.open_files(get_dumps_dir())
+
 
-    if simulation is not None:
-        with open(get_dump_filename('simulation'), 'wb') as dump:
-            pickle.dump(simulation, dump)
+def export_all(data_handler, portfolio, exec_handler, simulation=None, compress=False):
+    """
+    Dumps the bars, the ledger, the orders and the simulation of the run
+    as arrays with a manifest, which backtesting.artifacts.load_run() reads.
+    """
+    write_run(get_dumps_dir(), data_handler, portfolio, exec_handler, simulation, compress)
     print("Dump Folder Name:", folder_name)
@@ -1,86 +1,280 @@
-import os
-import queue
+"""
+Runs a single backtest. Without arguments it asks for the symbols and the
+trading and portfolio strategies interactively. With arguments, or a JSON
+config file with the same keys as the long options, it runs without any
+prompts, for example:
+
+    python main.py --symbols ASELS THYAO --strategy SMARibbon --params '{"windows": [10, 20, 30]}'
+    python main.py --config backtest.json --portfolio OptimizedGreedy --export
+
+The arguments override the config file. With --cache the results are kept
+in data/results, and running the same backtest on unchanged data again only
+prints the stored statistics. matplotlib is only imported with
+--plot, so headless runs start as fast as pandas can be imported, and
+--plot chart.png renders the chart to a file without a display.
+"""
+import argparse
 import datetime
+import json
+import logging
+import os
+import sys
 
 from backtesting.data import BistDataHandler
+from backtesting.engine import Backtest, EventQueue
+from backtesting.event import SignalEvent
 from backtesting.execution import SimulatedExecutionHandler
-from naive_greedy_portfolio import NaiveGreedyPortfolio
-from optimized_greedy_portfolio import OptimizedGreedyPortfolio
-from simple_moving_average import SimpleMovingAverageStrategy
-from simple_moving_average_ribbon import SimpleMovingAverageRibbonStrategy
-from simpler_simple_moving_average import SimplerSimpleMovingAverageStrategy
-from export import export_all
-from visualizer import visualize
-
-events = queue.Queue()
-symbols = []
-csv_dir = os.getcwd() + '/data/bist/symbols/'
-
-while True:
-    symbol = input("Write a ticker symbol, or press ENTER to continue: ")
-
-    if symbol == "":
-        if len(symbols) > 0:
-            break
-        else:
-            print("You must give at least one symbol")
-            continue
-
-    symbols.append(symbol + '.E')
-
-start_date = datetime.date(2017, 1, 1)
-bars = BistDataHandler(events, csv_dir, symbols, start_date)
-
-strategies = [
-    SimpleMovingAverageStrategy(bars, events, 40, 100),
-    SimplerSimpleMovingAverageStrategy(bars, events, 40),
-    SimpleMovingAverageRibbonStrategy(bars, events, [10, 20, 30, 40, 50, 60]),
-]
-
-print('''
+from registry import STRATEGIES, PORTFOLIOS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARAMS = {
+    'SimpleMovingAverage': {'long_window': 40, 'short_window': 100},
+    'SimplerSMA': {'window': 40},
+    'SMARibbon': {'windows': [10, 20, 30, 40, 50, 60]},
+}
+
+DEFAULTS = {
+    'csv_dir': os.getcwd() + '/data/bist/symbols/',
+    'storage': 'csv',
+    'start_date': '2017-01-01',
+    'end_date': None,
+    'strategy': 'SimpleMovingAverage',
+    'params': None,
+    'portfolio': 'NaiveGreedy',
+    'portfolio_params': {},
+    'vectorized': False,
+    'plot': False,
+    'export': False,
+    'compress': False,
+    'report': None,
+    'profile': None,
+    'cache': None,
+    'features': False,
+    'log_level': 'INFO',
+}
+
+CACHE_DIR = os.getcwd() + '/data/results/'
+
+
+def parse_date(text):
+    return None if text is None else datetime.datetime.strptime(text, '%Y-%m-%d').date()
+
+
+def normalize_symbol(symbol):
+    """
+    Adds the equity suffix to a bare ticker, so both ASELS and ASELS.E work.
+    """
+    return symbol if '.' in symbol else symbol + '.E'
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Runs a backtest, interactively when no arguments are given.')
+    parser.add_argument('-c', '--config', help='a JSON file with the same keys as the long options')
+    parser.add_argument('-s', '--symbols', nargs='+', help='the ticker symbols')
+    parser.add_argument('--start-date', help='the first date of the backtest, as YYYY-MM-DD')
+    parser.add_argument('--end-date', help='the last date of the backtest, as YYYY-MM-DD')
+    parser.add_argument('--strategy', choices=sorted(STRATEGIES), help='the trading strategy')
+    parser.add_argument('--params', type=json.loads, help='the strategy arguments as a JSON object')
+    parser.add_argument('--portfolio', choices=sorted(PORTFOLIOS), help='the portfolio strategy')
+    parser.add_argument('--portfolio-params', type=json.loads, help='the portfolio arguments as a JSON object')
+    parser.add_argument('--csv-dir', help='the directory of the symbol data')
+    parser.add_argument('--storage', choices=['csv', 'parquet'], help='the format of the symbol data')
+    parser.add_argument('--vectorized', action='store_true', default=None,
+                        help='run the strategy in a single vectorized pass')
+    parser.add_argument('--plot', nargs='?', const=True, metavar='PATH',
+                        help='plot the orders with matplotlib, to a file when a path is given')
+    parser.add_argument('--export', action='store_true', default=None, help='dump the results to data/dumps')
+    parser.add_argument('--compress', action='store_true', default=None,
+                        help='dump the results into one compressed file instead of memory-mappable ones')
+    parser.add_argument('--report', help='write the timings of the run to this JSON file')
+    parser.add_argument('--profile', help='write a cProfile profile of the run to this file')
+    parser.add_argument('--cache', nargs='?', const=CACHE_DIR, metavar='DIR',
+                        help='reuse the results of identical backtests, kept in DIR or data/results')
+    parser.add_argument('--features', action='store_true', default=None,
+                        help='read the moving averages precomputed by bist_csv.py --features')
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help='the logging level')
+    return parser
+
+
+def load_config(args):
+    """
+    Merges the defaults, the config file and the given arguments, in that order.
+    """
+    config = dict(DEFAULTS)
+
+    if args.config is not None:
+        with open(args.config, 'r') as config_file:
+            config.update(json.load(config_file))
+
+    config.update({name: value for name, value in vars(args).items() if value is not None and name != 'config'})
+
+    if not config.get('symbols'):
+        raise ValueError("At least one symbol must be given")
+    if config['strategy'] not in STRATEGIES:
+        raise ValueError("Unknown strategy: {}".format(config['strategy']))
+    if config['portfolio'] not in PORTFOLIOS:
+        raise ValueError("Unknown portfolio: {}".format(config['portfolio']))
+    if config['vectorized'] and (config['report'] or config['profile']):
+        raise ValueError("The timings and profile are only available for event-driven backtests")
+
+    config['symbols'] = [normalize_symbol(symbol) for symbol in config['symbols']]
+    if config['params'] is None:
+        config['params'] = DEFAULT_PARAMS[config['strategy']]
+
+    return config
+
+
+def print_stats(stats):
+    print('\n'.join(['{}: {}'.format(column, value) for column, value in stats]))
+
+
+def run(config):
+    """
+    Runs the backtest described by a config, prints its summary statistics
+    and returns them. With a cache and nothing else to produce than the
+    statistics, an identical earlier run is reused.
+    """
+    start_date = parse_date(config['start_date'])
+    symbols = config['symbols']
+    cache = None
+
+    if config['cache'] and not (config['export'] or config['plot'] or config['report'] or config['profile']):
+        from backtesting.result_cache import ResultCache, data_digests, result_key
+
+        cache = ResultCache(config['cache'])
+        run_config = {name: config[name] for name in ('symbols', 'start_date', 'end_date', 'strategy', 'params',
+                                                      'portfolio', 'portfolio_params')}
+        if config['features']:
+            # The stored averages can differ from the calculated ones in the first bars
+            run_config['features'] = True
+        key = result_key(data_digests(config['csv_dir'], symbols, config['storage']), run_config)
+        cached = cache.get(key, ['summary'])
+
+        if cached is not None:
+            logger.info("Reusing the cached result: %s", key)
+            print_stats(cached.metadata['stats']['summary'])
+            return cached.metadata['stats']['summary']
+
+    features = None
+
+    if config['features']:
+        from backtesting.features import FeatureStore
+
+        features = FeatureStore(config['csv_dir'], storage=config['storage'])
+
+    events = EventQueue()
+    bars = BistDataHandler(events, config['csv_dir'], symbols, start_date, storage=config['storage'],
+                           end_date=parse_date(config['end_date']), features=features)
+    strategy = STRATEGIES[config['strategy']](bars, events, **config['params'])
+    portfolio = PORTFOLIOS[config['portfolio']](bars, events, start_date, **config['portfolio_params'])
+    broker = SimulatedExecutionHandler(events, symbols)
+
+    if config['export'] and not config['compress']:
+        from export import open_ledger
+
+        open_ledger(portfolio)
+
+    if config['vectorized']:
+        from backtesting.vectorized import VectorizedBacktest
+
+        VectorizedBacktest(bars, strategy, portfolio, broker).run()
+    else:
+        instrumentation = None
+
+        if config['report'] or config['profile']:
+            from backtesting.instrumentation import Instrumentation
+
+            instrumentation = Instrumentation(trace_memory=bool(config['report']), profile=bool(config['profile']))
+
+        backtest = Backtest(bars, events, strategy, portfolio, broker, instrumentation)
+        backtest.register(SignalEvent, lambda signal: logger.info('%s', signal))
+        backtest.run()
+
+        if config['report']:
+            instrumentation.write_report(config['report'])
+        if config['profile']:
+            instrumentation.write_profile(config['profile'])
+
+    stats = portfolio.output_summary_stats(broker.history)
+    print_stats(stats)
+
+    if cache is not None:
+        cache.put(key, bars, portfolio, broker, {'summary': stats}, run_config)
+
+    if config['export']:
+        from export import export_all
+
+        export_all(bars, portfolio, broker, portfolio.simulation, config['compress'])
+
+    if config['plot']:
+        from visualizer import visualize
+
+        visualize(bars.latest_symbol_data, broker.history, portfolio.simulation,
+                  config['plot'] if isinstance(config['plot'], str) else None)
+
+    return stats
+
+
+def interactive():
+    """
+    Asks for the symbols and the strategies, then runs, exports and plots the backtest.
+    """
+    symbols = []
+
+    while True:
+        symbol = input("Write a ticker symbol, or press ENTER to continue: ")
+
+        if symbol == "":
+            if len(symbols) > 0:
+                break
+            else:
+                print("You must give at least one symbol")
+                continue
+
+        symbols.append(symbol + '.E')
+
+    print('''
 Trading strategies:
 1) Simple Moving Average
 2) Simpler SMA
 3) SMA Ribbon
 ''')
 
-strategy_choice = input('Pick: ')
+    strategy_choice = input('Pick: ')
 
-print('''
+    print('''
 Pick portfolio strategy:
 1) Greedy
 2) Optimized Greedy
 ''')
 
-portfolio_choice = int(input('Pick: '))
+    portfolio_choice = int(input('Pick: '))
 
-strategy = strategies[int(strategy_choice) - 1]
-portfolio = OptimizedGreedyPortfolio(bars, events, datetime.date(2017, 1, 1)) if portfolio_choice == 2 else NaiveGreedyPortfolio(bars, events, datetime.date(2017, 1, 1))
-broker = SimulatedExecutionHandler(events, symbols)
+    config = dict(DEFAULTS, symbols=symbols, export=True, plot=True,
+                  strategy=['SimpleMovingAverage', 'SimplerSMA', 'SMARibbon'][int(strategy_choice) - 1],
+                  portfolio='OptimizedGreedy' if portfolio_choice == 2 else 'NaiveGreedy')
+    config['params'] = DEFAULT_PARAMS[config['strategy']]
+    run(config)
 
-while True:
-    if bars.continue_backtest:
-        bars.update_bars()
-    else:
-        print('\n'.join(['{}: {}'.format(column, value) for column, value in portfolio.output_summary_stats()]))
-        export_all(bars, portfolio, broker, portfolio.simulation)
-        visualize(bars.latest_symbol_data, portfolio.all_holdings, broker.history, portfolio.simulation)
-        break
 
-    while True:
-        try:
-            event = events.get(False)
-        except queue.Empty:
-            break
-        else:
-            if event is not None:
-                if event.type == 'MARKET':
-                    strategy.calculate_signals(event)
-                    portfolio.update_time_index(event)
-                elif event.type == 'SIGNAL':
-                    portfolio.update_signal(event)
-                    print(event)
-                elif event.type == 'ORDER':
-                    broker.execute_order(event)
-                elif event.type == 'FILL':
-                    portfolio.update_fill(event)
+def main():
+    if len(sys.argv) == 1:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+        interactive()
+        return
+
+    parser = build_parser()
+    args = parser.parse_args()
+
+    try:
+        config = load_config(args)
+    except (OSError, ValueError) as error:
+        parser.error(str(error))
+
+    logging.basicConfig(level=config['log_level'], format='%(message)s')
+    run(config)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,218 +1,353 @@
+import logging
+
 import pandas as pd
 import numpy as np
 
-from backtesting.event import OrderEvent
-from backtesting.performance import create_sharpe_ratio, create_drawdowns
+from backtesting.event import OrderEvent, EventType, SignalType, Direction
+from backtesting.ledger import Ledger
+from backtesting.optimization import OnlineMoments, estimate_moments, max_sharpe_weights, min_variance_weights
+from backtesting.performance import create_performance_report
 from backtesting.portfolio import Portfolio
 
-np.random.seed(101)
+logger = logging.getLogger(__name__)
 
 
 class OptimizedGreedyPortfolio(Portfolio):
-    def __init__(self, bars, events, start_date, initial_capital=100000.0):
+    def __init__(self, bars, events, start_date, initial_capital=100000.0, num_portfolios=5000, seed=101,
+                 optimizer='monte_carlo', shrinkage=None, rebalance=None, halflife=None):
         self.bars = bars
         self.events = events
         self.symbol_list = self.bars.symbol_list
+        self.symbol_index = {symbol: i for i, symbol in enumerate(self.symbol_list)}
         self.start_date = pd.to_datetime(start_date)
         self.initial_capital = initial_capital
+        self.num_portfolios = num_portfolios  # number of random portfolios to simulate
+        self.seed = seed  # seed of the simulation, None for a different run every time
+        self.optimizer = optimizer  # 'monte_carlo', 'max_sharpe' or 'min_variance'
+        self.shrinkage = shrinkage  # None, 'ledoit_wolf' or a fixed intensity for the covariance
+        self.rebalance = rebalance  # None, 'monthly', 'quarterly' or a number of bars between re-optimizations
+        self.halflife = halflife  # half-life in bars of the walk-forward returns, None for equal weights
         self.equity_curve = None
         self.simulation = None
 
-        self.all_positions = self.construct_all_positions()
-        self.current_positions = {key: value for key, value in [(symbol, 0) for symbol in self.symbol_list]}
+        self.validate_rebalance()
 
-        self.optimized_ratios = self.calculate_optimized_ratios()
-        self.all_holdings = self.construct_all_holdings()
+        self.current_positions = np.zeros(len(self.symbol_list))
+        stocks = self.get_historical_prices()
+        self.optimized_ratios = self.calculate_optimized_ratios(stocks)
+        self.allocations = [(self.start_date, self.optimized_ratios)]
+        self.current_cash = self.construct_initial_cash()
         self.current_holdings = self.construct_initial_holdings()
-
-    def construct_all_positions(self):
-        dictionary = {key: value for key, value in [(symbol, 0) for symbol in self.symbol_list]}
-        dictionary['datetime'] = self.start_date
-        return [dictionary]
+        self.ledger = self.construct_ledger()
+
+        self.moments = None
+        self.last_date = stocks.index[-1] if len(stocks) else None
+        self.last_rebalance = self.last_date
+        self.bars_since_rebalance = 0
+
+        if self.rebalance is not None:
+            self.moments = self.construct_moments(stocks)
+
+    def validate_rebalance(self):
+        if self.rebalance is None:
+            if self.halflife is not None:
+                raise ValueError("The half-life only applies to walk-forward rebalancing, which needs a schedule")
+            return
+
+        if self.rebalance not in ('monthly', 'quarterly') and not (isinstance(self.rebalance, int) and
+                                                                  self.rebalance > 0):
+            raise ValueError("Unknown rebalance schedule: {}".format(self.rebalance))
+        if self.shrinkage == 'ledoit_wolf':
+            raise ValueError("Walk-forward rebalancing supports a fixed shrinkage, not 'ledoit_wolf'")
+
+    def optimize(self, mean, cov):
+        if self.optimizer == 'monte_carlo':
+            self.simulation = self.simulate_moments(mean, cov, self.num_portfolios, self.seed)
+            all_weights, ret_arr, vol_arr, sharpe_arr = self.simulation
+            return all_weights[sharpe_arr.argmax()]
+        if self.optimizer == 'max_sharpe':
+            return max_sharpe_weights(mean, cov)
+        if self.optimizer == 'min_variance':
+            return min_variance_weights(cov)
+
+        raise ValueError("Unknown optimizer: {}".format(self.optimizer))
 
     def get_opt_alloc(self, stocks):
-        self.simulation = self.simulate(stocks)
-        all_weights, ret_arr, vol_arr, sharpe_arr = self.simulation
+        mean, cov = estimate_moments(stocks, self.shrinkage)
+        weights = self.optimize(mean, cov)
 
-        max_sr_pos = sharpe_arr.argmax()
+        logger.info('Optimal Allocation:')
 
-        print('Optimal Allocation:')
+        # The exact optimizers leave most symbols out with a weight of exactly 0
+        for stock, alloc in list(zip(stocks.columns, weights)):
+            if alloc > 0:
+                logger.info('%s:\t%s', stock, alloc)
 
-        for stock, alloc in list(zip(stocks.columns, all_weights[max_sr_pos])):
-            print('{}:\t{}'.format(stock, alloc))
+        excluded = [stock for stock, alloc in zip(stocks.columns, weights) if not alloc > 0]
+        if excluded:
+            logger.info('Not allocated: %s', ', '.join(excluded))
 
-        return all_weights[max_sr_pos]
+        return weights
 
-    def calculate_optimized_ratios(self):
+    def get_historical_prices(self):
         stocks = []
         for symbol in self.symbol_list:
             stocks.append(self.bars.historical_symbol_data[symbol]['CLOSING PRICE'])
         stocks = pd.concat(stocks, axis=1)
         stocks.columns = self.symbol_list
+        return stocks
+
+    def calculate_optimized_ratios(self, stocks):
         hist_alloc = self.get_opt_alloc(stocks)
         return hist_alloc
 
-    def construct_all_holdings(self):
-        opt_ratios = self.optimized_ratios
-        dictionary = {key: value for key, value in [(symbol, 0.0) for symbol in self.symbol_list]}
-        dictionary['datetime'] = self.start_date
-        capital_ratio_per_sym = dict(zip(self.symbol_list, opt_ratios))
-        dictionary['cash'] = dict()
-        for key, value in capital_ratio_per_sym.items():
-            dictionary['cash'][key] = self.initial_capital * value
+    def construct_moments(self, stocks):
+        """
+        Feeds the history to the online estimator once, after
+        which every bar only adds its own returns.
+        """
+        moments = OnlineMoments(len(self.symbol_list), self.halflife)
+
+        for prices in stocks.values:
+            moments.update_prices(prices)
+
+        return moments
+
+    def is_rebalance_due(self, datetime):
+        if self.rebalance == 'monthly':
+            return (datetime.year, datetime.month) != (self.last_rebalance.year, self.last_rebalance.month)
+        if self.rebalance == 'quarterly':
+            return ((datetime.year, (datetime.month - 1) // 3) !=
+                    (self.last_rebalance.year, (self.last_rebalance.month - 1) // 3))
+
+        return self.bars_since_rebalance >= self.rebalance
+
+    def update_allocation(self, datetime, closes, market_values):
+        """
+        Adds the returns of the bar to the moments and, when the schedule is
+        due, re-optimizes the weights on them. The cash of every symbol is
+        then set by allocate_cash(). Open positions are not traded, the new
+        weights apply to the orders from this bar on.
+        """
+        if self.last_date is not None and datetime <= self.last_date:
+            return  # the bar is already in the history
+
+        self.last_date = datetime
+        self.moments.update_prices(closes)
+        self.bars_since_rebalance += 1
+
+        if self.last_rebalance is not None and not self.is_rebalance_due(datetime):
+            return
+
+        weights = self.optimize(*self.moments.moments(self.shrinkage))
+        self.current_cash[:] = self.allocate_cash(weights, self.current_holdings['remaining_cash'], market_values)
+        self.optimized_ratios = weights
+        self.allocations.append((datetime, weights))
+        self.last_rebalance = datetime
+        self.bars_since_rebalance = 0
+
+    @staticmethod
+    def allocate_cash(weights, remaining_cash, market_values):
+        """
+        Splits the remaining cash between the symbols, so that the cash and
+        holdings of every symbol add up to its weight of the total equity. A
+        symbol that already holds its weight or more gets no cash. When the
+        overweight positions leave less cash than the others fall short of,
+        the shortfalls are scaled down to add up to the remaining cash, so
+        the portfolio never buys on borrowed money.
+
+        Parameters:
+        weights - The target weights of the symbols.
+        remaining_cash - The cash of the account.
+        market_values - The market values of the positions.
+        """
+        total = remaining_cash + market_values.sum()
+        shortfall = np.maximum(weights * total - market_values, 0.0)
+        available = max(remaining_cash, 0.0)
+        needed = shortfall.sum()
+
+        if needed > available:
+            shortfall *= available / needed
+
+        return shortfall
+
+    def construct_initial_cash(self):
+        cash = self.initial_capital * np.asarray(self.optimized_ratios, dtype=np.float64)
+        logger.info('Cash: %s', dict(zip(self.symbol_list, cash.tolist())))
+        return cash
+
+    def construct_initial_holdings(self):
+        dictionary = dict()
         dictionary['remaining_cash'] = self.initial_capital  # spare cash in the account after any purchases
         dictionary['commission'] = 0.0  # the cumulative commission accrued
         dictionary['total'] = self.initial_capital  # the total account equity including cash and any open positions
-        return [dictionary]
-
-    def construct_initial_holdings(self):
-        opt_ratios = self.optimized_ratios
-        dictionary = {key: value for key, value in [(symbol, 0.0) for symbol in self.symbol_list]}
-        capital_ratio_per_sym = dict(zip(self.symbol_list, opt_ratios))
-        dictionary['cash'] = dict()
-        for key, value in capital_ratio_per_sym.items():
-            dictionary['cash'][key] = self.initial_capital * value
-        print('Cash:', dictionary['cash'])
-        dictionary['remaining_cash'] = self.initial_capital
-        dictionary['commission'] = 0.0
-        dictionary['total'] = self.initial_capital
         return dictionary
 
-    def update_time_index(self, event):
-        bars = {}
-        for symbol in self.symbol_list:
-            bars[symbol] = self.bars.get_latest_bars(symbol)
+    def construct_ledger(self):
+        expected = self.bars.get_expected_bar_count()
+        ledger = Ledger(self.symbol_list, ['remaining_cash', 'commission', 'total'],
+                        expected + 1 if expected else 256, symbol_cash=True)
+        ledger.append(self.start_date, self.current_positions, np.zeros(len(self.symbol_list)),
+                      (self.initial_capital, 0.0, self.initial_capital), self.current_cash)
+        return ledger
 
-        # Update positions
-        positions = {key: value for key, value in [(symbol, 0) for symbol in self.symbol_list]}
-        positions['datetime'] = pd.to_datetime(bars[self.symbol_list[0]].iloc[0].name)
+    @property
+    def all_positions(self):
+        return self.ledger.position_records()
 
-        for symbol in self.symbol_list:
-            positions[symbol] = self.current_positions[symbol]
+    @property
+    def all_holdings(self):
+        return self.ledger.holdings_records()
 
-        # Append the current positions
-        self.all_positions.append(positions)
+    def update_time_index(self, event):
+        closes = self.bars.get_latest_closes()
+        datetime = self.bars.get_latest_bar_datetime(self.symbol_list[0])
 
-        # Update holdings
-        holdings = {key: value for key, value in [(symbol, 0) for symbol in self.symbol_list]}
-        holdings['datetime'] = pd.to_datetime(bars[self.symbol_list[0]].iloc[0].name)
-        cash_per_symbol = [(symbol, self.current_holdings['cash'][symbol]) for symbol in self.symbol_list]
-        holdings['cash'] = {key: value for key, value in cash_per_symbol}
-        holdings['remaining_cash'] = self.current_holdings['remaining_cash']
-        holdings['commission'] = self.current_holdings['commission']
-        holdings['total'] = self.current_holdings['remaining_cash']
+        # Symbols that are not held do not count, even before their first price
+        market_values = np.where(self.current_positions != 0, self.current_positions * closes, 0.0)
+        remaining_cash = self.current_holdings['remaining_cash']
+        account = (remaining_cash, self.current_holdings['commission'], remaining_cash + market_values.sum())
 
-        for symbol in self.symbol_list:
-            # Approximation to the real value
-            market_value = self.current_positions[symbol] * bars[symbol].iloc[0]['CLOSING PRICE']
-            holdings[symbol] = market_value
-            holdings['total'] += market_value
+        if self.rebalance is not None:
+            self.update_allocation(datetime, closes, market_values)
 
-        # Append the current holdings
-        self.all_holdings.append(holdings)
+        self.ledger.append(datetime, self.current_positions, market_values, account, self.current_cash)
 
     def update_positions_from_fill(self, fill):
         # Check whether the fill is a buy or sell
         direction = 0
 
-        if fill.direction == 'BUY':
+        if fill.direction == Direction.BUY:
             direction = 1
-        if fill.direction == 'SELL':
+        if fill.direction == Direction.SELL:
             direction = -1
 
         # Update positions list with new quantities
-        self.current_positions[fill.symbol] += direction * fill.quantity
+        self.current_positions[self.symbol_index[fill.symbol]] += direction * fill.quantity
 
     def update_holdings_from_fill(self, fill):
         # Check whether the fill is a buy or sell
         direction = 0
 
-        if fill.direction == 'BUY':
+        if fill.direction == Direction.BUY:
             direction = 1
-        if fill.direction == 'SELL':
+        if fill.direction == Direction.SELL:
             direction = -1
 
         # Update holdings list with new quantities
-        cost = self.bars.get_latest_bars(fill.symbol).iloc[0]['CLOSING PRICE']  # Close price
+        index = self.symbol_index[fill.symbol]
+        cost = self.bars.get_latest_closes()[index]  # Close price
         cost = direction * cost * fill.quantity
-        self.current_holdings[fill.symbol] += cost
         self.current_holdings['commission'] += fill.commission
-        self.current_holdings['cash'][fill.symbol] -= (cost + fill.commission)
+        self.current_cash[index] -= (cost + fill.commission)
         self.current_holdings['remaining_cash'] -= (cost + fill.commission)
         self.current_holdings['total'] -= (cost + fill.commission)
 
     def update_fill(self, event):
-        if event.type == 'FILL':
+        if event.type == EventType.FILL:
             self.update_positions_from_fill(event)
             self.update_holdings_from_fill(event)
 
     def generate_naive_order(self, signal):
         symbol = signal.symbol
+        index = self.symbol_index[symbol]
         direction = signal.signal_type
-        close_price = self.bars.get_latest_bars(symbol).iloc[0]['CLOSING PRICE']
-        symbol_cash = self.current_holdings['cash'][symbol]
+        close_price = self.bars.get_latest_closes()[index]
+        symbol_cash = self.current_cash[index]
         market_quantity = symbol_cash / close_price
-        current_quantity = self.current_positions[symbol]
+        current_quantity = self.current_positions[index]
         order_type = 'MARKET'
 
-        if direction == 'LONG' and current_quantity == 0:
-            return OrderEvent(symbol, order_type, market_quantity, 'BUY', signal.datetime)
-        if direction == 'SHORT' and current_quantity == 0:
-            return OrderEvent(symbol, order_type, market_quantity, 'SELL', signal.datetime)
-        if direction == 'EXIT' and current_quantity > 0:
-            return OrderEvent(symbol, order_type, abs(current_quantity), 'SELL', signal.datetime)
-        if direction == 'EXIT' and current_quantity < 0:
-            return OrderEvent(symbol, order_type, abs(current_quantity), 'BUY', signal.datetime)
+        # Symbols without a weight, or whose cash went to commissions, are not entered
+        if direction in (SignalType.LONG, SignalType.SHORT) and not market_quantity > 0:
+            return None
+
+        if direction == SignalType.LONG and current_quantity == 0:
+            return OrderEvent(symbol, order_type, market_quantity, Direction.BUY, signal.datetime)
+        if direction == SignalType.SHORT and current_quantity == 0:
+            return OrderEvent(symbol, order_type, market_quantity, Direction.SELL, signal.datetime)
+        if direction == SignalType.EXIT and current_quantity > 0:
+            return OrderEvent(symbol, order_type, abs(current_quantity), Direction.SELL, signal.datetime)
+        if direction == SignalType.EXIT and current_quantity < 0:
+            return OrderEvent(symbol, order_type, abs(current_quantity), Direction.BUY, signal.datetime)
 
         return None
 
     def update_signal(self, event):
-        if event.type == 'SIGNAL':
+        if event.type == EventType.SIGNAL:
             order_event = self.generate_naive_order(event)
             self.events.put(order_event)
 
     def create_equity_curve(self):
-        curve = pd.DataFrame(self.all_holdings)
-        curve.set_index('datetime', inplace=True)
+        curve = self.ledger.frame()
         curve['returns'] = curve['total'].pct_change()
         curve['equity_curve'] = (1.0 + curve['returns']).cumprod()
         self.equity_curve = curve
 
-    def output_summary_stats(self):
+    def output_summary_stats(self, history=None):
         self.create_equity_curve()
 
-        total_return = self.equity_curve['equity_curve'][-1]
+        total_return = self.equity_curve['equity_curve'].iloc[-1]
         returns = self.equity_curve['returns']
         pnl = self.equity_curve['equity_curve']
 
-        sharpe_ratio = create_sharpe_ratio(returns)
-        max_dd, dd_duration = create_drawdowns(pnl)
+        prices = None if history is None else {symbol: frame['CLOSING PRICE']
+                                               for symbol, frame in self.bars.latest_symbol_data.items()}
+        report = create_performance_report(returns, pnl, history=history, prices=prices)
+        self.equity_curve['rolling_sharpe'] = report['rolling_sharpe']
+        self.equity_curve['underwater'] = report['underwater']
 
         stats = [("Initial Capital", self.initial_capital),
-                 ("Total Holdings", self.all_holdings[-1]['total']),
+                 ("Total Holdings", self.ledger.latest('total')),
                  ("Total Return", "%0.2f%%" % ((total_return - 1.0) * 100.0)),
-                 ("Sharpe Ratio", "%0.2f" % sharpe_ratio),
-                 ("Max Drawdown", "%0.2f%%" % (max_dd * 100.0)),
-                 ("Drawdown Duration", "%d" % dd_duration)]
-        return stats
+                 ("Sharpe Ratio", "%0.2f" % report['sharpe_ratio']),
+                 ("Sortino Ratio", "%0.2f" % report['sortino_ratio']),
+                 ("Calmar Ratio", "%0.2f" % report['calmar_ratio']),
+                 ("Max Drawdown", "%0.2f%%" % (report['max_drawdown'] * 100.0)),
+                 ("Drawdown Duration", "%d" % report['drawdown_duration'])]
 
-    @staticmethod
-    def simulate(stocks):
-        returns = np.log(stocks / stocks.shift(1))
-
-        num_ports = 5000  # Number of portfolios
-        all_weights = np.zeros((num_ports, len(stocks.columns)))
-        ret_arr = np.zeros(num_ports)
-        vol_arr = np.zeros(num_ports)
-        sharpe_arr = np.zeros(num_ports)
+        if history is not None:
+            stats.extend((name.replace('_', ' ').title(), value) for name, value in report['trades'].items())
 
-        for index in range(num_ports):
-            weights = np.array(np.random.random(len(stocks.columns)))
-            weights = weights / np.sum(weights)
-            all_weights[index, :] = weights
+        return stats
 
-            ret_arr[index] = np.sum(returns.mean() * weights * 252)
-            vol_arr[index] = np.sqrt(np.dot(weights.T, np.dot(returns.cov() * 252, weights)))
-            sharpe_arr[index] = ret_arr[index] / vol_arr[index]
+    @staticmethod
+    def simulate(stocks, num_ports=5000, seed=101, chunk_size=8192):
+        # Annualized mean and covariance of the log returns, calculated once
+        mean, cov = estimate_moments(stocks)
+        return OptimizedGreedyPortfolio.simulate_moments(mean, cov, num_ports, seed, chunk_size)
 
-        return all_weights, ret_arr, vol_arr, sharpe_arr
\ No newline at end of file
+    @staticmethod
+    def simulate_moments(mean, cov, num_ports=5000, seed=101, chunk_size=8192):
+        """
+        Draws random long-only portfolios and evaluates their return, volatility
+        and Sharpe ratio with matrix operations. The portfolios are drawn in
+        chunks so that the temporary arrays stay bounded for large simulations.
+        With the same seed, the weights match drawing them one portfolio at a time.
+
+        Parameters:
+        mean - The annualized mean returns of the symbols.
+        cov - The annualized covariance matrix of the returns.
+        num_ports - The number of portfolios to simulate.
+        seed - The seed of the random number generator.
+        chunk_size - The number of portfolios evaluated at once.
+        """
+        random = np.random.RandomState(seed)
+        num_symbols = len(mean)
+
+        all_weights = np.empty((num_ports, num_symbols))
+        ret_arr = np.empty(num_ports)
+        vol_arr = np.empty(num_ports)
+
+        for start in range(0, num_ports, chunk_size):
+            stop = min(start + chunk_size, num_ports)
+            weights = random.random_sample((stop - start, num_symbols))
+            weights /= weights.sum(axis=1, keepdims=True)
+
+            all_weights[start:stop] = weights
+            ret_arr[start:stop] = weights.dot(mean)
+            vol_arr[start:stop] = np.sqrt(np.einsum('ij,jk,ik->i', weights, cov, weights))
+
+        sharpe_arr = ret_arr / vol_arr
+
+        return all_weights, ret_arr, vol_arr, sharpe_arr
@@ -0,0 +1,21 @@
+"""
+The trading and portfolio strategies that can be picked by name, shared by
+main.py and sweep.py. Only the strategy modules are imported, so the command
+line does not pay for the process pool and the caches of the sweep.
+"""
+from naive_greedy_portfolio import NaiveGreedyPortfolio
+from optimized_greedy_portfolio import OptimizedGreedyPortfolio
+from simple_moving_average import SimpleMovingAverageStrategy
+from simple_moving_average_ribbon import SimpleMovingAverageRibbonStrategy
+from simpler_simple_moving_average import SimplerSimpleMovingAverageStrategy
+
+STRATEGIES = {
+    'SimpleMovingAverage': SimpleMovingAverageStrategy,
+    'SimplerSMA': SimplerSimpleMovingAverageStrategy,
+    'SMARibbon': SimpleMovingAverageRibbonStrategy,
+}
+
+PORTFOLIOS = {
+    'NaiveGreedy': NaiveGreedyPortfolio,
+    'OptimizedGreedy': OptimizedGreedyPortfolio,
+}
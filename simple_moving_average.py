@@ -1,5 +1,7 @@
+import numpy as np
+
 from backtesting.strategy import Strategy
-from backtesting.event import SignalEvent
+from backtesting.event import SignalEvent, EventType, SignalType
 
 
 class SimpleMovingAverageStrategy(Strategy):
@@ -11,6 +13,9 @@ class SimpleMovingAverageStrategy(Strategy):
         self.symbol_list = self.bars.symbol_list
         self.bought = self._calculate_initial_bought()
 
+        self.long_averages = {symbol: self.bars.indicators.sma(symbol, self.long_window) for symbol in self.symbol_list}
+        self.short_averages = {symbol: self.bars.indicators.sma(symbol, self.short_window) for symbol in self.symbol_list}
+
     def _calculate_initial_bought(self):
         bought = {}
 
@@ -20,24 +25,29 @@ class SimpleMovingAverageStrategy(Strategy):
         return bought
 
     def calculate_signals(self, event):
-        if event.type == 'MARKET':
+        if event.type == EventType.MARKET:
             for symbol in self.symbol_list:
-                long_bars = self.bars.get_latest_bars(symbol, self.long_window)
-                short_bars = self.bars.get_latest_bars(symbol, self.short_window)
-
-                if len(long_bars.index) < self.long_window:
+                if self.bars.get_bar_count(symbol) < self.long_window:
                     continue
 
-                long_avg = long_bars['CLOSING PRICE'].mean()
-                short_avg = short_bars['CLOSING PRICE'].mean()
+                long_avg = self.long_averages[symbol].value
+                short_avg = self.short_averages[symbol].value
 
                 if short_avg > long_avg and not self.bought[symbol]:
-                    signal = SignalEvent(symbol, long_bars.iloc[-1].name, 'LONG')
+                    signal = SignalEvent(symbol, self.bars.get_latest_bar_datetime(symbol), SignalType.LONG)
                     self.events.put(signal)
                     self.bought[symbol] = True
 
                 if short_avg < long_avg and self.bought[symbol]:
-                    signal = SignalEvent(symbol, long_bars.iloc[-1].name, 'EXIT')
+                    signal = SignalEvent(symbol, self.bars.get_latest_bar_datetime(symbol), SignalType.EXIT)
                     self.events.put(signal)
                     self.bought[symbol] = False
 
+    def calculate_positions(self, closes):
+        # Imported here, only vectorized backtests need it
+        from backtesting.vectorized import hold_states, rolling_mean
+
+        ready = np.arange(1, len(closes) + 1) >= self.long_window
+        long_avg = rolling_mean(closes, self.long_window)
+        short_avg = rolling_mean(closes, self.short_window)
+        return hold_states(ready & (short_avg > long_avg), ready & (short_avg < long_avg))
@@ -1,5 +1,7 @@
+import numpy as np
+
 from backtesting.strategy import Strategy
-from backtesting.event import SignalEvent
+from backtesting.event import SignalEvent, EventType, SignalType
 
 
 class SimpleMovingAverageRibbonStrategy(Strategy):
@@ -10,6 +12,9 @@ class SimpleMovingAverageRibbonStrategy(Strategy):
         self.symbol_list = self.bars.symbol_list
         self.bought = self._calculate_initial_bought()
 
+        self.averages = {symbol: [self.bars.indicators.sma(symbol, window) for window in self.windows]
+                         for symbol in self.symbol_list}
+
     def _calculate_initial_bought(self):
         bought = {}
 
@@ -19,30 +24,35 @@ class SimpleMovingAverageRibbonStrategy(Strategy):
         return bought
 
     def calculate_signals(self, event):
-        if event.type == 'MARKET':
+        if event.type == EventType.MARKET:
             for symbol in self.symbol_list:
-                latest_closing_bar = self.bars.get_latest_bars(symbol, 1)
-                bars = []
-                for val in self.windows:
-                    bars.append(self.bars.get_latest_bars(symbol, val))
-
-                if len(bars[-1].index) < self.windows[-1]:
+                if self.bars.get_bar_count(symbol) < self.windows[-1]:
                     continue
 
-                bars_mean = []
-                for val in bars:
-                    bars_mean.append(val['CLOSING PRICE'].mean())
+                latest_closing_price = self.bars.get_latest_bar_value(symbol, 'CLOSING PRICE')
+                bars_mean = [average.value for average in self.averages[symbol]]
 
-                if self.should_buy(latest_closing_bar['CLOSING PRICE'][0], bars_mean) and not self.bought[symbol]:
-                    signal = SignalEvent(symbol, latest_closing_bar.iloc[-1].name, 'LONG')
+                if self.should_buy(latest_closing_price, bars_mean) and not self.bought[symbol]:
+                    signal = SignalEvent(symbol, self.bars.get_latest_bar_datetime(symbol), SignalType.LONG)
                     self.events.put(signal)
                     self.bought[symbol] = True
 
-                if self.should_sell(latest_closing_bar['CLOSING PRICE'][0], bars_mean) and self.bought[symbol]:
-                    signal = SignalEvent(symbol, latest_closing_bar.iloc[-1].name, 'EXIT')
+                if self.should_sell(latest_closing_price, bars_mean) and self.bought[symbol]:
+                    signal = SignalEvent(symbol, self.bars.get_latest_bar_datetime(symbol), SignalType.EXIT)
                     self.events.put(signal)
                     self.bought[symbol] = False
 
+    def calculate_positions(self, closes):
+        # Imported here, only vectorized backtests need it
+        from backtesting.vectorized import hold_states, rolling_mean
+
+        ready = np.arange(1, len(closes) + 1) >= self.windows[-1]
+        means = np.column_stack([rolling_mean(closes, window) for window in self.windows])
+        threshold = (len(self.windows) / 2) + 1
+        above = (closes[:, None] > means).sum(axis=1) >= threshold
+        below = (closes[:, None] < means).sum(axis=1) >= threshold
+        return hold_states(ready & above, ready & below)
+
     @staticmethod
     def should_buy(latest_closing_bar, bars_mean):
         i = 0
@@ -63,4 +73,4 @@ class SimpleMovingAverageRibbonStrategy(Strategy):
         if i >= (len(bars_mean) / 2) + 1:
             return True
         else:
-            return False
\ No newline at end of file
+            return False
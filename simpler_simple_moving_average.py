@@ -1,5 +1,7 @@
+import numpy as np
+
 from backtesting.strategy import Strategy
-from backtesting.event import SignalEvent
+from backtesting.event import SignalEvent, EventType, SignalType
 
 
 class SimplerSimpleMovingAverageStrategy(Strategy):
@@ -10,6 +12,8 @@ class SimplerSimpleMovingAverageStrategy(Strategy):
         self.symbol_list = self.bars.symbol_list
         self.bought = self._calculate_initial_bought()
 
+        self.averages = {symbol: self.bars.indicators.sma(symbol, self.window) for symbol in self.symbol_list}
+
     def _calculate_initial_bought(self):
         bought = {}
 
@@ -19,23 +23,28 @@ class SimplerSimpleMovingAverageStrategy(Strategy):
         return bought
 
     def calculate_signals(self, event):
-        if event.type == 'MARKET':
+        if event.type == EventType.MARKET:
             for symbol in self.symbol_list:
-                bars = self.bars.get_latest_bars(symbol, self.window)
-                latest_closing_price = self.bars.get_latest_bars(symbol, 1)['CLOSING PRICE'][0]
-
-                if len(bars.index) < self.window:
+                if self.bars.get_bar_count(symbol) < self.window:
                     continue
 
-                avg = bars['CLOSING PRICE'].mean()
+                latest_closing_price = self.bars.get_latest_bar_value(symbol, 'CLOSING PRICE')
+                avg = self.averages[symbol].value
 
                 if latest_closing_price > avg and not self.bought[symbol]:
-                    signal = SignalEvent(symbol, bars.iloc[-1].name, 'LONG')
+                    signal = SignalEvent(symbol, self.bars.get_latest_bar_datetime(symbol), SignalType.LONG)
                     self.events.put(signal)
                     self.bought[symbol] = True
 
                 if latest_closing_price < avg and self.bought[symbol]:
-                    signal = SignalEvent(symbol, bars.iloc[-1].name, 'EXIT')
+                    signal = SignalEvent(symbol, self.bars.get_latest_bar_datetime(symbol), SignalType.EXIT)
                     self.events.put(signal)
                     self.bought[symbol] = False
 
+    def calculate_positions(self, closes):
+        # Imported here, only vectorized backtests need it
+        from backtesting.vectorized import hold_states, rolling_mean
+
+        ready = np.arange(1, len(closes) + 1) >= self.window
+        avg = rolling_mean(closes, self.window)
+        return hold_states(ready & (closes > avg), ready & (closes < avg))
@@ -0,0 +1,256 @@
+"""
+Runs grids of strategy parameters, symbol sets and portfolios on a process
+pool and collects their summary statistics into one table. The market data
+is read once and shared with the workers through shared memory.
+
+The grid is described by a JSON file such as:
+
+    {
+        "start_date": "2017-01-01",
+        "strategies": [
+            {"name": "SimpleMovingAverage", "grid": {"long_window": [20, 40], "short_window": [100, 150]}},
+            {"name": "SMARibbon", "grid": {"windows": [[10, 20, 30, 40, 50, 60]]}}
+        ],
+        "symbol_sets": [["ASELS.E"], ["ASELS.E", "THYAO.E"]],
+        "portfolios": ["NaiveGreedy", {"name": "OptimizedGreedy", "params": {"rebalance": "monthly"}}]
+    }
+
+A portfolio is given by its name, or by its name and constructor arguments.
+With --artifacts the ledger and the orders of every run are also kept, as a
+compressed archive per run that backtesting.artifacts.load_run() opens. With
+--cache the runs already done on unchanged data are not run again.
+
+Usage:
+    python sweep.py sweep.json --output results.csv --artifacts runs/ --cache data/results/
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import shutil
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from backtesting.artifacts import write_run
+from backtesting.data import BistDataHandler, load_symbol_frames
+from backtesting.engine import Backtest, EventQueue
+from backtesting.execution import SimulatedExecutionHandler
+from backtesting.result_cache import ResultCache, data_digests, result_key
+from registry import PORTFOLIOS, STRATEGIES
+
+# Set in every worker process by _init_worker()
+_memory = None
+_frames = None
+_cache = None
+_digests = None
+
+
+class SharedFrames(object):
+    """
+    Packs the numeric columns of the symbol DataFrames into a single shared
+    memory block. Workers attach to the block by name and wrap it in
+    DataFrames without copying, instead of receiving the data with every task.
+    """
+
+    def __init__(self, frames):
+        self.layout = {}
+        arrays = []
+        offset = 0
+
+        for symbol, frame in frames.items():
+            frame = frame.select_dtypes(include=[np.number])
+            index = np.asarray(frame.index.values, dtype='datetime64[ns]').view(np.int64)
+            values = np.ascontiguousarray(frame.values, dtype=np.float64)
+
+            self.layout[symbol] = (offset, len(index), [str(column) for column in frame.columns], frame.index.name)
+            arrays.append((offset, index, values))
+            offset += index.nbytes + values.nbytes
+
+        self.memory = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+
+        for offset, index, values in arrays:
+            np.ndarray(index.shape, np.int64, self.memory.buf, offset)[:] = index
+            np.ndarray(values.shape, np.float64, self.memory.buf, offset + index.nbytes)[:] = values
+
+    @property
+    def descriptor(self):
+        """
+        The picklable name and layout that workers attach with.
+        """
+        return self.memory.name, self.layout
+
+    @staticmethod
+    def attach(descriptor):
+        """
+        Attaches to a shared block and returns it with the DataFrames
+        over it. The block must be kept open while the frames are used.
+        """
+        name, layout = descriptor
+        memory = shared_memory.SharedMemory(name=name)
+        frames = {}
+
+        for symbol, (offset, rows, columns, index_name) in layout.items():
+            index = np.ndarray((rows,), np.int64, memory.buf, offset)
+            values = np.ndarray((rows, len(columns)), np.float64, memory.buf, offset + index.nbytes)
+            index = pd.DatetimeIndex(index.view('datetime64[ns]'), name=index_name)
+            frames[symbol] = pd.DataFrame(values, index=index, columns=columns, copy=False)
+
+        return memory, frames
+
+    def close(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+def expand_grid(grid):
+    """
+    Yields every combination of a parameter grid, which maps
+    each constructor argument to a list of values.
+    """
+    names = sorted(grid)
+
+    for values in itertools.product(*(grid[name] for name in names)):
+        yield dict(zip(names, values))
+
+
+def run_backtest(frames, symbols, start_date, strategy_class, params, portfolio_class, portfolio_params=None,
+                 artifacts=None, metadata=None, cache=None, key=None):
+    """
+    Runs a single event-driven backtest on already loaded data and returns
+    the summary statistics of the portfolio and the statistics of its trades.
+    If an artifacts directory is given, the ledger and the orders of the run
+    are written to it, compressed and described by the metadata. If a
+    ResultCache is given, the run is stored in it under the key.
+    """
+    events = EventQueue()
+    bars = BistDataHandler(events, None, symbols, start_date, frames=frames)
+    strategy = strategy_class(bars, events, **params)
+    portfolio = portfolio_class(bars, events, start_date, **(portfolio_params or {}))
+    broker = SimulatedExecutionHandler(events, symbols)
+
+    Backtest(bars, events, strategy, portfolio, broker).run()
+
+    if artifacts is not None:
+        write_run(artifacts, bars, portfolio, broker, compress=True, include_bars=False, metadata=metadata)
+
+    summary = portfolio.output_summary_stats(broker.history)
+
+    if cache is not None:
+        cache.put(key, bars, portfolio, broker, {'summary': summary}, metadata)
+
+    return summary
+
+
+def _init_worker(descriptor, cache_dir=None, digests=None):
+    global _memory, _frames, _cache, _digests
+    _memory, _frames = SharedFrames.attach(descriptor)
+    _cache = None if cache_dir is None else ResultCache(cache_dir)
+    _digests = digests
+
+
+def _run_task(task):
+    strategy_name, params, symbols, (portfolio_name, portfolio_params), start_date, artifacts = task
+    row = {'strategy': strategy_name, 'params': json.dumps(params, sort_keys=True),
+           'symbols': ' '.join(symbols), 'portfolio': portfolio_name,
+           'portfolio_params': json.dumps(portfolio_params, sort_keys=True)}
+
+    if artifacts is not None:
+        row['artifacts'] = artifacts
+
+    # The same description of the run as main.py uses, so both share the cached results
+    config = {'symbols': symbols, 'start_date': str(start_date), 'end_date': None, 'strategy': strategy_name,
+              'params': params, 'portfolio': portfolio_name, 'portfolio_params': portfolio_params}
+    key = cached = None
+
+    if _cache is not None:
+        key = result_key({symbol: _digests[symbol] for symbol in symbols}, config)
+        cached = _cache.get(key, ['summary'])
+
+    try:
+        if cached is not None:
+            stats = cached.metadata['stats']['summary']
+            if artifacts is not None:
+                shutil.copytree(cached.directory, artifacts, dirs_exist_ok=True)
+        else:
+            stats = run_backtest(_frames, symbols, start_date, STRATEGIES[strategy_name], params,
+                                 PORTFOLIOS[portfolio_name], portfolio_params, artifacts, config, _cache, key)
+    except Exception as error:
+        row['error'] = repr(error)
+    else:
+        row.update(stats)
+
+    return row
+
+
+def run_sweep(csv_dir, strategies, symbol_sets, portfolios, start_date, processes=None, artifacts_dir=None,
+              cache_dir=None):
+    """
+    Runs every combination of strategy parameters, symbol sets and portfolios
+    on a process pool and returns their summary statistics as a DataFrame.
+    A failing combination is reported in the "error" column.
+
+    Parameters:
+    csv_dir - The directory of the symbol CSVs.
+    strategies - A list of (strategy name, parameter grid) pairs.
+    symbol_sets - A list of symbol lists.
+    portfolios - A list of portfolio names, or {"name", "params"} dictionaries.
+    start_date - The start date of the backtests.
+    processes - The number of worker processes, all cores by default.
+    artifacts_dir - The directory to keep the results of every run in, one subdirectory per run.
+    cache_dir - The directory of the ResultCache, which skips the runs already done on the same data.
+    """
+    symbols = sorted(set(itertools.chain.from_iterable(symbol_sets)))
+    portfolios = [(portfolio, {}) if isinstance(portfolio, str) else (portfolio['name'], portfolio.get('params', {}))
+                  for portfolio in portfolios]
+    tasks = [(name, params, list(symbol_set), portfolio, start_date)
+             for name, grid in strategies
+             for params in expand_grid(grid)
+             for symbol_set in symbol_sets
+             for portfolio in portfolios]
+    tasks = [task + (None if artifacts_dir is None else os.path.join(artifacts_dir, '{:06d}'.format(i)),)
+             for i, task in enumerate(tasks)]
+
+    processes = processes or os.cpu_count()
+    shared = SharedFrames(load_symbol_frames(csv_dir, symbols))
+    digests = None if cache_dir is None else data_digests(csv_dir, symbols)
+
+    try:
+        with ProcessPoolExecutor(processes, initializer=_init_worker,
+                                 initargs=(shared.descriptor, cache_dir, digests)) as executor:
+            chunksize = max(1, len(tasks) // (processes * 4))
+            rows = list(executor.map(_run_task, tasks, chunksize=chunksize))
+    finally:
+        shared.close()
+
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs a parameter sweep described by a JSON file.')
+    parser.add_argument('config', help='the JSON file describing the grid')
+    parser.add_argument('-o', '--output', default='sweep.csv', help='the CSV file to write the results to')
+    parser.add_argument('-p', '--processes', type=int, help='the number of worker processes')
+    parser.add_argument('-a', '--artifacts', help='the directory to keep the ledger and orders of every run in')
+    parser.add_argument('--cache', help='the directory of the cached results, to skip the runs already done')
+    args = parser.parse_args()
+
+    with open(args.config, 'r') as config_file:
+        config = json.load(config_file)
+
+    start_date = datetime.datetime.strptime(config.get('start_date', '2017-01-01'), '%Y-%m-%d').date()
+    strategies = [(strategy['name'], strategy['grid']) for strategy in config['strategies']]
+
+    results = run_sweep(config.get('csv_dir', os.getcwd() + '/data/bist/symbols/'), strategies,
+                        config['symbol_sets'], config.get('portfolios', ['NaiveGreedy']), start_date,
+                        args.processes, args.artifacts, args.cache)
+    results.to_csv(args.output, index=False)
+    print("Wrote {} results to: {}".format(len(results), args.output))
+
+
+if __name__ == "__main__":
+    main()
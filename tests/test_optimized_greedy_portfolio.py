@@ -0,0 +1,54 @@
+import datetime
+
+import numpy as np
+
+from backtesting.data import BistDataHandler
+from backtesting.engine import Backtest, EventQueue
+from backtesting.event import MarketEvent
+from backtesting.execution import SimulatedExecutionHandler
+from benchmarks.synthetic import generate_frames
+from optimized_greedy_portfolio import OptimizedGreedyPortfolio
+from simpler_simple_moving_average import SimplerSimpleMovingAverageStrategy
+
+
+def test_allocate_cash_does_not_exceed_remaining_cash():
+    cash = OptimizedGreedyPortfolio.allocate_cash(np.array([0.1, 0.9]), 20.0, np.array([80.0, 0.0]))
+
+    assert cash.tolist() == [0.0, 20.0]
+
+
+def test_allocate_cash_without_remaining_cash():
+    cash = OptimizedGreedyPortfolio.allocate_cash(np.array([0.5, 0.5]), -5.0, np.array([100.0, 0.0]))
+
+    assert cash.tolist() == [0.0, 0.0]
+
+
+def test_rebalance_keeps_symbol_cash_within_remaining_cash():
+    frames = generate_frames(symbols=8, years=3)
+    first_date = min(frame.index[0] for frame in frames.values())
+    # The optimizer needs a history of every symbol
+    frames = {symbol: frame for symbol, frame in frames.items() if frame.index[0] == first_date}
+    symbols = sorted(frames)
+    start_date = datetime.date(2016, 12, 1)
+    events = EventQueue()
+    bars = BistDataHandler(events, None, symbols, start_date, frames=frames)
+    strategy = SimplerSimpleMovingAverageStrategy(bars, events, 20)
+    portfolio = OptimizedGreedyPortfolio(bars, events, start_date, optimizer='max_sharpe', rebalance='monthly')
+    broker = SimulatedExecutionHandler(events, symbols)
+    backtest = Backtest(bars, events, strategy, portfolio, broker)
+    allocations = [len(portfolio.allocations)]
+
+    def check_allocation(event):
+        # Runs after the portfolio updated its allocation for the bar
+        if len(portfolio.allocations) == allocations[-1]:
+            return
+
+        allocations.append(len(portfolio.allocations))
+        remaining_cash = max(portfolio.current_holdings['remaining_cash'], 0.0)
+        assert portfolio.current_cash.min() >= 0.0
+        assert portfolio.current_cash.sum() <= remaining_cash * (1.0 + 1e-12)
+
+    backtest.register(MarketEvent, check_allocation)
+    backtest.run()
+
+    assert len(allocations) > 1
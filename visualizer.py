@@ -1,26 +1,133 @@
+"""
+Plots the closing prices of the symbols with markers at their buy and sell
+orders. Long series are downsampled to about one point per pixel, and when
+a path is given the chart is rendered to a file with the Agg backend,
+without pyplot or a display, which is fast enough to draw a chart for every
+result of a sweep.
+"""
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 
 
-def visualize(data, portfolio, orders, simulation=None):
-    directions = []
+def lttb(x, y, threshold):
+    """
+    Downsamples a series with the Largest-Triangle-Three-Buckets algorithm
+    of Steinarsson (2013), which keeps the first and the last points and,
+    from every bucket in between, the point forming the largest triangle
+    with the previously kept point and the average of the next bucket. This
+    keeps the peaks and troughs that a plain stride would drop.
 
-    for symbol in orders:
-        directions.append(pd.DataFrame(orders[symbol]).set_index('date')['direction'])
-        
-    orders_df = pd.DataFrame(directions).T.fillna('HOLD')
-    orders_df.columns = [symbol + '_ORDER' for symbol in orders.keys()]
-    df = pd.DataFrame(portfolio).drop('cash', axis=1).drop_duplicates(subset='datetime').set_index('datetime')
-    df = df.merge(orders_df, how='left', left_index=True, right_index=True).fillna('HOLD')
+    Parameters:
+    x - The x coordinates, increasing.
+    y - The y coordinates.
+    threshold - The number of points to keep.
 
-    fig = plt.figure(figsize=(16,8))
-    ax1 = fig.add_subplot(111,  ylabel='Value in ₺')
+    Returns:
+    The indices of the kept points.
+    """
+    n = len(x)
+
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # threshold - 2 buckets between the first and the last point, and the last point as a bucket of its own
+    edges = np.append(np.linspace(1, n - 1, threshold - 1).astype(np.int64), n)
+    sizes = np.diff(edges)
+    average_x = (np.add.reduceat(x, edges[:-1]) / sizes).tolist()
+    average_y = (np.add.reduceat(y, edges[:-1]) / sizes).tolist()
+
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    selected = 0
+
+    # NumPy calls cost more than scanning buckets of a few points in Python
+    small = n <= 16 * threshold
+    if small:
+        x, y = x.tolist(), y.tolist()
+
+    for i, (start, stop) in enumerate(zip(edges[:-2].tolist(), edges[1:-1].tolist())):
+        ax, ay = x[selected], y[selected]
+        dx, dy = ax - average_x[i + 1], average_y[i + 1] - ay
+
+        if small:
+            largest = -1.0
+            for j in range(start, stop):
+                area = abs(dx * (y[j] - ay) - dy * (ax - x[j]))
+                if area > largest:
+                    largest, selected = area, j
+        else:
+            area = np.abs(dx * (y[start:stop] - ay) - dy * (ax - x[start:stop]))
+            selected = start + int(area.argmax())
+
+        indices[i + 1] = selected
+
+    return indices
+
+
+def downsample(series, threshold):
+    """
+    Drops the missing values of a series and downsamples it to the threshold number of points.
+    """
+    series = series.dropna()
+    return series.iloc[lttb(series.index.asi8, series.values, threshold)]
+
+
+def order_markers(closes, orders, direction):
+    """
+    Returns the dates and the closing prices of the orders in a direction,
+    looked up in the index of the prices at once.
+    """
+    dates = pd.DatetimeIndex([order['date'] for order in orders if order['direction'] == direction])
+    positions = closes.index.get_indexer(dates)
+    positions = positions[positions >= 0]
+    return closes.index[positions], closes.values[positions]
+
+
+def visualize(data, orders, simulation=None, path=None, width=16, height=8, dpi=100):
+    """
+    Plots the closing prices and the orders of the symbols.
+
+    Parameters:
+    data - The bars of the symbols, as a DataFrame per symbol.
+    orders - The order history of the broker.
+    simulation - The simulated portfolios, if any.
+    path - The file to render the chart to, or None to show it in a window.
+    width, height - The size of the chart in inches.
+    dpi - The resolution of the chart, which with the width sets the number of points plotted per series.
+    """
+    if path is None:
+        import matplotlib.pyplot as plt
+
+        fig = plt.figure(figsize=(width, height), dpi=dpi)
+    else:
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        fig = Figure(figsize=(width, height), dpi=dpi)
+        FigureCanvasAgg(fig)
+
+    ax1 = fig.add_subplot(111, ylabel='Value in ₺')
+    points = int(width * dpi)
 
     for symbol in orders.keys():
-        column = symbol + '_ORDER'
-        data[symbol]['CLOSING PRICE'].plot(label=symbol[:-2])
-        ax1.plot(df[column].loc[df[column] == 'BUY'].index, data[symbol]['CLOSING PRICE'][df[column] == 'BUY'], '^', markersize=10, label=symbol[:-2] + ' Buy Order')
-        ax1.plot(df[column].loc[df[column] == 'SELL'].index, data[symbol]['CLOSING PRICE'][df[column] == 'SELL'], 'v', markersize=10, label=symbol[:-2] + ' Sell Order')
-            
-    ax1.legend()
-    plt.show()
+        closes = data[symbol]['CLOSING PRICE']
+        line = downsample(closes, points)
+        ax1.plot(line.index, line.values, label=symbol[:-2])
+
+        # Every order is marked, even where the line was downsampled
+        for direction, marker, name in (('BUY', '^', ' Buy Order'), ('SELL', 'v', ' Sell Order')):
+            dates, prices = order_markers(closes, orders[symbol], direction)
+            ax1.plot(dates, prices, marker, markersize=10, label=symbol[:-2] + name)
+
+    # A fixed location, searching for the best one is slow with many points
+    ax1.legend(loc='upper left')
+
+    if path is None:
+        plt.show()
+    else:
+        fig.savefig(path)
+
+    return fig